@@ -38,6 +38,14 @@ with app.app_context():
         # Create all tables
         db.create_all()
         logger.info("Database tables created successfully")
+
+        # Resume purges left unfinished by a previous run
+        from utils.purge import purge_worker
+        purge_worker.wake()
+
+        # Recheck uploaded file URLs not probed recently
+        from utils.url_health import url_prober
+        url_prober.wake()
     except Exception as e:
         logger.error(f"Error creating database tables: {str(e)}")
         logger.error(f"Database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
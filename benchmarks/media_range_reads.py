@@ -0,0 +1,149 @@
+"""
+Benchmark: concurrent byte-range reads of a local video
+
+Serves a video from a temporary static folder through a threaded WSGI server,
+once with Flask's static handler and once through the /media endpoint, and
+has several clients seek through it at random like video players scrubbing.
+Repeat views are measured too: the static handler has every view revalidated,
+/media files named by their hash are cached as immutable and not requested
+again.
+
+Run it under gunicorn (--server gunicorn, if installed) to have the ranges
+that run to the end of the file sent with sendfile(2).
+
+Usage:
+    python benchmarks/media_range_reads.py [--size-mb 64] [--clients 16] [--reads 50] [--chunk-kb 1024]
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.media_files import MediaServer, media_url
+
+VIDEO_NAME = 'f' * 64 + '.mp4'
+
+def make_app(static_folder):
+    app = Flask(__name__, static_folder=static_folder)
+    server = MediaServer()
+    server.x_accel_prefix = ''
+    app.add_url_rule('/media/<kind>/<path:name>', view_func=server.send)
+    return app, server
+
+def start_server(app, kind):
+    """Serve the app on a free port, with werkzeug or gunicorn"""
+    if kind == 'gunicorn':
+        from gunicorn.app.base import BaseApplication
+
+        class Standalone(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', '127.0.0.1:8765')
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('threads', 32)
+                self.cfg.set('workers', 1)
+
+            def load(self):
+                return app
+
+        threading.Thread(target=Standalone().run, daemon=True).start()
+        time.sleep(2)
+        return 'http://127.0.0.1:8765'
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def scrub(url, size, reads, chunk):
+    """Read random ranges like a player seeking through the video, returns latencies"""
+    session = requests.Session()
+    latencies = []
+    for _ in range(reads):
+        start = random.randrange(0, size - chunk)
+        # Players mostly ask for everything from the seek position and stop reading early
+        header = f'bytes={start}-' if random.random() < 0.5 else f'bytes={start}-{start + chunk - 1}'
+        began = time.perf_counter()
+        with session.get(url, headers={'Range': header}, stream=True, timeout=60) as response:
+            assert response.status_code == 206, response.status_code
+            received = 0
+            for block in response.iter_content(64 * 1024):
+                received += len(block)
+                if received >= chunk:
+                    break
+        latencies.append(time.perf_counter() - began)
+    return latencies
+
+def repeat_views(url, views):
+    """Requests made and bytes transferred for repeat views by a browser with a cache"""
+    session = requests.Session()
+    response = session.get(url, timeout=60)
+    etag = response.headers.get('ETag')
+    immutable = 'immutable' in response.headers.get('Cache-Control', '')
+    made, transferred = 1, len(response.content)
+    for _ in range(views - 1):
+        if immutable:
+            continue
+        response = session.get(url, headers={'If-None-Match': etag} if etag else {}, timeout=60)
+        made += 1
+        transferred += len(response.content)
+    return made, transferred
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--reads', type=int, default=50)
+    parser.add_argument('--chunk-kb', type=int, default=1024)
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug')
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+    chunk = args.chunk_kb * 1024
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        static_folder = os.path.join(tmpdir, 'static')
+        videos = os.path.join(static_folder, 'uploads', 'videos')
+        os.makedirs(videos)
+        with open(os.path.join(videos, VIDEO_NAME), 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                f.write(block)
+
+        app, media = make_app(static_folder)
+        base = start_server(app, args.server)
+        urls = {
+            'static': f'{base}/static/uploads/videos/{VIDEO_NAME}',
+            'media': f'{base}{media_url("videos", VIDEO_NAME)}'
+        }
+
+        print(f"{args.clients} clients x {args.reads} range reads of {args.chunk_kb}KB "
+              f"from a {args.size_mb}MB video ({args.server})")
+        for name, url in urls.items():
+            began = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as executor:
+                jobs = [executor.submit(scrub, url, size, args.reads, chunk) for _ in range(args.clients)]
+                latencies = sorted(l for job in jobs for l in job.result())
+            elapsed = time.perf_counter() - began
+
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            made, transferred = repeat_views(url, 10)
+            print(f"{name:>8}: {len(latencies) / elapsed:7.1f} reads/s, "
+                  f"p50 {statistics.median(latencies) * 1000:6.1f} ms, p95 {p95 * 1000:6.1f} ms, "
+                  f"10 views: {made} requests, {transferred / 1024 / 1024:.1f} MB")
+
+        print(f"{media.stats['zero_copy']} of {media.stats['requests']} /media responses went through wsgi.file_wrapper")
+
+if __name__ == '__main__':
+    main()
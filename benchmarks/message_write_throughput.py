@@ -0,0 +1,111 @@
+"""
+Benchmark: sustained message writes per second on a single SQLite file
+
+Compares one commit per message (the previous send path) against the
+group-commit MessageWriter, with several threads sending concurrently.
+
+Usage:
+    python benchmarks/message_write_throughput.py [--threads 8] [--messages 2000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database import db
+from models import User, Conversation, Message
+from utils.message_writer import MessageWriter, KIND_MESSAGE
+
+def create_benchmark_app(db_path):
+    """Create a minimal app with one conversation to write into"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            User(username='sender', email='sender@example.com'),
+            User(username='recipient', email='recipient@example.com')
+        ])
+        db.session.add(Conversation(user1_id=1, user2_id=2))
+        db.session.commit()
+
+    return app
+
+def run_threads(app, threads, messages, send_one):
+    """Split messages across threads and return messages per second"""
+    per_thread = messages // threads
+
+    def worker():
+        with app.app_context():
+            for i in range(per_thread):
+                send_one(i)
+            db.session.remove()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return (per_thread * threads) / elapsed
+
+def bench_commit_per_message(app, threads, messages):
+    def send_one(i):
+        message = Message(conversation_id=1, sender_id=1, recipient_id=2, content=f'message {i}')
+        db.session.add(message)
+        db.session.commit()
+        Conversation.query.filter_by(id=1).update({'last_message_at': message.created_at})
+        db.session.commit()
+
+    return run_threads(app, threads, messages, send_one)
+
+def bench_group_commit(app, threads, messages):
+    writer = MessageWriter()
+    writer.enabled = True
+    writer.init_app(app)
+
+    def send_one(i):
+        pending = writer.submit(KIND_MESSAGE, {
+            'conversation_id': 1,
+            'sender_id': 1,
+            'recipient_id': 2,
+            'content': f'message {i}'
+        }, touch={'conversation_id': 1})
+        pending.wait(timeout=30)
+
+    rate = run_threads(app, threads, messages, send_one)
+    return rate, writer.stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    for name in ('commit per message', 'group commit'):
+        fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            app = create_benchmark_app(db_path)
+            if name == 'group commit':
+                rate, stats = bench_group_commit(app, args.threads, args.messages)
+                print(f"{name:>20}: {rate:8.0f} msg/s ({stats['batches_committed']} commits)")
+            else:
+                rate = bench_commit_per_message(app, args.threads, args.messages)
+                print(f"{name:>20}: {rate:8.0f} msg/s")
+        finally:
+            os.remove(db_path)
+
+if __name__ == '__main__':
+    main()
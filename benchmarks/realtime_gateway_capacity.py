@@ -0,0 +1,134 @@
+"""
+Benchmark: idle connection capacity and event latency of a Socket.IO server
+
+Opens many authenticated websocket connections to a running server, reports
+the server's memory and thread count while they sit idle, then measures the
+acknowledgement round trip of typing events from a subset of them. Run it once
+against the Flask app and once against the realtime gateway to compare.
+
+    python main.py                        # threading server on :5000
+    python realtime_gateway.py            # asyncio gateway on :5001
+
+Usage:
+    python benchmarks/realtime_gateway_capacity.py --url http://localhost:5000 \\
+        --pid <server pid> --cookie "session=..." --conversation 1 \\
+        [--connections 2000] [--events 2000] [--senders 50]
+
+Requires the aiohttp extra of python-socketio for the async client.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import socketio
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def read_process_status(pid):
+    """Get resident memory (MB) and thread count of a process from /proc"""
+    if not pid:
+        return None, None
+
+    rss_mb, threads = None, None
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                rss_mb = int(line.split()[1]) / 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss_mb, threads
+
+async def open_client(url, cookie):
+    """Connect and authenticate one client"""
+    client = socketio.AsyncClient(reconnection=False)
+    authenticated = asyncio.get_running_loop().create_future()
+
+    @client.on('auth_response')
+    async def on_auth_response(data):
+        if not authenticated.done():
+            authenticated.set_result(data.get('status') == 'success')
+
+    await client.connect(url, headers={'Cookie': cookie}, transports=['websocket'])
+    await client.emit('auth', {})
+    if not await asyncio.wait_for(authenticated, 30):
+        raise RuntimeError('Authentication failed, check --cookie')
+    return client
+
+async def open_connections(url, cookie, count, concurrency=100):
+    """Open count clients, at most concurrency at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    clients, failures = [], 0
+
+    async def open_one():
+        nonlocal failures
+        async with semaphore:
+            try:
+                clients.append(await open_client(url, cookie))
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return clients, failures, time.perf_counter() - start
+
+async def measure_latency(clients, conversation_id, events):
+    """Send typing events spread over the clients and collect ack round trips in ms"""
+    latencies = []
+
+    async def sender(client, n):
+        for _ in range(n):
+            start = time.perf_counter()
+            await client.call('typing', {'conversation_id': conversation_id}, timeout=30)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    per_client = max(events // len(clients), 1)
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(client, per_client) for client in clients))
+    return latencies, time.perf_counter() - start
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+async def run(args):
+    rss_before, threads_before = read_process_status(args.pid)
+    clients, failures, elapsed = await open_connections(args.url, args.cookie, args.connections)
+    print(f"connections: {len(clients)} open, {failures} failed in {elapsed:.1f}s")
+
+    # Let the server settle with every connection idle
+    await asyncio.sleep(args.idle)
+    rss_after, threads_after = read_process_status(args.pid)
+    if rss_after is not None:
+        per_connection = (rss_after - rss_before) * 1024 / max(len(clients), 1)
+        print(f"server memory: {rss_before:.0f} -> {rss_after:.0f} MB ({per_connection:.1f} KB/connection)")
+        print(f"server threads: {threads_before} -> {threads_after}")
+
+    if clients:
+        latencies, elapsed = await measure_latency(clients[:args.senders], args.conversation, args.events)
+        print(f"typing ack latency over {len(latencies)} events: "
+              f"p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, "
+              f"p99 {percentile(latencies, 99):.1f} ms, mean {statistics.mean(latencies):.1f} ms "
+              f"({len(latencies) / elapsed:.0f} events/s)")
+
+    await asyncio.gather(*(client.disconnect() for client in clients))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--cookie', required=True, help='Session cookie of a logged in user')
+    parser.add_argument('--conversation', type=int, required=True, help='Conversation the user belongs to')
+    parser.add_argument('--pid', type=int, default=None, help='Server process to sample memory and threads from')
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--idle', type=float, default=5, help='Seconds to wait before sampling the server')
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: bytes on the wire and encode CPU of socket event broadcasts
+
+Replays a chat-heavy stream of new_message events (a few senders, many
+recipients) and compares the Socket.IO packets sent to each recipient with
+JSON payloads against compact MessagePack payloads with interned profiles.
+
+Usage:
+    python benchmarks/socket_payload_size.py [--messages 2000] [--recipients 20] [--senders 5]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+from socketio import packet
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.compact_events import CompactEncoder
+
+def make_messages(count, senders):
+    """Direct messages as utils/direct_messages.py emits them"""
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    return [{
+        'id': i + 1,
+        'conversation_id': 1 + i % senders,
+        'sender_id': 1 + i % senders,
+        'sender_username': f'user_{1 + i % senders}',
+        'sender_profile_pic': f'/static/uploads/photos/profile_{1 + i % senders}_2f9c1e6a4b.jpg',
+        'recipient_id': 100,
+        'content': f'Message number {i} in a fairly ordinary chat conversation',
+        'created_at': (start + timedelta(seconds=i)).isoformat(),
+        'read': False,
+        'seq': i + 1,
+        'epoch': '5f3a9c1d'
+    } for i in range(count)]
+
+def wire_size(encoded):
+    """Bytes of an encoded packet, including binary attachments"""
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+def bench_json(messages, recipients):
+    """One JSON packet per broadcast, shared by every recipient"""
+    total_bytes = 0
+    start = time.perf_counter()
+    for message in messages:
+        encoded = packet.Packet(packet.EVENT, data=['new_message', message]).encode()
+        total_bytes += wire_size(encoded) * recipients
+    return total_bytes, time.perf_counter() - start
+
+def bench_compact(messages, recipients):
+    """Body encoded once per broadcast, one binary packet per distinct payload"""
+    encoder = CompactEncoder(enabled=True, intern_size=256)
+    sids = [f'sid{i}' for i in range(recipients)]
+    for sid in sids:
+        encoder.enable(sid)
+
+    total_bytes = 0
+    start = time.perf_counter()
+    for message in messages:
+        body, profile = encoder.encode(message)
+
+        # Recipients that already know the sender share one packet, as in OutboundGuard
+        for payload, group in encoder.group_payloads(sids, body, profile):
+            encoded = packet.Packet(packet.EVENT, data=['new_message', payload]).encode()
+            total_bytes += wire_size(encoded) * len(group)
+    return total_bytes, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--recipients', type=int, default=20)
+    parser.add_argument('--senders', type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, args.senders)
+    results = {
+        'json': bench_json(messages, args.recipients),
+        'compact': bench_compact(messages, args.recipients)
+    }
+
+    for name, (total_bytes, elapsed) in results.items():
+        per_message = total_bytes / (args.messages * args.recipients)
+        per_broadcast_us = elapsed / args.messages * 1e6
+        print(f"{name:>8}: {per_message:6.1f} bytes/recipient, {per_broadcast_us:7.1f} us encode per broadcast "
+              f"to {args.recipients} recipients")
+
+    ratio = results['compact'][0] / results['json'][0]
+    print(f"compact payloads are {ratio:.0%} of JSON on the wire")
+
+if __name__ == '__main__':
+    main()
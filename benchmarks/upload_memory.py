@@ -0,0 +1,114 @@
+"""
+Benchmark: peak memory of concurrent uploads to several backends
+
+Uploads a large video concurrently to a local HTTP server standing in for the
+hosting services, once the way the uploaders used to (request file read into
+memory and encoded by requests) and once streamed from a spool file. Each mode
+runs in its own process so the peak RSS figures are independent.
+
+Usage:
+    python benchmarks/upload_memory.py [--size-mb 16] [--uploads 4] [--services 3]
+"""
+import os
+import sys
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from werkzeug.datastructures import FileStorage
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.upload_spool import spool_upload, post_multipart
+
+class DrainHandler(BaseHTTPRequestHandler):
+    """Reads and discards the request body, like a hosting service would store it"""
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'https://example.com/file')
+
+    def log_message(self, *args):
+        pass
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def make_request_file(size):
+    """A request file as werkzeug hands it over: spooled to a temp file when large"""
+    stream = tempfile.TemporaryFile()
+    stream.write(b'\x00\x00\x00\x18ftypmp42')
+    chunk = os.urandom(1024 * 1024)
+    while stream.tell() < size:
+        stream.write(chunk)
+    stream.truncate(size)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename='video.mp4', content_type='video/mp4')
+
+def run(mode, size, uploads, services):
+    """Upload in the given mode and print the peak RSS of this process"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DrainHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/upload'
+    files = [make_request_file(size) for _ in range(uploads)]
+    baseline = peak_rss_mb()
+
+    def in_memory(file):
+        # One copy of the body per service, plus the encoded multipart body
+        file.seek(0)
+        data = file.read()
+        requests.post(url, files={'file': (file.filename, BytesIO(data), file.content_type)}, timeout=60)
+
+    def streamed(spool):
+        post_multipart(url, spool, 'file', timeout=60)
+
+    with ThreadPoolExecutor(max_workers=uploads * services) as executor:
+        if mode == 'memory':
+            jobs = [executor.submit(in_memory, file) for file in files for _ in range(services)]
+        else:
+            spools = [spool_upload(file) for file in files]
+            jobs = [executor.submit(streamed, spool) for spool in spools for _ in range(services)]
+        for job in jobs:
+            job.result()
+
+    if mode == 'spool':
+        for spool in spools:
+            spool.release()
+
+    print(f"{peak_rss_mb() - baseline:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--uploads', type=int, default=4)
+    parser.add_argument('--services', type=int, default=3)
+    parser.add_argument('--mode', choices=['memory', 'spool'])
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    if args.mode:
+        run(args.mode, size, args.uploads, args.services)
+        return
+
+    print(f"{args.uploads} uploads of {args.size_mb}MB to {args.services} services at once")
+    for mode in ('memory', 'spool'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--size-mb', str(args.size_mb),
+             '--uploads', str(args.uploads), '--services', str(args.services)],
+            capture_output=True, text=True, check=True
+        )
+        print(f"{mode:>8}: peak RSS grew by {float(output.stdout.strip().splitlines()[-1]):7.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -71,11 +71,27 @@ def get_default_config():
             ],
             "preferred_services": ["imgur", "catbox"],
             "rate_limit_seconds": 1,
+            "rate_limit_burst": 1,
             "max_retries": 3,
             "retry_delay_seconds": 2,
             "allowed_image_extensions": ["jpg", "jpeg", "png", "gif"],
             "allowed_video_extensions": ["mp4", "webm", "ogg"],
-            "max_upload_size_bytes": 16777216
+            "max_upload_size_bytes": 16777216,
+            "max_parallel_uploads": 8,
+            "first_success_timeout_seconds": 30,
+            "spool_dir": "",
+            "chunk_size_bytes": 4194304,
+            "max_chunked_upload_size_bytes": 1073741824,
+            "session_ttl_seconds": 86400,
+            "url_health_ttl_seconds": 600,
+            "url_health_negative_ttl_seconds": 60,
+            "url_probe_timeout_seconds": 5,
+            "url_probe_interval_seconds": 300,
+            "url_probe_batch_size": 100,
+            "health_window": 50,
+            "breaker_failure_threshold": 3,
+            "breaker_cooldown_seconds": 60,
+            "endpoint_cache_ttl_seconds": 3600
         },
         "firebase": {
             "config_path": "static/js/firebase-config.js",
@@ -88,7 +104,63 @@ def get_default_config():
             "read_receipts_enabled": True,
             "typing_indicators_enabled": True,
             "message_unsend_timeout_minutes": 10,
-            "emoji_shortcuts_enabled": True
+            "emoji_shortcuts_enabled": True,
+            "group_commit_enabled": True,
+            "group_commit_interval_ms": 5,
+            "group_commit_max_batch": 200,
+            "typing_throttle_ms": 2000,
+            "typing_timeout_ms": 5000,
+            "membership_cache_size": 4096,
+            "membership_cache_ttl": 60,
+            "sync_log_retention_days": 30
+        },
+        "realtime": {
+            "replay_buffer_size": 100,
+            "replay_max_users": 10000,
+            "replay_max_age_seconds": 300,
+            "outbound_soft_limit": 64,
+            "outbound_hard_limit": 512,
+            "outbound_flush_interval_ms": 500,
+            "gateway_enabled": False,
+            "gateway_url": "",
+            "gateway_port": 5001,
+            "gateway_socket_path": "instance/realtime_gateway.sock",
+            "gateway_ipc_workers": 8,
+            "message_bus": "",
+            "bus_path": "instance/socketio_bus.db",
+            "bus_poll_interval_ms": 20,
+            "bus_retention_seconds": 60,
+            "compact_encoding_enabled": True,
+            "compact_intern_size": 256
+        },
+        "maintenance": {
+            "purge_batch_size": 1000,
+            "purge_batch_pause_ms": 10,
+            "purge_poll_interval_seconds": 60,
+            "storage_gc_interval_seconds": 86400
+        },
+        "media": {
+            "derivative_widths": [80, 160, 320, 640, 1280],
+            "derivative_format": "webp",
+            "derivative_quality": 80,
+            "derivative_workers": 2,
+            "device_pixel_ratio": 2,
+            "derivative_index_size": 4096,
+            "derivative_miss_ttl_seconds": 30,
+            "placeholder_width": 16,
+            "placeholder_quality": 50,
+            "cache_max_age_seconds": 86400,
+            "x_accel_prefix": ""
+        },
+        "storage": {
+            "local_root": "",
+            "shard_depth": 2,
+            "gc_grace_seconds": 86400,
+            "external_backends": []
+        },
+        "accounts": {
+            "uid_block_size": 1000,
+            "uid_backfill_batch_size": 10000
         },
         "development": {
             "debug_enabled": True,
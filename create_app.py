@@ -80,6 +80,34 @@ def create_app():
     from utils.websocket import init_socketio
     init_socketio(app)
 
+    # Initialize the group-commit message writer
+    from utils.message_writer import init_message_writer
+    init_message_writer(app)
+
+    # Initialize the background purge worker for deleted posts and chats
+    from utils.purge import init_purge_worker
+    init_purge_worker(app)
+
+    # Initialize the background prober of uploaded file URLs
+    from utils.url_health import init_url_prober
+    init_url_prober(app)
+
+    # Resolve the local object store holding uploads no external host took
+    from utils.storage import init_local_store
+    init_local_store(app)
+
+    # Initialize the worker pool rendering resized copies of uploaded images
+    from utils.image_derivatives import init_image_pipeline
+    init_image_pipeline(app)
+
+    # Track background uploads once the request that started them is over
+    from utils.upload import init_upload_tracking
+    init_upload_tracking(app)
+
+    # Open the IPC channel for the standalone realtime gateway
+    from utils.gateway_ipc import init_gateway_bridge
+    init_gateway_bridge(app)
+
     # Register custom Jinja2 filters
     from utils.filters import register_filters
     register_filters(app)
@@ -94,6 +122,7 @@ def create_app():
     from routes.profile import profile_bp
     from routes.chat import chat_bp
     from routes.test import test_bp
+    from routes.media import media_bp
 
     # Import route modules to register routes with blueprints
     # Auth routes
@@ -115,6 +144,9 @@ def create_app():
     import routes.story.create
     import routes.story.view
 
+    # Media routes
+    import routes.media.files
+
     # Test routes
     import routes.test.notifications
     import routes.test.upload
@@ -128,6 +160,7 @@ def create_app():
     import routes.api.search
     import routes.api.stories
     import routes.api.uploads
+    import routes.api.realtime
 
     # Register all blueprints
     app.register_blueprint(auth_bp)
@@ -139,6 +172,7 @@ def create_app():
     app.register_blueprint(profile_bp)
     app.register_blueprint(chat_bp)
     app.register_blueprint(test_bp)
+    app.register_blueprint(media_bp)
 
     # No Firebase configuration is injected into templates
     # We're using server-side authentication only
@@ -151,6 +185,15 @@ def create_app():
             'firebase_config': None
         }
 
+    @app.context_processor
+    def inject_realtime_config():
+        """
+        Tell the client where to open its Socket.IO connection
+        """
+        return {
+            'realtime_url': get_config('realtime.gateway_url', '')
+        }
+
     @app.before_request
     def before_request():
         # Log session state
@@ -0,0 +1,44 @@
+"""
+Migration script to add the (chat_id, id) index used by chat history paging
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+import sqlite3
+
+def add_chat_message_index():
+    """
+    Add the ix_chat_message_chat_id_id index to the chat_message table
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            print("Creating ix_chat_message_chat_id_id index...")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_chat_message_chat_id_id ON chat_message (chat_id, id)"
+            )
+            conn.commit()
+            print("Index created successfully")
+        except Exception as e:
+            print(f"Error creating index: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    add_chat_message_index()
@@ -0,0 +1,94 @@
+"""
+Migration script to key conversations by their canonical (low, high) user pair
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+import sqlite3
+
+def add_conversation_pair():
+    """
+    Add low_user_id/high_user_id to the conversation table, merge duplicate
+    conversations between the same users and add the unique pair index
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            # Check which columns already exist
+            cursor.execute("PRAGMA table_info(conversation)")
+            column_names = [column[1] for column in cursor.fetchall()]
+
+            for column in ('low_user_id', 'high_user_id'):
+                if column not in column_names:
+                    print(f"Adding {column} column to conversation table...")
+                    cursor.execute(f"ALTER TABLE conversation ADD COLUMN {column} INTEGER REFERENCES user (id)")
+
+            # Backfill the canonical pair
+            cursor.execute("""
+                UPDATE conversation
+                SET low_user_id = MIN(user1_id, user2_id),
+                    high_user_id = MAX(user1_id, user2_id)
+                WHERE low_user_id IS NULL OR high_user_id IS NULL
+            """)
+
+            # Merge duplicate conversations into the oldest one for each pair
+            cursor.execute("""
+                SELECT low_user_id, high_user_id, MIN(id), COUNT(*)
+                FROM conversation
+                GROUP BY low_user_id, high_user_id
+                HAVING COUNT(*) > 1
+            """)
+            duplicates = cursor.fetchall()
+            print(f"Found {len(duplicates)} user pairs with duplicate conversations")
+
+            for low_user_id, high_user_id, keep_id, count in duplicates:
+                cursor.execute("""
+                    UPDATE message SET conversation_id = ?
+                    WHERE conversation_id IN (
+                        SELECT id FROM conversation
+                        WHERE low_user_id = ? AND high_user_id = ? AND id != ?
+                    )
+                """, (keep_id, low_user_id, high_user_id, keep_id))
+                cursor.execute("""
+                    UPDATE conversation SET last_message_at = (
+                        SELECT MAX(last_message_at) FROM conversation
+                        WHERE low_user_id = ? AND high_user_id = ?
+                    )
+                    WHERE id = ?
+                """, (low_user_id, high_user_id, keep_id))
+                cursor.execute("""
+                    DELETE FROM conversation
+                    WHERE low_user_id = ? AND high_user_id = ? AND id != ?
+                """, (low_user_id, high_user_id, keep_id))
+                print(f"Merged {count} conversations between users {low_user_id} and {high_user_id} into {keep_id}")
+
+            print("Creating unique_conversation_pair index...")
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS unique_conversation_pair
+                ON conversation (low_user_id, high_user_id)
+            """)
+            conn.commit()
+            print("Conversation pairs migrated successfully")
+        except Exception as e:
+            print(f"Error migrating conversation pairs: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    add_conversation_pair()
@@ -0,0 +1,76 @@
+"""
+Migration script to add the content_hash column used to deduplicate uploads
+"""
+import sys
+import os
+import hashlib
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+import sqlite3
+
+def add_file_upload_content_hash():
+    """
+    Add the indexed content_hash column to the file_upload table and hash the local files
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            # Check if the content_hash column already exists
+            cursor.execute("PRAGMA table_info(file_upload)")
+            column_names = [column[1] for column in cursor.fetchall()]
+
+            if 'content_hash' not in column_names:
+                print("Adding content_hash column to file_upload table...")
+                cursor.execute("ALTER TABLE file_upload ADD COLUMN content_hash VARCHAR(64)")
+                print("content_hash column added successfully")
+            else:
+                print("content_hash column already exists")
+
+            print("Creating ix_file_upload_content_hash index...")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_file_upload_content_hash ON file_upload (content_hash)"
+            )
+            conn.commit()
+
+            # Files stored locally can be hashed now, external ones are hashed when uploaded again
+            cursor.execute(
+                "SELECT id, primary_url FROM file_upload WHERE content_hash IS NULL "
+                "AND primary_url NOT LIKE 'http://%' AND primary_url NOT LIKE 'https://%'"
+            )
+            hashed = 0
+            for upload_id, url in cursor.fetchall():
+                path = os.path.join(app.static_folder, url.lstrip('/'))
+                if not os.path.exists(path):
+                    continue
+
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        digest.update(chunk)
+                cursor.execute("UPDATE file_upload SET content_hash = ? WHERE id = ?", (digest.hexdigest(), upload_id))
+                hashed += 1
+
+            conn.commit()
+            print(f"Hashed {hashed} local files")
+        except Exception as e:
+            print(f"Error adding content_hash column: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    add_file_upload_content_hash()
@@ -0,0 +1,55 @@
+"""
+Migration script to add the derivatives column and the primary_url index used to serve resized images
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+import sqlite3
+
+def add_file_upload_derivatives():
+    """
+    Add the derivatives column and the ix_file_upload_primary_url index to the file_upload table
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            # Check if the derivatives column already exists
+            cursor.execute("PRAGMA table_info(file_upload)")
+            column_names = [column[1] for column in cursor.fetchall()]
+
+            if 'derivatives' not in column_names:
+                print("Adding derivatives column to file_upload table...")
+                cursor.execute("ALTER TABLE file_upload ADD COLUMN derivatives TEXT")
+                print("derivatives column added successfully")
+            else:
+                print("derivatives column already exists")
+
+            print("Creating ix_file_upload_primary_url index...")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_file_upload_primary_url ON file_upload (primary_url)"
+            )
+            conn.commit()
+            print("Index created successfully")
+        except Exception as e:
+            print(f"Error adding derivatives column: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    add_file_upload_derivatives()
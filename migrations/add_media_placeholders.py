@@ -0,0 +1,82 @@
+"""
+Migration script to add the placeholder columns holding the inline thumbnails of images
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+from utils.image_derivatives import make_placeholder
+import sqlite3
+
+# Tables that get a placeholder column
+PLACEHOLDER_TABLES = ['file_upload', 'post_media', 'story']
+
+def add_media_placeholders():
+    """
+    Add the placeholder column to file_upload, post_media and story, and fill it in for local images
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            for table in PLACEHOLDER_TABLES:
+                # Check if the placeholder column already exists
+                cursor.execute(f"PRAGMA table_info({table})")
+                column_names = [column[1] for column in cursor.fetchall()]
+
+                if 'placeholder' not in column_names:
+                    print(f"Adding placeholder column to {table} table...")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN placeholder TEXT")
+                    print("placeholder column added successfully")
+                else:
+                    print(f"placeholder column already exists in {table}")
+            conn.commit()
+
+            # Images stored locally can be rendered now, external ones get a placeholder when uploaded again
+            cursor.execute(
+                "SELECT id, primary_url FROM file_upload WHERE placeholder IS NULL AND media_type = 'image' "
+                "AND primary_url NOT LIKE 'http://%' AND primary_url NOT LIKE 'https://%'"
+            )
+            rendered = 0
+            for upload_id, url in cursor.fetchall():
+                path = os.path.join(app.static_folder, url.lstrip('/'))
+                if not os.path.exists(path):
+                    continue
+
+                placeholder = make_placeholder(path)
+                if placeholder:
+                    cursor.execute("UPDATE file_upload SET placeholder = ? WHERE id = ?", (placeholder, upload_id))
+                    rendered += 1
+            print(f"Rendered {rendered} placeholders")
+
+            # Copy them to the posts and stories showing these images
+            for table in ('post_media', 'story'):
+                cursor.execute(
+                    f"UPDATE {table} SET placeholder = (SELECT placeholder FROM file_upload "
+                    f"WHERE file_upload.primary_url = {table}.media_url) WHERE placeholder IS NULL "
+                    f"AND media_url IN (SELECT primary_url FROM file_upload WHERE placeholder IS NOT NULL)"
+                )
+                print(f"Filled in placeholders of {cursor.rowcount} {table} rows")
+
+            conn.commit()
+        except Exception as e:
+            print(f"Error adding placeholder columns: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    add_media_placeholders()
@@ -7,9 +7,8 @@ import os
 # Add the parent directory to the path so we can import from the project
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import db
 from models import User
-from utils.uid_generator import generate_unique_uid
+from utils.uid_generator import assign_uids_to_existing_users
 from create_app import create_app
 
 def assign_uids():
@@ -18,22 +17,15 @@ def assign_uids():
     """
     # Create app context
     app = create_app()
-    
+
     with app.app_context():
-        # Get all users without a UID
-        users_without_uid = User.query.filter(User.uid.is_(None)).all()
-        
-        print(f"Found {len(users_without_uid)} users without a UID")
-        
-        count = 0
-        for user in users_without_uid:
-            user.uid = generate_unique_uid()
-            count += 1
-            print(f"Assigned UID {user.uid} to user {user.username} (ID: {user.id})")
-        
-        # Commit changes
-        db.session.commit()
-        
+        total = User.query.filter(User.uid.is_(None)).count()
+
+        print(f"Found {total} users without a UID")
+
+        # Batches are committed as they go, so an interrupted run can simply be restarted
+        count = assign_uids_to_existing_users(progress=lambda done: print(f"Assigned UIDs to {done}/{total} users"))
+
         print(f"Successfully assigned UIDs to {count} users")
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+Migration script to move local uploads from the flat photo and video folders into the object store
+"""
+import sys
+import os
+import hashlib
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+from utils.media_files import local_path
+from utils.storage import local_store
+from utils.upload_spool import sniff_type
+import sqlite3
+
+# Columns holding a single media URL
+URL_COLUMNS = [
+    ('file_upload', 'primary_url'),
+    ('post_media', 'media_url'),
+    ('story', 'media_url'),
+    ('chat_message', 'media_url'),
+    ('user', 'profile_pic'),
+    ('user', 'cover_pic')
+]
+
+def move_uploads_to_object_store():
+    """
+    Copy every local upload into the sharded object store, point its URLs at it and remove the old file
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+        print(f"Object store at: {local_store.root}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                "SELECT id, primary_url FROM file_upload "
+                "WHERE primary_url NOT LIKE 'http://%' AND primary_url NOT LIKE 'https://%' "
+                "AND primary_url NOT LIKE '/media/objects/%'"
+            )
+            moved = 0
+            for upload_id, url in cursor.fetchall():
+                path = local_path(url, app.static_folder)
+                if not path or not os.path.isfile(path):
+                    print(f"Skipping upload {upload_id}: {url} not found")
+                    continue
+
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    head = f.read(12)
+                    f.seek(0)
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        digest.update(chunk)
+                mime_type = sniff_type(head) or 'application/octet-stream'
+
+                new_url = local_store.store_file(path, digest.hexdigest(), mime_type)
+                for table, column in URL_COLUMNS:
+                    cursor.execute(f'UPDATE "{table}" SET "{column}" = ? WHERE "{column}" = ?', (new_url, url))
+                cursor.execute(
+                    "UPDATE file_upload SET content_hash = ? WHERE id = ? AND content_hash IS NULL",
+                    (digest.hexdigest(), upload_id)
+                )
+                conn.commit()
+
+                # The database no longer points at the old file
+                os.remove(path)
+                moved += 1
+
+            print(f"Moved {moved} uploads into the object store")
+        except Exception as e:
+            print(f"Error moving uploads: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    move_uploads_to_object_store()
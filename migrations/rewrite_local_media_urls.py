@@ -0,0 +1,71 @@
+"""
+Migration script to point local upload URLs at the /media endpoint
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_app import create_app
+from utils.media_files import MEDIA_DIRS
+import sqlite3
+
+# Columns holding a single media URL
+URL_COLUMNS = [
+    ('file_upload', 'primary_url'),
+    ('post_media', 'media_url'),
+    ('story', 'media_url'),
+    ('chat_message', 'media_url'),
+    ('user', 'profile_pic'),
+    ('user', 'cover_pic')
+]
+
+# Older forms of local URLs, relative to the static folder or under /static
+OLD_PREFIXES = ['/static/uploads/', 'uploads/']
+
+def rewrite_local_media_urls():
+    """
+    Rewrite 'uploads/<kind>/...' and '/static/uploads/<kind>/...' URLs to '/media/<kind>/...'
+    """
+    # Create app context
+    app = create_app()
+
+    with app.app_context():
+        # Get the database path from the app config
+        db_path = app.config.get('DATABASE_PATH', 'fblike.db')
+
+        print(f"Using database at: {db_path}")
+
+        # Connect to the SQLite database directly
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            for table, column in URL_COLUMNS:
+                rewritten = 0
+                for prefix in OLD_PREFIXES:
+                    condition = ' OR '.join(f'"{column}" LIKE ?' for _ in MEDIA_DIRS)
+                    cursor.execute(
+                        f'UPDATE "{table}" SET "{column}" = \'/media/\' || substr("{column}", ?) WHERE {condition}',
+                        [len(prefix) + 1] + [f'{prefix}{kind}/%' for kind in MEDIA_DIRS]
+                    )
+                    rewritten += cursor.rowcount
+                print(f"Rewrote {rewritten} URLs in {table}.{column}")
+
+            # Derivative URLs are stored as JSON, their prefix is unique within it
+            cursor.execute(
+                "UPDATE file_upload SET derivatives = REPLACE(derivatives, '/static/uploads/derivatives/', "
+                "'/media/derivatives/') WHERE derivatives LIKE '%/static/uploads/derivatives/%'"
+            )
+            print(f"Rewrote the derivatives of {cursor.rowcount} uploads")
+
+            conn.commit()
+        except Exception as e:
+            print(f"Error rewriting media URLs: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    rewrite_local_media_urls()
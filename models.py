@@ -10,12 +10,15 @@ class FileUpload(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     original_filename = db.Column(db.String(255), nullable=False)
-    primary_url = db.Column(db.String(500), nullable=False)
+    primary_url = db.Column(db.String(500), nullable=False, index=True)
     fallback_urls = db.Column(db.Text)  # JSON list of backup URLs
     media_type = db.Column(db.String(20), nullable=False)  # 'image' or 'video'
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     last_check = db.Column(db.DateTime, default=datetime.utcnow)
     is_available = db.Column(db.Boolean, default=True)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the file, for deduplication
+    derivatives = db.Column(db.Text)  # JSON {width: URL} of resized copies
+    placeholder = db.Column(db.Text)  # data: URI of a tiny thumbnail, shown while the image loads
 
     def get_all_urls(self):
         """
@@ -33,11 +36,26 @@ class FileUpload(db.Model):
 
     def get_best_url(self):
         """
-        Returns the best available URL for this file
+        Returns the best available URL for this file, from cached URL health only
         """
-        from utils.multi_upload import get_first_working_url
-        urls = self.get_all_urls()
-        return get_first_working_url(urls) or self.primary_url
+        from utils.url_health import url_prober
+        return url_prober.resolve(self)
+
+class UploadSession(db.Model):
+    """
+    A resumable upload being received in chunks, see utils.chunked_upload
+    """
+    id = db.Column(db.String(32), primary_key=True)  # Random token, part of the session URL
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    media_type = db.Column(db.String(20), nullable=False)  # 'image' or 'video'
+    size = db.Column(db.BigInteger, nullable=False)  # Total size announced by the client
+    path = db.Column(db.String(500), nullable=False)  # Spool file the chunks are appended to
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.filename}>'
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -86,6 +104,14 @@ class User(UserMixin, db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+class UidSequence(db.Model):
+    """
+    State of the UID allocator, a single row (see utils.uid_generator)
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False)  # Hex key of the UID permutation, must never change
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)  # First counter value not reserved yet
+
 class Friend(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -157,6 +183,7 @@ class PostMedia(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     media_type = db.Column(db.String(20), nullable=False)  # image, video
     media_url = db.Column(db.String(255), nullable=False)
+    placeholder = db.Column(db.Text)  # data: URI of a tiny thumbnail, shown while the image loads
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
@@ -168,6 +195,7 @@ class PostMedia(db.Model):
             'post_id': self.post_id,
             'media_type': self.media_type,
             'media_url': self.media_url,
+            'placeholder': self.placeholder,
             'created_at': self.created_at.isoformat()
         }
 
@@ -237,6 +265,7 @@ class Story(db.Model):
     story_type = db.Column(db.String(20), nullable=False)  # text, image, video
     content = db.Column(db.Text)  # For text stories or caption
     media_url = db.Column(db.String(255))  # For image or video stories
+    placeholder = db.Column(db.Text)  # data: URI of a tiny thumbnail of image stories
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime)  # 24 hours after creation
 
@@ -255,6 +284,7 @@ class Story(db.Model):
             'story_type': self.story_type,
             'content': self.content,
             'media_url': self.media_url,
+            'placeholder': self.placeholder,
             'created_at': self.created_at.isoformat(),
             'expires_at': self.expires_at.isoformat(),
             'view_count': self.views.count()
@@ -347,6 +377,9 @@ class ChatMessage(db.Model):
     user = db.relationship('User', backref=db.backref('chat_messages', lazy='dynamic'))
     read_receipts = db.relationship('MessageReadReceipt', backref='message', lazy='dynamic', cascade='all, delete-orphan')
 
+    # Index for keyset pagination of chat history
+    __table_args__ = (db.Index('ix_chat_message_chat_id_id', 'chat_id', 'id'),)
+
     def __repr__(self):
         return f'<ChatMessage {self.id} in {self.chat_id} by {self.user_id}>'
 
@@ -390,6 +423,25 @@ class MessageReadReceipt(db.Model):
             'read_at': self.read_at.isoformat()
         }
 
+class ChatChangeLog(db.Model):
+    """Append-only log of chat changes; the ID is the client sync cursor"""
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat_group.id'), nullable=False)
+    change_type = db.Column(db.String(20), nullable=False)  # message, edit, delete, read, members
+    message_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Author, reader or affected member
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # AUTOINCREMENT so IDs are never reused after old entries are pruned
+    __table_args__ = (
+        db.Index('ix_chat_change_log_chat_id_id', 'chat_id', 'id'),
+        db.Index('ix_chat_change_log_user_id_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True}
+    )
+
+    def __repr__(self):
+        return f'<ChatChangeLog {self.id} {self.change_type} in {self.chat_id}>'
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -466,6 +518,9 @@ class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Canonical ordered pair, set automatically on insert (nullable during migration)
+    low_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    high_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -474,9 +529,17 @@ class Conversation(db.Model):
     user2 = db.relationship('User', foreign_keys=[user2_id], backref=db.backref('conversations_received', lazy='dynamic'))
     messages = db.relationship('Message', backref='conversation', lazy='dynamic', cascade='all, delete-orphan')
 
+    # Add unique constraint to prevent duplicate conversations between the same users
+    __table_args__ = (db.UniqueConstraint('low_user_id', 'high_user_id', name='unique_conversation_pair'),)
+
     def __repr__(self):
         return f'<Conversation {self.id} between {self.user1_id} and {self.user2_id}>'
 
+@event.listens_for(Conversation, 'before_insert')
+def set_conversation_pair(mapper, connection, target):
+    target.low_user_id = min(target.user1_id, target.user2_id)
+    target.high_user_id = max(target.user1_id, target.user2_id)
+
 
 class Message(db.Model):
     """Model for messages in a conversation"""
@@ -505,4 +568,15 @@ class Message(db.Model):
             'content': self.content,
             'created_at': self.created_at.isoformat(),
             'read': self.read
-        }
\ No newline at end of file
+        }
+
+
+class PurgeJob(db.Model):
+    """Children of a deleted post or chat still waiting to be removed"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # post, chat
+    target_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PurgeJob {self.kind} {self.target_id}>'
@@ -0,0 +1,483 @@
+"""
+Realtime Gateway
+Standalone asyncio Socket.IO server for the realtime events
+
+The Flask app serves Socket.IO in threading mode, which costs an OS thread
+per long-lived connection and shares the GIL with HTTP requests. The gateway
+terminates the websocket connections in a single asyncio process instead, so
+idle clients cost a coroutine and a few kilobytes. It implements the client
+events (auth, join_user_room, join_conversation, leave_conversation,
+send_message, typing, stop_typing) and forwards anything that needs the
+database to the app over the channel in utils/gateway_ipc.py. Events the app
+sends to rooms are pushed back over the same channel and emitted here. With
+several app workers the gateway holds a channel to each of them.
+
+Usage:
+    python realtime_gateway.py [--host 0.0.0.0] [--port 5001]
+
+Set realtime.gateway_enabled so the app opens the channel, and
+realtime.gateway_url so browsers connect to the gateway. Serving requires
+an ASGI server (uvicorn).
+"""
+import os
+import time
+import asyncio
+import argparse
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import socketio
+
+from config import get_config
+from utils.gateway_ipc import encode_frame, decode_frame, find_worker_sockets
+from utils.typing_indicator import TypingTracker
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class AppChannel:
+    """
+    Gateway side of the IPC channel: requests to the app and pushed emits from it
+    """
+
+    def __init__(self, path: str, on_push: Callable[[Dict], Awaitable[None]], timeout: float = 10,
+                 reconnect: bool = True):
+        self.path = path
+        self.on_push = on_push
+        self.timeout = timeout
+        # Without reconnect the channel ends when its connection does, and AppChannels drops it
+        self.reconnect = reconnect
+
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._writer = None
+        self._connected = asyncio.Event()
+        self._task = None
+
+    async def start(self) -> None:
+        """Connect to the app in the background, reconnecting when the channel drops"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    async def request(self, op: str, **args) -> Any:
+        """
+        Call an operation in the app and wait for its result
+
+        Raises:
+            ConnectionError: If the app is not reachable or returned an error
+        """
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError('App channel is not connected')
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode_frame({'id': request_id, 'op': op, 'args': args}))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f'App did not answer {op} in time')
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _run(self) -> None:
+        delay = 0.5
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=2 ** 22)
+            except OSError as e:
+                if not self.reconnect:
+                    # Nobody listens any more: the socket of a worker that has exited
+                    if isinstance(e, ConnectionRefusedError):
+                        logger.info(f"Removing stale app channel {self.path}")
+                        try:
+                            os.unlink(self.path)
+                        except OSError:
+                            pass
+                    return
+                logger.warning(f"App channel unavailable ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+                continue
+
+            logger.info(f"Connected to app channel at {self.path}")
+            delay = 0.5
+            self._connected.set()
+            try:
+                await self._read(reader)
+            finally:
+                self._connected.clear()
+                self._writer.close()
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError('App channel closed'))
+            if not self.reconnect:
+                logger.info(f"App channel {self.path} closed")
+                return
+            logger.warning("App channel closed, reconnecting")
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+
+            frame = decode_frame(line)
+            if 'id' in frame:
+                future = self._pending.get(frame['id'])
+                if future is None or future.done():
+                    continue
+                if 'error' in frame:
+                    future.set_exception(ConnectionError(frame['error']))
+                else:
+                    future.set_result(frame.get('result'))
+            else:
+                try:
+                    await self.on_push(frame)
+                except Exception as e:
+                    logger.error(f"Error handling pushed frame: {str(e)}")
+
+class AppChannels:
+    """
+    Channels to every app worker, found by scanning for their sockets
+
+    Pushed emits are taken from all of them, requests go to the connected
+    workers in turn.
+    """
+
+    def __init__(self, path: str, on_push: Callable[[Dict], Awaitable[None]], timeout: float = 10,
+                 scan_interval: float = 2.0):
+        self.path = path
+        self.on_push = on_push
+        self.timeout = timeout
+        self.scan_interval = scan_interval
+
+        # socket path -> AppChannel
+        self.channels = {}
+        self._turn = itertools.count()
+        self._task = None
+
+    async def start(self) -> None:
+        """Connect to the workers listening now, and to new ones as they start"""
+        if self._task is None:
+            await self.scan()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for channel in self.channels.values():
+            await channel.close()
+        self.channels = {}
+
+    async def scan(self) -> None:
+        """Open channels to new worker sockets and drop those whose worker went away"""
+        for path, channel in list(self.channels.items()):
+            if channel.finished:
+                del self.channels[path]
+
+        for path in find_worker_sockets(self.path):
+            if path not in self.channels:
+                channel = AppChannel(path, self.on_push, self.timeout, reconnect=False)
+                self.channels[path] = channel
+                await channel.start()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.scan_interval)
+            await self.scan()
+
+    async def request(self, op: str, **args) -> Any:
+        """
+        Call an operation in one of the app workers and wait for its result
+
+        Raises:
+            ConnectionError: If no worker is reachable or the worker returned an error
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connected = [channel for channel in self.channels.values() if channel.connected]
+            if connected:
+                break
+            if time.monotonic() >= deadline:
+                raise ConnectionError('App channel is not connected')
+            await asyncio.sleep(0.05)
+
+        channel = connected[next(self._turn) % len(connected)]
+        return await channel.request(op, **args)
+
+class RealtimeGateway:
+    """
+    Socket.IO event handlers of the gateway
+    """
+
+    def __init__(self, sio: socketio.AsyncServer, channel_path: str):
+        self.sio = sio
+        self.channel = AppChannels(channel_path, self.on_push)
+        self.typing = TypingTracker(
+            get_config('messaging.typing_throttle_ms', 2000),
+            get_config('messaging.typing_timeout_ms', 5000)
+        )
+
+        # sid -> {'user_id', 'username', 'conversations'}
+        self.identities = {}
+        # user_id -> number of authenticated sockets
+        self.user_sockets = {}
+        self._sweeper = None
+
+        for event in ('connect', 'disconnect', 'auth', 'join_user_room', 'join_conversation',
+                      'leave_conversation', 'send_message', 'typing', 'stop_typing'):
+            sio.on(event, getattr(self, f'on_{event}'))
+
+    async def start(self) -> None:
+        await self.channel.start()
+        self._sweeper = asyncio.create_task(self._sweep_typing())
+
+    async def on_push(self, frame: Dict) -> None:
+        """Emit an event the app sent to a room"""
+        if frame.get('op') == 'emit':
+            await self.sio.emit(frame['event'], frame.get('data'), room=frame.get('room'))
+
+    async def on_connect(self, sid: str, environ: Dict, auth: Optional[Dict] = None) -> bool:
+        # The session cookie is resolved on the app side when the client authenticates
+        await self.sio.save_session(sid, {'cookie': environ.get('HTTP_COOKIE', '')})
+        await self.sio.emit('connected', {
+            'status': 'connected',
+            'authenticated': False,
+            'timestamp': datetime.utcnow().isoformat()
+        }, to=sid)
+        return True
+
+    async def on_disconnect(self, sid: str, reason: Any = None) -> None:
+        identity = self.identities.pop(sid, None)
+        if not identity:
+            return
+
+        user_id = identity['user_id']
+        for (_, conversation_id), entry in self.typing.clear_user(user_id):
+            await self._emit_typing_stopped(user_id, conversation_id, entry)
+
+        self.user_sockets[user_id] -= 1
+        if self.user_sockets[user_id] <= 0:
+            del self.user_sockets[user_id]
+            try:
+                await self.channel.request('presence', user_id=user_id, online=False)
+            except ConnectionError as e:
+                logger.warning(f"Could not record offline status of user {user_id}: {str(e)}")
+
+    async def on_auth(self, sid: str, data: Optional[Dict] = None) -> None:
+        data = data or {}
+        session = await self.sio.get_session(sid)
+        try:
+            result = await self.channel.request(
+                'auth', cookie=session.get('cookie', ''),
+                last_seq=data.get('last_seq'), epoch=data.get('epoch')
+            )
+        except ConnectionError as e:
+            logger.error(f"Authentication failed for {sid}: {str(e)}")
+            await self.sio.emit('auth_response', {'status': 'error', 'message': 'Server unavailable'}, to=sid)
+            return
+
+        if not result:
+            await self.sio.emit('auth_response', {'status': 'error', 'message': 'Authentication failed'}, to=sid)
+            return
+
+        user_id = result['user_id']
+        if sid not in self.identities:
+            self.user_sockets[user_id] = self.user_sockets.get(user_id, 0) + 1
+        self.identities[sid] = {'user_id': user_id, 'username': result['username'], 'conversations': set()}
+        await self.sio.enter_room(sid, f"user_{user_id}")
+
+        # Presence is broadcast by the app so both servers' clients see it
+        try:
+            await self.channel.request('presence', user_id=user_id, online=True)
+        except ConnectionError as e:
+            logger.warning(f"Could not record online status of user {user_id}: {str(e)}")
+
+        if not result['complete']:
+            await self.sio.emit('resync_required', {'epoch': result['epoch'], 'seq': result['seq']}, to=sid)
+        for seq, event_type, event_data in result['replay']:
+            await self.sio.emit(event_type, dict(event_data, seq=seq, replayed=True), to=sid)
+
+        await self.sio.emit('auth_response', {
+            'status': 'success',
+            'user_id': user_id,
+            'username': result['username'],
+            'epoch': result['epoch'],
+            'seq': result['seq']
+        }, to=sid)
+
+    async def on_join_user_room(self, sid: str, data: Any = None) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        await self.sio.enter_room(sid, f"user_{identity['user_id']}")
+        return {'success': True}
+
+    async def on_join_conversation(self, sid: str, data: Dict) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        conversation_id = (data or {}).get('conversation_id')
+        result = await self._request('join_conversation', user_id=identity['user_id'], conversation_id=conversation_id)
+        if result['success']:
+            identity['conversations'].add(conversation_id)
+            await self.sio.enter_room(sid, f"conversation_{conversation_id}")
+        return result
+
+    async def on_leave_conversation(self, sid: str, data: Dict) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        conversation_id = (data or {}).get('conversation_id')
+        if not conversation_id:
+            return {'success': False, 'error': 'Missing conversation ID'}
+
+        identity['conversations'].discard(conversation_id)
+        await self.sio.leave_room(sid, f"conversation_{conversation_id}")
+        return {'success': True}
+
+    async def on_send_message(self, sid: str, data: Dict) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        data = data or {}
+        result = await self._request(
+            'send_message', user_id=identity['user_id'],
+            recipient_id=data.get('recipient_id'), content=data.get('content')
+        )
+
+        # The message replaces the sender's typing indicator
+        if result.get('success'):
+            conversation_id = result['message']['conversation_id']
+            entry = self.typing.stop(identity['user_id'], conversation_id)
+            if entry:
+                await self._emit_typing_stopped(identity['user_id'], conversation_id, entry)
+        return result
+
+    async def on_typing(self, sid: str, data: Dict) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        conversation_id = (data or {}).get('conversation_id')
+        if not conversation_id:
+            return {'success': False, 'error': 'Missing conversation ID'}
+
+        # Membership is checked once per socket and conversation
+        if conversation_id not in identity['conversations']:
+            participants = await self._request('participants', conversation_id=conversation_id)
+            if isinstance(participants, dict):
+                return participants
+            if identity['user_id'] not in participants:
+                return {'success': False, 'error': 'Not authorized for this conversation'}
+            identity['conversations'].add(conversation_id)
+
+        if self.typing.touch(identity['user_id'], identity['username'], conversation_id, sid):
+            await self.sio.emit('typing', {
+                'user_id': identity['user_id'],
+                'username': identity['username'],
+                'conversation_id': conversation_id
+            }, room=f"conversation_{conversation_id}", skip_sid=sid)
+        return {'success': True}
+
+    async def on_stop_typing(self, sid: str, data: Dict) -> Dict:
+        identity = self.identities.get(sid)
+        if not identity:
+            return {'success': False, 'error': 'Not authenticated'}
+
+        conversation_id = (data or {}).get('conversation_id')
+        if not conversation_id:
+            return {'success': False, 'error': 'Missing conversation ID'}
+
+        entry = self.typing.stop(identity['user_id'], conversation_id)
+        if entry:
+            await self._emit_typing_stopped(identity['user_id'], conversation_id, entry)
+        return {'success': True}
+
+    async def _request(self, op: str, **args) -> Any:
+        """Call the app, turning channel failures into an error acknowledgement"""
+        try:
+            return await self.channel.request(op, **args)
+        except ConnectionError as e:
+            logger.error(f"Gateway operation {op} failed: {str(e)}")
+            return {'success': False, 'error': 'Server unavailable'}
+
+    async def _emit_typing_stopped(self, user_id: int, conversation_id: int, entry: Dict) -> None:
+        await self.sio.emit('typing_stopped', {
+            'user_id': user_id,
+            'username': entry['username'],
+            'conversation_id': conversation_id
+        }, room=f"conversation_{conversation_id}", skip_sid=entry['sid'])
+
+    async def _sweep_typing(self) -> None:
+        interval = min(self.typing.timeout / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            for (user_id, conversation_id), entry in self.typing.expire():
+                await self._emit_typing_stopped(user_id, conversation_id, entry)
+
+def get_channel_path() -> str:
+    path = get_config('realtime.gateway_socket_path', 'instance/realtime_gateway.sock')
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path
+
+def create_gateway(channel_path: Optional[str] = None):
+    """
+    Create the gateway Socket.IO server and its ASGI app
+
+    Returns:
+        Tuple[RealtimeGateway, socketio.ASGIApp]
+    """
+    sio = socketio.AsyncServer(
+        async_mode='asgi',
+        cors_allowed_origins='*',
+        ping_timeout=20,
+        ping_interval=10,
+        max_http_buffer_size=1024 * 1024
+    )
+    gateway = RealtimeGateway(sio, channel_path or get_channel_path())
+    asgi_app = socketio.ASGIApp(sio, on_startup=gateway.start)
+    return gateway, asgi_app
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the standalone realtime gateway')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=get_config('realtime.gateway_port', 5001))
+    parser.add_argument('--socket', default=None, help='Configured path of the app IPC sockets')
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    _, asgi_app = create_gateway(args.socket)
+    uvicorn.run(asgi_app, host=args.host, port=args.port, log_level='info')
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,13 @@ from datetime import datetime, timezone
 from flask import jsonify, request, g, current_app
 from werkzeug.utils import secure_filename
 from database import db
-from models import User, Post, Friend, Follower, Comment, PostLike as Like, PostMedia
+from models import User, Post, Friend, Follower, Comment, CommentLike, PostLike as Like, PostMedia
 from routes.api import api_bp
 from routes.auth_old import login_required
 from utils.multi_upload import save_multi_uploads
+from utils.upload import start_upload
+from utils.image_derivatives import pick_size, placeholder_for, AVATAR_WIDTH, POST_MEDIA_WIDTH
+from utils.purge import schedule_purge, purge_worker, PURGE_POST
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -53,7 +56,8 @@ def get_feed():
 
             # Get post media
             media = PostMedia.query.filter_by(post_id=post.id).all()
-            media_urls = [m.media_url for m in media]
+            media_urls = [pick_size(m.media_url, POST_MEDIA_WIDTH) for m in media]
+            media_placeholders = [m.placeholder for m in media]
 
             # Get like count
             like_count = Like.query.filter_by(post_id=post.id).count()
@@ -73,13 +77,14 @@ def get_feed():
                 'id': post.id,
                 'user_id': post.user_id,
                 'author': author.username,
-                'profile_pic': author.profile_pic,
+                'profile_pic': pick_size(author.profile_pic, AVATAR_WIDTH),
                 'content': post.content,
                 'created_at': post.created_at.isoformat(),
                 'like_count': like_count,
                 'comment_count': comment_count,
                 'liked_by_user': liked_by_user,
-                'media': media_urls
+                'media': media_urls,
+                'media_placeholders': media_placeholders
             })
 
         # Return response
@@ -133,31 +138,29 @@ def create_post():
         # Handle media uploads if any
         media_urls = []
 
-        # Check for media files in the request
+        # Check for media files in the request, they are served locally until external hosts have them
+        upload_jobs = []
         if 'media' in request.files:
-            files = request.files.getlist('media')
-            for file in files:
-                if file and file.filename:
-                    try:
-                        # Use our image upload utility
-                        from utils.image_upload import upload_image
-                        result = upload_image(file, file.filename)
-
-                        if result['success']:
-                            media_url = result['url']
-                            media_urls.append(media_url)
-
-                            # Create post media entry
-                            media = PostMedia(
-                                post_id=post.id,
-                                media_type='image',
-                                media_url=media_url
-                            )
-                            db.session.add(media)
-                        else:
-                            logger.warning(f"Failed to upload image: {result.get('error')}")
-                    except Exception as e:
-                        logger.error(f"Error uploading image: {str(e)}")
+            files = [file for file in request.files.getlist('media') if file and file.filename]
+            try:
+                for file in files:
+                    media_url, job_id = start_upload(file, 'image', g.user.id)
+                    if not media_url:
+                        continue
+                    media_urls.append(media_url)
+                    if job_id:
+                        upload_jobs.append(job_id)
+
+                    # Create post media entry
+                    media = PostMedia(
+                        post_id=post.id,
+                        media_type='image',
+                        media_url=media_url,
+                        placeholder=placeholder_for(media_url)
+                    )
+                    db.session.add(media)
+            except Exception as e:
+                logger.error(f"Error uploading images: {str(e)}")
 
         # Check for media URLs in the form data
         if 'media_urls[]' in request.form:
@@ -188,7 +191,8 @@ def create_post():
             'success': True,
             'message': 'Post created successfully',
             'post_id': post.id,
-            'media_urls': media_urls
+            'media_urls': media_urls,
+            'upload_jobs': upload_jobs
         })
 
     except Exception as e:
@@ -215,7 +219,8 @@ def get_post(post_id):
 
         # Get post media
         media = PostMedia.query.filter_by(post_id=post.id).all()
-        media_urls = [m.media_url for m in media]
+        media_urls = [pick_size(m.media_url, POST_MEDIA_WIDTH) for m in media]
+        media_placeholders = [m.placeholder for m in media]
 
         # Get like count
         like_count = Like.query.filter_by(post_id=post.id).count()
@@ -236,13 +241,14 @@ def get_post(post_id):
             'id': post.id,
             'user_id': post.user_id,
             'author': author.username,
-            'profile_pic': author.profile_pic,
+            'profile_pic': pick_size(author.profile_pic, AVATAR_WIDTH),
             'content': post.content,
             'created_at': post.created_at.isoformat(),
             'like_count': like_count,
             'comment_count': comment_count,
             'liked_by_user': liked_by_user,
-            'media': media_urls
+            'media': media_urls,
+            'media_placeholders': media_placeholders
         }
 
         return jsonify({
@@ -276,18 +282,11 @@ def delete_post(post_id):
                 'message': 'You can only delete your own posts'
             }), 403
 
-        # Delete post media
-        PostMedia.query.filter_by(post_id=post.id).delete()
-
-        # Delete post likes
-        Like.query.filter_by(post_id=post.id).delete()
-
-        # Delete post comments
-        Comment.query.filter_by(post_id=post.id).delete()
-
-        # Delete post
-        db.session.delete(post)
+        # Delete the post now; media, likes and comments are purged in the background
+        Post.query.filter_by(id=post.id).delete(synchronize_session=False)
+        schedule_purge(PURGE_POST, post.id)
         db.session.commit()
+        purge_worker.wake()
 
         return jsonify({
             'success': True,
@@ -334,7 +333,7 @@ def get_comments(post_id):
                 'post_id': comment.post_id,
                 'user_id': comment.user_id,
                 'author': author.username,
-                'profile_pic': author.profile_pic,
+                'profile_pic': pick_size(author.profile_pic, AVATAR_WIDTH),
                 'content': comment.content,
                 'created_at': comment.created_at.isoformat()
             })
@@ -414,7 +413,7 @@ def add_comment(post_id):
             'post_id': comment.post_id,
             'user_id': comment.user_id,
             'author': author.username,
-            'profile_pic': author.profile_pic,
+            'profile_pic': pick_size(author.profile_pic, AVATAR_WIDTH),
             'content': comment.content,
             'created_at': comment.created_at.isoformat()
         }
@@ -453,8 +452,9 @@ def delete_comment(comment_id):
                 'message': 'You can only delete your own comments or comments on your posts'
             }), 403
 
-        # Delete comment
-        db.session.delete(comment)
+        # Delete comment and its likes without loading them
+        CommentLike.query.filter_by(comment_id=comment.id).delete(synchronize_session=False)
+        Comment.query.filter_by(id=comment.id).delete(synchronize_session=False)
         db.session.commit()
 
         return jsonify({
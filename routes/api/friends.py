@@ -77,7 +77,7 @@ def send_friend_request(username):
             user_id=g.user.id,
             friend_id=user.id,
             status='pending',
-            created_at=datetime.now()
+            created_at=datetime.utcnow()
         )
         
         db.session.add(friend_request)
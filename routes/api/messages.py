@@ -4,10 +4,16 @@ from models import User, Message, Conversation
 from routes.api import api_bp
 from database import db
 from datetime import datetime
+from utils.conversations import get_or_create_conversation_id
+from utils.message_writer import message_writer, KIND_MESSAGE
+from utils.image_derivatives import pick_size, AVATAR_WIDTH
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a message to be written before reporting failure
+MESSAGE_ACK_TIMEOUT = 5
+
 @api_bp.route('/messages/send', methods=['POST'])
 def send_message():
     """Send a message to another user"""
@@ -54,45 +60,36 @@ def send_message():
                 'error': 'Recipient not found'
             }), 404
 
-        # Find or create conversation
-        conversation = Conversation.query.filter(
-            ((Conversation.user1_id == g.user.id) & (Conversation.user2_id == recipient.id)) |
-            ((Conversation.user1_id == recipient.id) & (Conversation.user2_id == g.user.id))
-        ).first()
-
-        if not conversation:
-            conversation = Conversation(
-                user1_id=g.user.id,
-                user2_id=recipient.id
-            )
-            db.session.add(conversation)
-            db.session.commit()
-
-        # Create message
-        message = Message(
-            conversation_id=conversation.id,
-            sender_id=g.user.id,
-            recipient_id=recipient.id,
-            content=content,
-            created_at=datetime.utcnow()
-        )
-        db.session.add(message)
+        # Find or create conversation (a new one is committed before the message is queued)
+        conversation_id = get_or_create_conversation_id(g.user.id, recipient.id)
         db.session.commit()
 
-        # Update conversation last_message_at
-        conversation.last_message_at = message.created_at
-        db.session.commit()
+        # Hand the message to the group-commit writer and wait until it is durable
+        pending = message_writer.submit(KIND_MESSAGE, {
+            'conversation_id': conversation_id,
+            'sender_id': g.user.id,
+            'recipient_id': recipient.id,
+            'content': content,
+            'created_at': datetime.utcnow(),
+            'read': False
+        }, touch={'conversation_id': conversation_id})
+
+        if not pending.wait(timeout=MESSAGE_ACK_TIMEOUT):
+            return jsonify({
+                'success': False,
+                'error': 'An error occurred while sending the message'
+            }), 500
 
         return jsonify({
             'success': True,
             'message': {
-                'id': message.id,
-                'conversation_id': message.conversation_id,
-                'sender_id': message.sender_id,
-                'recipient_id': message.recipient_id,
-                'content': message.content,
-                'created_at': message.created_at.isoformat(),
-                'read': message.read
+                'id': pending.id,
+                'conversation_id': conversation_id,
+                'sender_id': g.user.id,
+                'recipient_id': recipient.id,
+                'content': content,
+                'created_at': pending.values['created_at'].isoformat(),
+                'read': False
             }
         })
 
@@ -219,7 +216,7 @@ def get_conversations():
                 'other_user': {
                     'id': other_user.id,
                     'username': other_user.username,
-                    'profile_pic': other_user.profile_pic
+                    'profile_pic': pick_size(other_user.profile_pic, AVATAR_WIDTH)
                 },
                 'last_message': {
                     'id': last_message.id,
@@ -4,7 +4,7 @@ from flask import jsonify, request, g, url_for
 from models import User, Post, Friend, Follower
 from database import db
 from routes.api import api_bp
-from utils.upload import save_photo
+from utils.upload import start_upload
 from routes.auth_old import login_required
 
 # Set up logger
@@ -168,22 +168,18 @@ def upload_profile_pic():
     if profile_pic.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
-    media_path = save_photo(profile_pic)
+    # Served locally until an external host has the file, the user is told over Socket.IO
+    media_path, job_id = start_upload(profile_pic, 'image', g.user.id)
     if not media_path:
         return jsonify({'error': 'Invalid file type'}), 400
-        
-    # Check if the media_path is already a full URL (from external services)
-    if media_path.startswith(('http://', 'https://')):
-        g.user.profile_pic = media_path
-    else:
-        # For local files, don't use url_for to avoid host/static prefix
-        g.user.profile_pic = media_path
 
+    g.user.profile_pic = media_path
     db.session.commit()
 
     return jsonify({
         'success': True,
-        'profile_pic': g.user.profile_pic
+        'profile_pic': g.user.profile_pic,
+        'job_id': job_id
     })
     
 @api_bp.route('/profile/upload_cover_pic', methods=['POST'])
@@ -197,20 +193,16 @@ def upload_cover_pic():
     if cover_pic.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
-    media_path = save_photo(cover_pic)
+    # Served locally until an external host has the file, the user is told over Socket.IO
+    media_path, job_id = start_upload(cover_pic, 'image', g.user.id)
     if not media_path:
         return jsonify({'error': 'Invalid file type'}), 400
-        
-    # Check if the media_path is already a full URL (from external services)
-    if media_path.startswith(('http://', 'https://')):
-        g.user.cover_pic = media_path
-    else:
-        # For local files, don't use url_for to avoid host/static prefix
-        g.user.cover_pic = media_path
 
+    g.user.cover_pic = media_path
     db.session.commit()
 
     return jsonify({
         'success': True,
-        'cover_pic': g.user.cover_pic
+        'cover_pic': g.user.cover_pic,
+        'job_id': job_id
     })
@@ -0,0 +1,39 @@
+import logging
+from flask import jsonify, g
+from routes.api import api_bp
+from utils.backpressure import outbound_guard
+from utils.event_replay import event_buffer
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+@api_bp.route('/realtime/stats', methods=['GET'])
+def get_realtime_stats():
+    """
+    Get outbound queue and replay buffer metrics of the socket server
+
+    Response:
+        {
+            'success': bool,
+            'outbound': queue depth, drop and disconnect counters,
+            'replay': replay buffer counters
+        }
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    try:
+        return jsonify({
+            'success': True,
+            'outbound': outbound_guard.get_stats(),
+            'replay': dict(event_buffer.stats)
+        })
+    except Exception as e:
+        logger.exception(f"Error getting realtime stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error getting realtime stats: {str(e)}'
+        }), 500
@@ -50,6 +50,7 @@ def get_stories():
                 'story_type': story.story_type,
                 'content': story.content,
                 'media_url': story.media_url,
+                'placeholder': story.placeholder,
                 'created_at': story.created_at.isoformat(),
                 'expires_at': story.expires_at.isoformat(),
                 'viewed': viewed
@@ -2,9 +2,20 @@ import os
 import logging
 import json
 from flask import request, jsonify, g, current_app
+from werkzeug.http import parse_content_range_header
 from werkzeug.utils import secure_filename
 from routes.api import api_bp
 from utils.image_upload import upload_image, get_active_services
+from utils.multi_upload import upload_engine
+from utils.url_health import url_prober
+from utils.image_derivatives import image_pipeline, placeholder_for
+from utils.media_files import media_server
+from utils.storage import local_store
+from utils.chunked_upload import chunked_uploads, ChunkConflict
+from utils.service_health import service_health
+from utils.rate_limit import upload_limiter
+from utils.upload import start_spooled_upload
+from utils.upload_spool import spool_upload, allowed_image_types, UploadRejected
 from config import get_config, get_allowed_image_extensions
 
 # Set up logger
@@ -15,15 +26,20 @@ def upload_image_api():
     """
     API endpoint for uploading images to external services
     
+    Without a service the image is stored locally and the request returns
+    at once; the external uploads run in the background and their progress
+    is sent to the user's socket room (upload_progress, upload_complete).
+    
     Request:
         - file: The image file to upload
-        - service: (optional) The service to use for upload
+        - service: (optional) The service to upload to before answering
         
     Response:
         {
             'success': bool,
-            'url': str,
-            'service': str,
+            'url': str, provisional local URL unless a service was given,
+            'job_id': str (None if the image was uploaded before),
+            'service': str (if a service was given),
             'error': str (if success is False)
         }
     """
@@ -64,9 +80,35 @@ def upload_image_api():
     # Get service from request (optional)
     service = request.form.get('service')
     
+    # Spool the file once, checking its size and type on the way
+    try:
+        spool = spool_upload(file, allowed_image_types())
+    except UploadRejected as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    if not service:
+        try:
+            with spool:
+                url, job_id = start_spooled_upload(spool, 'image', g.user.id)
+            return jsonify({
+                'success': True,
+                'url': url,
+                'job_id': job_id
+            })
+        except Exception as e:
+            logger.exception(f"Error uploading image: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': f'Error uploading image: {str(e)}'
+            }), 500
+
     try:
-        # Upload the image
-        result = upload_image(file, filename, service)
+        # Upload the image to the service asked for
+        with spool:
+            result = upload_image(spool, filename, service)
         
         # Log the result
         if result['success']:
@@ -83,22 +125,261 @@ def upload_image_api():
             'error': f'Error uploading image: {str(e)}'
         }), 500
 
+def _session_or_404(session_id):
+    session = chunked_uploads.get(session_id, g.user.id)
+    if session is None:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Upload session not found'
+        }), 404)
+    return session, None
+
+@api_bp.route('/uploads/sessions', methods=['POST'])
+def create_upload_session():
+    """
+    Start a resumable upload, sent in chunks with PUT /api/uploads/sessions/<id>
+
+    Request:
+        {
+            'filename': str,
+            'size': int, total size in bytes,
+            'media_type': 'image' or 'video'
+        }
+
+    Response:
+        {
+            'success': bool,
+            'session_id': str,
+            'offset': int, always 0,
+            'chunk_size': int, largest chunk accepted,
+            'expires_at': str
+        }
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    try:
+        session = chunked_uploads.create(g.user.id, data.get('filename', ''), size, data.get('media_type', 'video'))
+    except UploadRejected as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.exception(f"Error starting upload session: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error starting upload session: {str(e)}'
+        }), 500
+
+    return jsonify({
+        'success': True,
+        'session_id': session.id,
+        'offset': 0,
+        'chunk_size': chunked_uploads.chunk_size,
+        'expires_at': session.expires_at.isoformat()
+    }), 201
+
+@api_bp.route('/uploads/sessions/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """
+    Get how much of a resumable upload has arrived, to resume it after an interruption
+
+    Response:
+        {
+            'success': bool,
+            'offset': int, where the next chunk starts,
+            'size': int
+        }
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    session, error = _session_or_404(session_id)
+    if error:
+        return error
+
+    return jsonify({
+        'success': True,
+        'offset': chunked_uploads.offset(session),
+        'size': session.size
+    })
+
+@api_bp.route('/uploads/sessions/<session_id>', methods=['PUT'])
+def put_upload_chunk(session_id):
+    """
+    Append a chunk to a resumable upload
+
+    Request:
+        Raw bytes of the chunk, with a Content-Range header such as
+        'bytes 0-4194303/104857600' giving its position in the file
+
+    Response:
+        {
+            'success': bool,
+            'offset': int, where the next chunk starts,
+            'size': int
+        }
+
+        409 with the current offset if the chunk does not start there
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    session, error = _session_or_404(session_id)
+    if error:
+        return error
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes' or content_range.length != session.size:
+        return jsonify({
+            'success': False,
+            'error': f'A Content-Range header of bytes <start>-<end>/{session.size} is required'
+        }), 400
+    length = content_range.stop - content_range.start
+    if request.content_length != length:
+        return jsonify({
+            'success': False,
+            'error': 'Content-Length does not match Content-Range'
+        }), 400
+
+    try:
+        # The body is read from the socket a block at a time, never buffered whole
+        offset = chunked_uploads.append(session, content_range.start, request.stream, length)
+    except ChunkConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'offset': e.offset
+        }), 409
+    except UploadRejected as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'offset': offset,
+        'size': session.size
+    })
+
+@api_bp.route('/uploads/sessions/<session_id>/complete', methods=['POST'])
+def complete_upload_session(session_id):
+    """
+    Finish a resumable upload once every chunk has arrived and store the file
+
+    The file is stored locally and uploaded to the external services in the
+    background, like POST /api/uploads/image.
+
+    Response:
+        {
+            'success': bool,
+            'url': str, provisional local URL,
+            'job_id': str (None if the file was uploaded before),
+            'media_type': str,
+            'placeholder': str or None
+        }
+
+        409 with the current offset if chunks are still missing
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    session, error = _session_or_404(session_id)
+    if error:
+        return error
+    media_type = session.media_type
+
+    try:
+        spool = chunked_uploads.complete(session)
+    except ChunkConflict as e:
+        return jsonify({
+            'success': False,
+            'error': f'Upload is incomplete, {e.offset} of {session.size} bytes received',
+            'offset': e.offset
+        }), 409
+    except UploadRejected as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    try:
+        with spool:
+            url, job_id = start_spooled_upload(spool, media_type, g.user.id)
+        return jsonify({
+            'success': True,
+            'url': url,
+            'job_id': job_id,
+            'media_type': media_type,
+            'placeholder': placeholder_for(url)
+        })
+    except Exception as e:
+        logger.exception(f"Error saving chunked upload: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error saving upload: {str(e)}'
+        }), 500
+
+@api_bp.route('/uploads/sessions/<session_id>', methods=['DELETE'])
+def delete_upload_session(session_id):
+    """
+    Abandon a resumable upload and discard what it received
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    session, error = _session_or_404(session_id)
+    if error:
+        return error
+
+    chunked_uploads.abort(session)
+    return jsonify({
+        'success': True
+    })
+
 @api_bp.route('/uploads/services', methods=['GET'])
 def get_upload_services():
     """
-    Get available image upload services
+    Get available image upload services with their health
     
     Response:
         {
             'success': bool,
-            'services': list of active services
+            'services': list of active services,
+            'health': per-service breaker state, rolling success rate and median latency,
+            'breakers': breaker counters
         }
     """
     try:
         services = get_active_services()
         return jsonify({
             'success': True,
-            'services': services
+            'services': services,
+            'health': service_health.snapshot(),
+            'breakers': dict(service_health.stats)
         })
     except Exception as e:
         logger.exception(f"Error getting upload services: {str(e)}")
@@ -106,3 +387,45 @@ def get_upload_services():
             'success': False,
             'error': f'Error getting upload services: {str(e)}'
         }), 500
+
+@api_bp.route('/uploads/stats', methods=['GET'])
+def get_upload_stats():
+    """
+    Get latency histograms of the multi-service uploads, rate limit waits, URL health, derivative,
+    media serving, storage and chunked upload counters
+
+    Response:
+        {
+            'success': bool,
+            'services': per-service upload count, failures, average and histogram,
+            'rate_limits': per-service requests delayed by the rate limiter and time spent waiting,
+            'url_health': URL prober and health cache counters,
+            'derivatives': image derivative pipeline counters,
+            'media': local media serving counters,
+            'storage': local object store counters,
+            'chunked': resumable upload counters
+        }
+    """
+    if not g.user:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    try:
+        return jsonify({
+            'success': True,
+            'services': upload_engine.get_stats(),
+            'rate_limits': upload_limiter.get_stats(),
+            'url_health': url_prober.get_stats(),
+            'derivatives': dict(image_pipeline.stats),
+            'media': dict(media_server.stats),
+            'storage': dict(local_store.stats),
+            'chunked': dict(chunked_uploads.stats)
+        })
+    except Exception as e:
+        logger.exception(f"Error getting upload stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error getting upload stats: {str(e)}'
+        }), 500
@@ -87,7 +87,7 @@ def login():
         logger.debug(f"Session after setting user_id: {session}")
 
         # Update last online time
-        user.last_online = datetime.now()
+        user.last_online = datetime.utcnow()
         db.session.commit()
 
         # Log successful login
@@ -172,8 +172,8 @@ def register():
             username=username,
             email=email,
             password_hash=generate_password_hash(password, method='pbkdf2:sha256:50000'),
-            created_at=datetime.now(),
-            last_online=datetime.now()
+            created_at=datetime.utcnow(),
+            last_online=datetime.utcnow()
         )
 
         # Add user to database
@@ -279,7 +279,7 @@ def api_login():
     logger.debug(f"Session after setting user_id: {session}")
 
     # Update last online time
-    user.last_online = datetime.now()
+    user.last_online = datetime.utcnow()
     db.session.commit()
     logger.debug("Updated last online time")
 
@@ -359,8 +359,8 @@ def api_register():
         username=username,
         email=email,
         password_hash=generate_password_hash(password, method='pbkdf2:sha256:50000'),
-        created_at=datetime.now(),
-        last_online=datetime.now()
+        created_at=datetime.utcnow(),
+        last_online=datetime.utcnow()
     )
 
     # Add user to database
@@ -773,7 +773,7 @@ def test_filters():
     """Test Jinja2 filters"""
     from datetime import datetime, timedelta
 
-    now = datetime.now()
+    now = datetime.utcnow()
     one_hour_ago = now - timedelta(hours=1)
     one_day_ago = now - timedelta(days=1)
     one_week_ago = now - timedelta(weeks=1)
@@ -61,7 +61,7 @@ def login():
         logger.debug(f"Session after setting user_id: {session}")
 
         # Update last online time
-        user.last_online = datetime.now()
+        user.last_online = datetime.utcnow()
         db.session.commit()
 
         # Log successful login
@@ -185,7 +185,7 @@ def api_login():
     logger.debug(f"Session after setting user_id: {session}")
 
     # Update last online time
-    user.last_online = datetime.now()
+    user.last_online = datetime.utcnow()
     db.session.commit()
     logger.debug("Updated last online time")
 
@@ -4,10 +4,15 @@ from flask import render_template, redirect, url_for, request, g, jsonify
 from database import db
 from models import User, Message, Conversation
 from routes.auth import auth_bp
+from utils.conversations import get_or_create_conversation_id
+from utils.message_writer import message_writer, KIND_MESSAGE
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a message to be written before reporting failure
+MESSAGE_ACK_TIMEOUT = 5
+
 @auth_bp.route('/messages')
 def messages_redirect():
     """Redirect to messages inbox"""
@@ -83,25 +88,15 @@ def messages(username):
     other_user = User.query.filter_by(username=username).first_or_404()
 
     # Find or create conversation
-    conversation = Conversation.query.filter(
-        ((Conversation.user1_id == g.user.id) & (Conversation.user2_id == other_user.id)) |
-        ((Conversation.user1_id == other_user.id) & (Conversation.user2_id == g.user.id))
-    ).first()
-
-    if not conversation:
-        conversation = Conversation(
-            user1_id=g.user.id,
-            user2_id=other_user.id
-        )
-        db.session.add(conversation)
-        db.session.commit()
+    conversation_id = get_or_create_conversation_id(g.user.id, other_user.id)
+    db.session.commit()
 
     # Get messages
-    messages = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.created_at).all()
+    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at).all()
 
     # Mark messages as read
     unread_messages = Message.query.filter_by(
-        conversation_id=conversation.id,
+        conversation_id=conversation_id,
         recipient_id=g.user.id,
         read=False
     ).all()
@@ -111,7 +106,7 @@ def messages(username):
 
     db.session.commit()
 
-    return render_template('messaging/messages.html', other_user=other_user, messages=messages, conversation_id=conversation.id)
+    return render_template('messaging/messages.html', other_user=other_user, messages=messages, conversation_id=conversation_id)
 
 @auth_bp.route('/api/messages/send', methods=['POST'])
 def send_message():
@@ -131,40 +126,29 @@ def send_message():
     if not recipient:
         return jsonify({'success': False, 'message': 'Recipient not found'}), 404
 
-    # Find or create conversation
-    conversation = Conversation.query.filter(
-        ((Conversation.user1_id == g.user.id) & (Conversation.user2_id == recipient.id)) |
-        ((Conversation.user1_id == recipient.id) & (Conversation.user2_id == g.user.id))
-    ).first()
-
-    if not conversation:
-        conversation = Conversation(
-            user1_id=g.user.id,
-            user2_id=recipient.id
-        )
-        db.session.add(conversation)
-        db.session.commit()
-
-    # Create message
-    message = Message(
-        conversation_id=conversation.id,
-        sender_id=g.user.id,
-        recipient_id=recipient.id,
-        content=content,
-        created_at=datetime.now()
-    )
-    db.session.add(message)
-
-    # Update conversation last_message_at
-    conversation.last_message_at = message.created_at
+    # Find or create conversation (a new one is committed before the message is queued)
+    conversation_id = get_or_create_conversation_id(g.user.id, recipient.id)
     db.session.commit()
 
+    # Messages are only inserted by the writer, which assigns their IDs
+    pending = message_writer.submit(KIND_MESSAGE, {
+        'conversation_id': conversation_id,
+        'sender_id': g.user.id,
+        'recipient_id': recipient.id,
+        'content': content,
+        'created_at': datetime.utcnow(),
+        'read': False
+    }, touch={'conversation_id': conversation_id})
+
+    if not pending.wait(timeout=MESSAGE_ACK_TIMEOUT):
+        return jsonify({'success': False, 'message': 'Error sending message'}), 500
+
     return jsonify({
         'success': True,
         'message': {
-            'id': message.id,
-            'content': message.content,
-            'created_at': message.created_at.isoformat()
+            'id': pending.id,
+            'content': content,
+            'created_at': pending.values['created_at'].isoformat()
         }
     })
 
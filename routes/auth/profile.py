@@ -72,17 +72,18 @@ def edit_profile():
         g.user.username = username
         g.user.bio = bio
 
+        # Pictures are served locally until the background uploads finish
+        from utils.upload import start_upload
+
         # Handle profile picture upload
         if 'profile_pic' in request.files and request.files['profile_pic'].filename:
-            from utils.upload import save_photo
-            profile_pic = save_photo(request.files['profile_pic'])
+            profile_pic, _ = start_upload(request.files['profile_pic'], 'image', g.user.id)
             if profile_pic:
                 g.user.profile_pic = profile_pic
 
         # Handle cover picture upload
         if 'cover_pic' in request.files and request.files['cover_pic'].filename:
-            from utils.upload import save_photo
-            cover_pic = save_photo(request.files['cover_pic'])
+            cover_pic, _ = start_upload(request.files['cover_pic'], 'image', g.user.id)
             if cover_pic:
                 g.user.cover_pic = cover_pic
 
@@ -62,8 +62,8 @@ def register():
             username=username,
             email=email,
             password_hash=generate_password_hash(password, method='pbkdf2:sha256:50000'),
-            created_at=datetime.now(),
-            last_online=datetime.now()
+            created_at=datetime.utcnow(),
+            last_online=datetime.utcnow()
         )
 
         # Add user to database
@@ -142,8 +142,8 @@ def api_register():
         username=username,
         email=email,
         password_hash=generate_password_hash(password, method='pbkdf2:sha256:50000'),
-        created_at=datetime.now(),
-        last_online=datetime.now()
+        created_at=datetime.utcnow(),
+        last_online=datetime.utcnow()
     )
 
     # Add user to database
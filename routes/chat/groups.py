@@ -3,13 +3,30 @@ from datetime import datetime
 from flask import g, request, jsonify
 
 from database import db
-from models import User, ChatGroup, ChatMember, ChatMessage
+from models import User, ChatGroup, ChatMember
 from routes.auth_old import login_required
 from routes.chat import chat_bp
+from utils.chat_membership import (
+    get_member_role, is_chat_member, is_chat_admin, membership_cache,
+    invalidate_chat_members, emit_to_chat_members
+)
+from utils.chat_sync import record_change, CHANGE_MEMBERS
+from utils.message_writer import message_writer, KIND_CHAT_MESSAGE
+from utils.purge import schedule_purge, purge_worker, PURGE_CHAT
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+def post_system_message(chat_id, content):
+    """Queue a system message in a chat through the message writer"""
+    return message_writer.submit(KIND_CHAT_MESSAGE, {
+        'chat_id': chat_id,
+        'user_id': g.user.id,
+        'message_type': 'system',
+        'content': content,
+        'is_deleted': False
+    })
+
 @chat_bp.route('/api/chats/create', methods=['POST'])
 @login_required
 def create_chat():
@@ -44,12 +61,7 @@ def create_chat():
 
         for chat in existing_chats:
             # Check if other user is also a member
-            other_member = ChatMember.query.filter_by(
-                chat_id=chat.id,
-                user_id=other_user_id
-            ).first()
-
-            if other_member:
+            if is_chat_member(chat.id, other_user_id):
                 return jsonify({'id': chat.id})
 
         # Create new direct message chat
@@ -69,7 +81,10 @@ def create_chat():
             ChatMember(chat_id=chat.id, user_id=other_user_id, role='member')
         ]
         db.session.add_all(members)
+        for member in members:
+            record_change(chat.id, CHANGE_MEMBERS, user_id=member.user_id)
         db.session.commit()
+        invalidate_chat_members(chat.id)
 
         return jsonify({'id': chat.id})
 
@@ -90,6 +105,7 @@ def create_chat():
         role='admin'
     )
     db.session.add(member)
+    record_change(chat.id, CHANGE_MEMBERS, user_id=g.user.id)
 
     # Add other members if provided
     if data.get('members'):
@@ -103,8 +119,10 @@ def create_chat():
                         role='member'
                     )
                     db.session.add(member)
+                    record_change(chat.id, CHANGE_MEMBERS, user_id=user_id)
 
     db.session.commit()
+    invalidate_chat_members(chat.id)
 
     return jsonify({'id': chat.id})
 
@@ -113,12 +131,7 @@ def create_chat():
 def get_chat_members(chat_id):
     """Get members of a chat"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     # Get all members
@@ -141,13 +154,7 @@ def get_chat_members(chat_id):
 def add_chat_member(chat_id):
     """Add a member to a chat"""
     # Check if user is an admin of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        role='admin'
-    ).first()
-
-    if not member:
+    if not is_chat_admin(chat_id, g.user.id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     # Check if chat is a group
@@ -166,12 +173,7 @@ def add_chat_member(chat_id):
         return jsonify({'error': 'User not found'}), 404
 
     # Check if user is already a member
-    existing_member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=user_id
-    ).first()
-
-    if existing_member:
+    if is_chat_member(chat_id, user_id):
         return jsonify({'error': 'User is already a member'}), 400
 
     # Add new member
@@ -181,17 +183,21 @@ def add_chat_member(chat_id):
         role='member'
     )
     db.session.add(new_member)
+    record_change(chat_id, CHANGE_MEMBERS, user_id=user_id)
     db.session.commit()
+    invalidate_chat_members(chat_id)
 
     # Create system message
-    system_message = ChatMessage(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        message_type='system',
-        content=f"{g.user.username} added {user.username} to the chat"
-    )
-    db.session.add(system_message)
-    db.session.commit()
+    post_system_message(chat_id, f"{g.user.username} added {user.username} to the chat")
+
+    emit_to_chat_members(chat_id, 'member_added', {
+        'chat_id': chat_id,
+        'member': {
+            'user': user.serialize(),
+            'role': new_member.role,
+            'joined_at': new_member.joined_at.isoformat()
+        }
+    })
 
     return jsonify({'success': True})
 
@@ -200,13 +206,7 @@ def add_chat_member(chat_id):
 def remove_chat_member(chat_id):
     """Remove a member from a chat"""
     # Check if user is an admin of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        role='admin'
-    ).first()
-
-    if not member:
+    if not is_chat_admin(chat_id, g.user.id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     # Check if chat is a group
@@ -225,29 +225,27 @@ def remove_chat_member(chat_id):
         return jsonify({'error': 'Cannot remove yourself from the chat'}), 400
 
     # Check if user is a member
-    member_to_remove = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=user_id
-    ).first()
-
-    if not member_to_remove:
+    if not is_chat_member(chat_id, user_id):
         return jsonify({'error': 'User is not a member of this chat'}), 400
 
     # Get user for system message
     user = User.query.get(user_id)
 
     # Remove member
-    db.session.delete(member_to_remove)
+    ChatMember.query.filter_by(chat_id=chat_id, user_id=user_id).delete()
+    record_change(chat_id, CHANGE_MEMBERS, user_id=user_id)
+    db.session.commit()
 
     # Create system message
-    system_message = ChatMessage(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        message_type='system',
-        content=f"{g.user.username} removed {user.username} from the chat"
-    )
-    db.session.add(system_message)
-    db.session.commit()
+    post_system_message(chat_id, f"{g.user.username} removed {user.username} from the chat")
+
+    # Notify the remaining members and the removed user
+    recipients = [member_id for member_id in membership_cache.get_members(chat_id) if member_id != user_id]
+    invalidate_chat_members(chat_id)
+    emit_to_chat_members(chat_id, 'member_removed', {
+        'chat_id': chat_id,
+        'user_id': user_id
+    }, user_ids=recipients + [user_id])
 
     return jsonify({'success': True})
 
@@ -256,13 +254,7 @@ def remove_chat_member(chat_id):
 def make_chat_admin(chat_id):
     """Make a user an admin of a chat"""
     # Check if user is an admin of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        role='admin'
-    ).first()
-
-    if not member:
+    if not is_chat_admin(chat_id, g.user.id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     # Check if chat is a group
@@ -277,33 +269,25 @@ def make_chat_admin(chat_id):
     user_id = data.get('user_id')
 
     # Check if user is a member
-    member_to_promote = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=user_id
-    ).first()
-
-    if not member_to_promote:
+    role = get_member_role(chat_id, user_id)
+    if role is None:
         return jsonify({'error': 'User is not a member of this chat'}), 400
 
     # Already an admin
-    if member_to_promote.role == 'admin':
+    if role == 'admin':
         return jsonify({'error': 'User is already an admin'}), 400
 
     # Get user for system message
     user = User.query.get(user_id)
 
     # Promote to admin
-    member_to_promote.role = 'admin'
+    ChatMember.query.filter_by(chat_id=chat_id, user_id=user_id).update({'role': 'admin'})
+    record_change(chat_id, CHANGE_MEMBERS, user_id=user_id)
+    db.session.commit()
+    invalidate_chat_members(chat_id)
 
     # Create system message
-    system_message = ChatMessage(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        message_type='system',
-        content=f"{g.user.username} made {user.username} an admin"
-    )
-    db.session.add(system_message)
-    db.session.commit()
+    post_system_message(chat_id, f"{g.user.username} made {user.username} an admin")
 
     return jsonify({'success': True})
 
@@ -312,12 +296,10 @@ def make_chat_admin(chat_id):
 def leave_chat(chat_id):
     """Leave a chat"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
+    members = membership_cache.get_members(chat_id)
+    role = members.get(g.user.id)
 
-    if not member:
+    if role is None:
         return jsonify({'error': 'Not a member of this chat'}), 403
 
     # Check if chat is a group
@@ -325,45 +307,40 @@ def leave_chat(chat_id):
     if not chat.is_group:
         return jsonify({'error': 'Cannot leave direct messages'}), 400
 
+    other_ids = [user_id for user_id in members if user_id != g.user.id]
+
     # Check if user is the only admin
-    if member.role == 'admin':
-        admin_count = ChatMember.query.filter_by(
-            chat_id=chat_id,
-            role='admin'
-        ).count()
+    if role == 'admin':
+        admin_count = sum(1 for member_role in members.values() if member_role == 'admin')
 
         if admin_count == 1:
             # Find another member to promote
-            other_member = ChatMember.query.filter(
-                ChatMember.chat_id == chat_id,
-                ChatMember.user_id != g.user.id
-            ).first()
-
-            if other_member:
-                other_member.role = 'admin'
+            if other_ids:
+                ChatMember.query.filter_by(chat_id=chat_id, user_id=other_ids[0]).update({'role': 'admin'})
+                record_change(chat_id, CHANGE_MEMBERS, user_id=other_ids[0])
             else:
-                # No other members, delete the chat
-                chat_messages = ChatMessage.query.filter_by(chat_id=chat_id).all()
-                for message in chat_messages:
-                    db.session.delete(message)
-
-                db.session.delete(chat)
-                db.session.delete(member)
+                # No other members, delete the chat; messages are purged in the background
+                ChatMember.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+                ChatGroup.query.filter_by(id=chat_id).delete(synchronize_session=False)
+                schedule_purge(PURGE_CHAT, chat_id)
                 db.session.commit()
+                invalidate_chat_members(chat_id)
+                purge_worker.wake()
 
                 return jsonify({'success': True})
 
-    # Create system message
-    system_message = ChatMessage(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        message_type='system',
-        content=f"{g.user.username} left the chat"
-    )
-    db.session.add(system_message)
-
     # Remove user from chat
-    db.session.delete(member)
+    ChatMember.query.filter_by(chat_id=chat_id, user_id=g.user.id).delete()
+    record_change(chat_id, CHANGE_MEMBERS, user_id=g.user.id)
     db.session.commit()
+    invalidate_chat_members(chat_id)
+
+    # Create system message
+    post_system_message(chat_id, f"{g.user.username} left the chat")
+
+    emit_to_chat_members(chat_id, 'member_removed', {
+        'chat_id': chat_id,
+        'user_id': g.user.id
+    }, user_ids=other_ids)
 
     return jsonify({'success': True})
@@ -7,10 +7,22 @@ from database import db
 from models import User, ChatGroup, ChatMember, ChatMessage, MessageReadReceipt
 from routes.auth_old import login_required
 from routes.chat import chat_bp
+from utils.chat_history import DEFAULT_PAGE_SIZE, fetch_message_page, serialize_message_page
+from utils.chat_sync import (
+    DEFAULT_SYNC_LIMIT, CHANGE_DELETE, record_change, get_sync_cursor, is_cursor_expired,
+    fetch_changes, serialize_changes
+)
+from utils.chat_membership import (
+    is_chat_member, is_chat_admin, get_chat_member_ids, mark_chat_read, emit_to_chat_members
+)
+from utils.message_writer import message_writer, KIND_CHAT_MESSAGE
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a message to be written before reporting failure
+MESSAGE_ACK_TIMEOUT = 5
+
 @chat_bp.route('/')
 @login_required
 def messages():
@@ -22,12 +34,7 @@ def messages():
 def view_chat(chat_id):
     """View a specific chat"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         abort(403)
 
     chat = ChatGroup.query.get_or_404(chat_id)
@@ -40,7 +47,8 @@ def get_chats():
     """Get all chats for the current user"""
     # Get all chat groups where user is a member
     memberships = ChatMember.query.filter_by(user_id=g.user.id).all()
-    chat_ids = [membership.chat_id for membership in memberships]
+    last_read = {membership.chat_id: membership.last_read for membership in memberships}
+    chat_ids = list(last_read)
 
     chats = ChatGroup.query.filter(ChatGroup.id.in_(chat_ids)).all()
 
@@ -53,16 +61,11 @@ def get_chats():
         ).order_by(desc(ChatMessage.created_at)).first()
 
         # Get unread count
-        member = ChatMember.query.filter_by(
-            chat_id=chat.id,
-            user_id=g.user.id
-        ).first()
-
         unread_count = 0
-        if member and member.last_read:
+        if last_read.get(chat.id):
             unread_count = ChatMessage.query.filter(
                 ChatMessage.chat_id == chat.id,
-                ChatMessage.created_at > member.last_read,
+                ChatMessage.created_at > last_read[chat.id],
                 ChatMessage.user_id != g.user.id,
                 ChatMessage.is_deleted == False
             ).count()
@@ -70,13 +73,10 @@ def get_chats():
         # Check if this is a direct message
         other_user = None
         if not chat.is_group:
-            other_member = ChatMember.query.filter(
-                ChatMember.chat_id == chat.id,
-                ChatMember.user_id != g.user.id
-            ).first()
+            other_ids = [user_id for user_id in get_chat_member_ids(chat.id) if user_id != g.user.id]
 
-            if other_member:
-                other_user = User.query.get(other_member.user_id)
+            if other_ids:
+                other_user = User.query.get(other_ids[0])
 
         chat_data = {
             'id': chat.id,
@@ -97,12 +97,7 @@ def get_chats():
 def get_chat_messages(chat_id):
     """Get messages for a specific chat"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     # Get pagination parameters
@@ -118,7 +113,7 @@ def get_chat_messages(chat_id):
     )
 
     # Update last read timestamp
-    member.last_read = datetime.utcnow()
+    mark_chat_read(chat_id, g.user.id, datetime.utcnow())
     db.session.commit()
 
     # Format response
@@ -136,17 +131,68 @@ def get_chat_messages(chat_id):
 
     return jsonify(result)
 
+@chat_bp.route('/api/chats/<int:chat_id>/messages/history')
+@login_required
+def get_chat_history(chat_id):
+    """Get a page of messages before or after a message ID"""
+    # Check if user is a member of this chat
+    if not is_chat_member(chat_id, g.user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    # Get cursor parameters
+    before_id = request.args.get('before', type=int)
+    after_id = request.args.get('after', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+
+    if before_id is not None and after_id is not None:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
+
+    messages, has_more = fetch_message_page(chat_id, before_id=before_id, after_id=after_id, limit=limit)
+
+    # Only the latest page marks the chat as read
+    if before_id is None and after_id is None:
+        mark_chat_read(chat_id, g.user.id, datetime.utcnow())
+        db.session.commit()
+
+    result = serialize_message_page(messages)
+    result['has_more'] = has_more
+    result['cursors'] = {
+        'before': messages[0].id if messages else before_id,
+        'after': messages[-1].id if messages else after_id
+    }
+
+    return jsonify(result)
+
+@chat_bp.route('/api/sync')
+@login_required
+def sync_chats():
+    """Get changes across all of the user's chats since a sync cursor"""
+    cursor = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', DEFAULT_SYNC_LIMIT, type=int)
+
+    # No cursor, or changes already pruned: the client must reload and start from here
+    if cursor is None or is_cursor_expired(cursor):
+        return jsonify({
+            'reset': True,
+            'cursor': get_sync_cursor(),
+            'has_more': False
+        })
+
+    changes, has_more = fetch_changes(g.user.id, cursor, limit=limit)
+
+    result = serialize_changes(changes)
+    result['reset'] = False
+    result['cursor'] = changes[-1].id if changes else cursor
+    result['has_more'] = has_more
+
+    return jsonify(result)
+
 @chat_bp.route('/api/chats/<int:chat_id>/messages/send', methods=['POST'])
 @login_required
 def handle_send_message(chat_id):
     """Send a message to a chat"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         return jsonify({'error': 'Not a member of this chat'}), 403
 
     data = request.json
@@ -160,20 +206,20 @@ def handle_send_message(chat_id):
     if not content and not media_url:
         return jsonify({'error': 'Message cannot be empty'}), 400
 
-    # Create message in database
-    message = ChatMessage(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        message_type=message_type,
-        content=content,
-        media_url=media_url
-    )
-    db.session.add(message)
-    db.session.flush()  # Get message ID without committing
+    # Hand the message to the group-commit writer, the database assigns its ID
+    pending = message_writer.submit(KIND_CHAT_MESSAGE, {
+        'chat_id': chat_id,
+        'user_id': g.user.id,
+        'message_type': message_type,
+        'content': content,
+        'media_url': media_url,
+        'is_deleted': False
+    }, touch={'chat_id': chat_id, 'user_id': g.user.id})
 
-    # Update last read timestamp for sending user
-    member.last_read = datetime.utcnow()
-    db.session.commit()
+    # Publish only once the message is durable
+    if not pending.wait(timeout=MESSAGE_ACK_TIMEOUT):
+        return jsonify({'error': 'Message could not be saved'}), 500
+    created_at = pending.values['created_at'].isoformat()
 
     # Get MQTT client and publish message
     from routes.chat.realtime import get_chat_mqtt_client, get_chat_topic
@@ -182,7 +228,7 @@ def handle_send_message(chat_id):
 
     message_payload = {
         'type': 'message',
-        'message_id': message.id,
+        'message_id': pending.id,
         'chat_id': chat_id,
         'user': {
             'id': g.user.id,
@@ -192,13 +238,31 @@ def handle_send_message(chat_id):
         'message_type': message_type,
         'content': content,
         'media_url': media_url,
-        'created_at': message.created_at.isoformat(),
+        'created_at': created_at,
         'is_deleted': False
     }
 
     client.publish(topic, message_payload)
 
-    return jsonify(message.serialize())
+    message_data = {
+        'id': pending.id,
+        'chat_id': chat_id,
+        'user_id': g.user.id,
+        'sender': g.user.username,
+        'profile_pic': g.user.profile_pic,
+        'message_type': message_type,
+        'content': content,
+        'media_url': media_url,
+        'created_at': created_at,
+        'updated_at': created_at,
+        'is_deleted': False,
+        'read_by': []
+    }
+
+    # Notify connected members through their personal rooms
+    emit_to_chat_members(chat_id, 'new_message', message_data)
+
+    return jsonify(message_data)
 
 @chat_bp.route('/api/chats/<int:chat_id>/messages/<int:message_id>/delete', methods=['POST'])
 @login_required
@@ -215,11 +279,7 @@ def handle_delete_message(chat_id, message_id):
 
     # Only message author or chat admin can delete messages
     is_author = message.user_id == g.user.id
-    is_admin = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id,
-        role='admin'
-    ).first() is not None
+    is_admin = is_chat_admin(chat_id, g.user.id)
 
     if not (is_author or is_admin):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -228,6 +288,7 @@ def handle_delete_message(chat_id, message_id):
     message.is_deleted = True
     message.content = "[This message was deleted]"
     message.media_url = None
+    record_change(chat_id, CHANGE_DELETE, user_id=g.user.id, message_id=message_id)
     db.session.commit()
 
     # Send delete notification via MQTT
@@ -246,6 +307,13 @@ def handle_delete_message(chat_id, message_id):
 
     client.publish(topic, delete_payload)
 
+    emit_to_chat_members(chat_id, 'message_deleted', {
+        'id': message_id,
+        'chat_id': chat_id,
+        'content': message.content,
+        'is_deleted': True
+    })
+
     return jsonify({'success': True})
 
 @chat_bp.route('/api/chats/<int:chat_id>/messages/read', methods=['POST'])
@@ -253,12 +321,7 @@ def handle_delete_message(chat_id, message_id):
 def handle_read_messages(chat_id):
     """Mark messages as read"""
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         return jsonify({'error': 'Not a member of this chat'}), 403
 
     data = request.json
@@ -284,7 +347,7 @@ def handle_read_messages(chat_id):
             db.session.add(receipt)
 
     # Update last read timestamp
-    member.last_read = datetime.utcnow()
+    mark_chat_read(chat_id, g.user.id, datetime.utcnow())
     db.session.commit()
 
     # Send read notification via MQTT
@@ -303,4 +366,6 @@ def handle_read_messages(chat_id):
 
     client.publish(topic, read_payload)
 
+    emit_to_chat_members(chat_id, 'messages_read', read_payload)
+
     return jsonify({'success': True})
@@ -6,7 +6,7 @@ from urllib.parse import quote_plus
 
 from routes.auth_old import login_required
 from routes.chat import chat_bp
-from models import ChatMember
+from utils.chat_membership import is_chat_member
 from utils.mqtt_client import get_mqtt_client
 
 # Set up logger
@@ -60,12 +60,7 @@ def handle_join_chat(chat_id=None):
         return jsonify({'error': 'No chat ID provided'}), 400
 
     # Check if user is a member of this chat
-    member = ChatMember.query.filter_by(
-        chat_id=chat_id,
-        user_id=g.user.id
-    ).first()
-
-    if not member:
+    if not is_chat_member(chat_id, g.user.id):
         return jsonify({'error': 'Not a member of this chat'}), 403
 
     # Subscribe to chat topic
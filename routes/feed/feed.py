@@ -5,7 +5,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from sqlalchemy import desc, func
 
 from database import db
-from utils.upload import save_photo
+from utils.upload import save_photos
 from flask import current_app
 from models import User, Post, PostMedia, PostLike, Comment, Story, Friend, Follower, Notification
 from routes.auth_old import login_required
@@ -109,25 +109,24 @@ def create_post():
             db.session.add(post)
             db.session.flush()  # Get post ID without committing
 
-            # Handle media files if any
-            media_files = request.files.getlist('media')
-            for media_file in media_files:
-                if media_file and media_file.filename:
-                    media_path = save_photo(media_file)
-                    if not media_path:
-                        continue
-                    # Check if the media_path is already a full URL (from external services)
-                    if media_path.startswith(('http://', 'https://')):
-                        media_url = media_path
-                    else:
-                        # For local files, don't use url_for to avoid host/static prefix
-                        media_url = media_path
-                    post_media = PostMedia(
-                        post_id=post.id,
-                        media_type='image',
-                        media_url=media_url
-                    )
-                    db.session.add(post_media)
+            # Handle media files if any, all of them are uploaded side by side
+            media_files = [media_file for media_file in request.files.getlist('media')
+                           if media_file and media_file.filename]
+            for media_path in save_photos(media_files):
+                if not media_path:
+                    continue
+                # Check if the media_path is already a full URL (from external services)
+                if media_path.startswith(('http://', 'https://')):
+                    media_url = media_path
+                else:
+                    # For local files, don't use url_for to avoid host/static prefix
+                    media_url = media_path
+                post_media = PostMedia(
+                    post_id=post.id,
+                    media_type='image',
+                    media_url=media_url
+                )
+                db.session.add(post_media)
 
             db.session.commit()
 
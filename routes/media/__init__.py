@@ -0,0 +1,11 @@
+import logging
+from flask import Blueprint
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+media_bp = Blueprint('media', __name__, url_prefix='/media')
+
+# Note: Route modules will be imported in each module file
+# to avoid circular imports
@@ -0,0 +1,11 @@
+import logging
+from routes.media import media_bp
+from utils.media_files import media_server
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+@media_bp.route('/<kind>/<path:name>', methods=['GET'])
+def serve_media(kind, name):
+    """Serve a locally stored upload or image derivative, with Range and ETag support"""
+    return media_server.send(kind, name)
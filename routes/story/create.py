@@ -5,7 +5,8 @@ from routes.story import story_bp
 from routes.auth_old import login_required
 from database import db
 from models import Story, User
-from utils.multi_upload import save_multi_uploads
+from utils.upload import start_upload
+from utils.image_derivatives import placeholder_for
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -36,12 +37,13 @@ def create_story():
         if 'media' in request.files and request.files['media'].filename:
             file = request.files['media']
             
-            # Upload to external services
-            urls = save_multi_uploads(file)
-            if urls:
-                # Use the first successful URL
-                story.media_url = urls[0]
-                story.story_type = 'image'
+            # Served locally until external hosts have it, the user is told over Socket.IO
+            media_type = 'video' if (file.mimetype or '').startswith('video/') else 'image'
+            media_url, job_id = start_upload(file, media_type, g.user.id)
+            if media_url:
+                story.media_url = media_url
+                story.story_type = media_type
+                story.placeholder = placeholder_for(media_url)
         
         db.session.add(story)
         db.session.commit()
@@ -3,10 +3,17 @@ Shared SocketIO instance to avoid circular imports
 """
 import logging
 from flask_socketio import SocketIO
+from utils.socket_bus import create_client_manager
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Share emits between worker processes when a message bus is configured
+options = {}
+client_manager = create_client_manager()
+if client_manager is not None:
+    options['client_manager'] = client_manager
+
 # Create a shared SocketIO instance
 socketio = SocketIO(
     cors_allowed_origins="*",
@@ -15,7 +22,8 @@ socketio = SocketIO(
     engineio_logger=True,
     ping_timeout=20,
     ping_interval=10,
-    max_http_buffer_size=1024 * 1024
+    max_http_buffer_size=1024 * 1024,
+    **options
 )
 
 logger.info("SocketIO instance created with threading mode")
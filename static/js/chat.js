@@ -13,6 +13,8 @@ const chatModule = (function() {
   let hasMoreMessages = true;
   let currentPage = 1;
   let membersContainer;
+  let syncCursor = null;
+  let isSyncing = false;
   
   // Initialize chat
   function init() {
@@ -27,6 +29,11 @@ const chatModule = (function() {
     const chatIdMatch = window.location.pathname.match(/\/chat\/(\d+)/);
     chatId = chatIdMatch ? chatIdMatch[1] : null;
     
+    // Take the sync cursor before loading so later changes are not missed
+    if (chatList || (chatMessages && chatId)) {
+      initSync();
+    }
+    
     // Initialize chat list if present
     if (chatList) {
       loadChatList();
@@ -1244,6 +1251,98 @@ const chatModule = (function() {
     }
   }
   
+  // Start delta sync from the current cursor; the page load itself is a full load
+  function initSync() {
+    fetchSyncCursor();
+    
+    // Catch up when the tab becomes visible again
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'visible') {
+        syncChanges();
+      }
+    });
+  }
+  
+  // Get the current cursor without any changes
+  function fetchSyncCursor() {
+    fetch('/chat/api/sync')
+      .then(response => response.json())
+      .then(data => saveSyncCursor(data.cursor))
+      .catch(error => {
+        console.error('Error getting sync cursor:', error);
+      });
+  }
+  
+  function saveSyncCursor(cursor) {
+    syncCursor = String(cursor);
+  }
+  
+  // Fetch and apply only what changed since the last sync (e.g. after a reconnect)
+  function syncChanges() {
+    if (syncCursor === null || isSyncing) return;
+    isSyncing = true;
+    
+    fetch(`/chat/api/sync?cursor=${encodeURIComponent(syncCursor)}`)
+      .then(response => response.json())
+      .then(data => {
+        isSyncing = false;
+        
+        if (data.reset) {
+          // Too far behind, reload everything from scratch
+          saveSyncCursor(data.cursor);
+          if (chatList) loadChatList();
+          if (chatMessages && chatId) loadChatMessages();
+          return;
+        }
+        
+        applySyncChanges(data);
+        saveSyncCursor(data.cursor);
+        
+        if (data.has_more) {
+          syncChanges();
+        }
+      })
+      .catch(error => {
+        isSyncing = false;
+        console.error('Error syncing chats:', error);
+      });
+  }
+  
+  // Apply a delta returned by the sync endpoint
+  function applySyncChanges(data) {
+    data.messages.forEach(message => {
+      const sender = data.users[message.user_id] || {};
+      message.sender = sender.username;
+      message.profile_pic = sender.profile_pic;
+      
+      if (chatMessages && String(message.chat_id) === String(chatId) &&
+          !chatMessages.querySelector(`.message-item[data-message-id="${message.id}"]`)) {
+        appendMessage(message);
+      }
+      updateChatList(message.chat_id, message);
+    });
+    
+    data.deleted.forEach(message => {
+      if (String(message.chat_id) === String(chatId)) {
+        updateDeletedMessage(message);
+      }
+    });
+    
+    data.read.forEach(read => {
+      if (String(read.chat_id) === String(chatId) && String(read.user_id) !== String(getCurrentUserId())) {
+        updateReadReceipts(read);
+      }
+    });
+    
+    // Membership changed: refresh the list and the member panel
+    if (data.chats.length > 0) {
+      if (chatList) loadChatList();
+      if (membersContainer && data.chats.some(id => String(id) === String(chatId))) {
+        loadChatMembers();
+      }
+    }
+  }
+  
   // Get current user ID
   function getCurrentUserId() {
     const userIdEl = document.getElementById('current-user-id');
@@ -1265,7 +1364,8 @@ const chatModule = (function() {
     removeMember,
     loadChatMessages,
     loadChatMembers,
-    loadChatList
+    loadChatList,
+    syncChanges
   };
 })();
 
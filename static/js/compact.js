@@ -0,0 +1,94 @@
+// Compact (MessagePack) socket event payloads, negotiated per connection
+
+const compactEvents = (function() {
+  // Decoded payloads, so every handler of an event sees the same object
+  const decoded = new WeakMap();
+
+  // Wrap a socket so its handlers receive decoded payloads, then ask the server for compact encoding
+  function attach(socket) {
+    if (!socket || socket.compactAttached || typeof MessagePack === 'undefined') {
+      return socket;
+    }
+    socket.compactAttached = true;
+
+    // Alias tables sent by the server, and sender profiles interned on this connection
+    let schema = null;
+    let profiles = {};
+
+    const on = socket.on.bind(socket);
+    const onAny = socket.onAny.bind(socket);
+
+    socket.on = function(event, handler) {
+      return on(event, function(...args) {
+        return handler.apply(this, args.map(decode));
+      });
+    };
+
+    socket.onAny = function(handler) {
+      return onAny(function(event, ...args) {
+        return handler.call(this, event, ...args.map(decode));
+      });
+    };
+
+    // The server sends the schema before its first compact payload
+    on('encoding_selected', function(data) {
+      schema = data && data.encoding === 'msgpack' ? data : null;
+    });
+
+    // Every connection starts with JSON and an empty profile table
+    on('connect', function() {
+      schema = null;
+      profiles = {};
+      socket.emit('negotiate_encoding', { encodings: ['msgpack'] });
+    });
+
+    function decode(arg) {
+      if (!(arg instanceof ArrayBuffer) || !schema) return arg;
+      if (decoded.has(arg)) return decoded.get(arg);
+
+      const [newProfiles, body] = MessagePack.decode(new Uint8Array(arg));
+      (newProfiles || []).forEach(function([id, name, pic]) {
+        profiles[id] = [name, pic];
+      });
+
+      const data = expand(body);
+      decoded.set(arg, data);
+      return data;
+    }
+
+    function expand(value) {
+      if (Array.isArray(value)) return value.map(expand);
+      if (value === null || typeof value !== 'object') return value;
+
+      const result = {};
+      Object.keys(value).forEach(function(key) {
+        if (key === schema.profile_key) return;
+        const name = schema.keys[key] || key;
+        if (schema.timestamps.includes(key) && typeof value[key] === 'number') {
+          result[name] = new Date(value[key]).toISOString();
+        } else {
+          result[name] = expand(value[key]);
+        }
+      });
+
+      // Restore the interned sender profile
+      if (schema.profile_key in value) {
+        const [idField, nameField, picField] = schema.profiles[value[schema.profile_key]];
+        const profile = profiles[result[idField]];
+        if (profile) {
+          result[nameField] = profile[0];
+          result[picField] = profile[1];
+        }
+      }
+      return result;
+    }
+
+    return socket;
+  }
+
+  return {
+    attach: attach
+  };
+})();
+
+window.compactEvents = compactEvents;
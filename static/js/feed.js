@@ -180,11 +180,13 @@ const feedModule = (function() {
     // Create media HTML if post has media
     let mediaHTML = '';
     if (post.media && post.media.length > 0) {
+      const placeholders = post.media_placeholders || [];
+
       if (post.media.length === 1) {
         // Single image
         mediaHTML = `
           <div class="post-media">
-            <img class="img-fluid rounded" data-src="${post.media[0].media_url}" alt="Post image">
+            ${lazyImageHTML(post.media[0], placeholders[0], 'img-fluid rounded', 'Post image')}
           </div>
         `;
       } else {
@@ -196,7 +198,7 @@ const feedModule = (function() {
 
         const slides = post.media.map((media, index) => `
           <div class="carousel-item ${index === 0 ? 'active' : ''}">
-            <img class="d-block w-100" data-src="${media.media_url}" alt="Post image ${index + 1}">
+            ${lazyImageHTML(media, placeholders[index], 'd-block w-100', `Post image ${index + 1}`)}
           </div>
         `).join('');
 
@@ -680,6 +682,32 @@ const feedModule = (function() {
     return userIdEl ? userIdEl.value : null;
   }
 
+  // Image loaded lazily, showing the inline placeholder (if any) until it arrives
+  function lazyImageHTML(media, placeholder, className, alt) {
+    const url = typeof media === 'string' ? media : media.media_url;
+    if (!placeholder) {
+      return `<img class="${className}" data-src="${url}" alt="${alt}">`;
+    }
+    return `<img class="${className} lqip" src="${placeholder}" data-src="${url}" alt="${alt}">`;
+  }
+
+  // Swap an image to its full source once it has been downloaded
+  function loadFullImage(img, src) {
+    if (!img.classList.contains('lqip')) {
+      img.src = src;
+      return;
+    }
+
+    // Keep the placeholder on screen instead of a blank box while downloading
+    const full = new Image();
+    full.onload = () => {
+      img.src = src;
+      img.classList.remove('lqip');
+    };
+    full.onerror = () => img.classList.remove('lqip');
+    full.src = src;
+  }
+
   // Lazy load images
   function lazyLoadImages() {
     // Check if IntersectionObserver is supported
@@ -691,7 +719,7 @@ const feedModule = (function() {
             const src = img.getAttribute('data-src');
 
             if (src && src !== 'undefined') {
-              img.src = src;
+              loadFullImage(img, src);
               img.removeAttribute('data-src');
               img.classList.remove('lazy-load');
             } else {
@@ -718,7 +746,7 @@ const feedModule = (function() {
       lazyImages.forEach(img => {
         const src = img.getAttribute('data-src');
         if (src && src !== 'undefined') {
-          img.src = src;
+          loadFullImage(img, src);
           img.removeAttribute('data-src');
           img.classList.remove('lazy-load');
         } else {
@@ -8,6 +8,11 @@ const realtimeModule = (function() {
   let messageHandlers = {};
   let userId = null;
   let username = null;
+  
+  // Last event sequence received, kept across page loads so gaps can be replayed
+  const SEQ_STORAGE_KEY = 'realtimeEventSeq';
+  let lastSeq = null;
+  let epoch = null;
 
   // Initialize Socket.IO connection
   function init() {
@@ -21,14 +26,26 @@ const realtimeModule = (function() {
         console.log('Current user ID:', userId);
       }
 
+      loadSequence();
+      
       // Initialize Socket.IO with proper configuration
-      socket = io({
+      const options = {
         transports: ['websocket', 'polling'],
         reconnection: true,
         reconnectionAttempts: 5,
         reconnectionDelay: 1000,
-        timeout: 20000
-      });
+        timeout: 20000,
+        withCredentials: true
+      };
+
+      // Connect to the standalone realtime gateway when one is configured
+      const gatewayMeta = document.querySelector('meta[name="realtime-url"]');
+      socket = gatewayMeta ? io(gatewayMeta.content, options) : io(options);
+
+      // Use compact binary payloads when the decoder is available
+      if (window.compactEvents) {
+        window.compactEvents.attach(socket);
+      }
 
       // Connection established
       socket.on('connect', function() {
@@ -58,6 +75,31 @@ const realtimeModule = (function() {
         console.error('Socket.IO connection error:', error);
       });
 
+      // Track the sequence of every event sent to this user (runs before the event handlers)
+      socket.onAny(function(eventName, data) {
+        if (!data || typeof data.seq !== 'number') return;
+
+        // Sequenced by another server process: deliver without tracking
+        if (data.epoch && epoch !== null && data.epoch !== epoch) return;
+        
+        if (lastSeq !== null && data.seq <= lastSeq) {
+          data.duplicate = true;
+        } else {
+          saveSequence(epoch, data.seq);
+        }
+      });
+      
+      // Missed events are no longer buffered on the server
+      socket.on('resync_required', function(data) {
+        console.log('Realtime resync required:', data);
+        saveSequence(data.epoch, data.seq);
+        
+        if (window.chatModule && window.chatModule.syncChanges) {
+          window.chatModule.syncChanges();
+        }
+        document.dispatchEvent(new CustomEvent('realtime-resync', { detail: data }));
+      });
+
       // Authentication response
       socket.on('auth_response', function(data) {
         console.log('Authentication response:', data);
@@ -65,6 +107,11 @@ const realtimeModule = (function() {
           authenticated = true;
           userId = data.user_id;
           username = data.username;
+          
+          // Start from the server's sequence unless a replay already brought us up to date
+          if (data.epoch !== epoch || lastSeq === null) {
+            saveSequence(data.epoch, data.seq);
+          }
           console.log('Successfully authenticated as:', username);
         } else {
           console.error('Authentication failed:', data.message);
@@ -88,6 +135,15 @@ const realtimeModule = (function() {
         console.log('Connected confirmation:', data);
       });
 
+      // Uploads finishing in the background
+      socket.on('upload_progress', function(data) {
+        handleUploadUpdate('upload-progress', data);
+      });
+
+      socket.on('upload_complete', function(data) {
+        handleUploadUpdate('upload-complete', data);
+      });
+
       // Set up event listeners for page visibility and network changes
       document.addEventListener('visibilitychange', handleVisibilityChange);
       window.addEventListener('online', handleOnline);
@@ -129,7 +185,38 @@ const realtimeModule = (function() {
     }
 
     console.log('Sending authentication request...');
-    socket.emit('auth', {});
+    
+    // Ask for the events missed since the last one we saw
+    const authData = {};
+    if (lastSeq !== null && epoch !== null) {
+      authData.last_seq = lastSeq;
+      authData.epoch = epoch;
+    }
+    socket.emit('auth', authData);
+  }
+  
+  // Load the last seen event sequence
+  function loadSequence() {
+    try {
+      const stored = JSON.parse(sessionStorage.getItem(SEQ_STORAGE_KEY));
+      if (stored && String(stored.userId) === String(userId)) {
+        epoch = stored.epoch;
+        lastSeq = stored.seq;
+      }
+    } catch (error) {
+      console.warn('Could not load realtime sequence:', error);
+    }
+  }
+  
+  // Remember the last seen event sequence
+  function saveSequence(newEpoch, seq) {
+    epoch = newEpoch;
+    lastSeq = seq;
+    try {
+      sessionStorage.setItem(SEQ_STORAGE_KEY, JSON.stringify({ userId: userId, epoch: epoch, seq: seq }));
+    } catch (error) {
+      console.warn('Could not save realtime sequence:', error);
+    }
   }
 
   // Send message to server
@@ -154,6 +241,11 @@ const realtimeModule = (function() {
     try {
       // Log message for debugging
       console.log('Message received:', data);
+      
+      // Skip events that were already delivered
+      if (data && data.duplicate) {
+        return;
+      }
 
       // Call appropriate handler based on message type
       if (data && data.type && messageHandlers[data.type]) {
@@ -168,6 +260,18 @@ const realtimeModule = (function() {
     }
   }
 
+  // Swap a provisional local URL for the hosted one once an external service has the file
+  function handleUploadUpdate(eventName, data) {
+    if (data.provisional_url && data.url && data.url !== data.provisional_url) {
+      document.querySelectorAll('img, video, source').forEach(function(element) {
+        if (element.getAttribute('src') === data.provisional_url) {
+          element.setAttribute('src', data.url);
+        }
+      });
+    }
+    document.dispatchEvent(new CustomEvent(eventName, { detail: data }));
+  }
+
   // Register message handler
   function on(messageType, callback) {
     messageHandlers[messageType] = callback;
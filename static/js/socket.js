@@ -3,6 +3,7 @@
 let socket;
 let socketConnected = false;
 let reconnectAttempts = 0;
+let hasConnectedBefore = false;
 const MAX_RECONNECT_ATTEMPTS = 5;
 
 // Initialize Socket.IO connection
@@ -16,6 +17,11 @@ function initializeSocket() {
     timeout: 10000
   });
   
+  // Use compact binary payloads when the decoder is available
+  if (window.compactEvents) {
+    window.compactEvents.attach(socket);
+  }
+  
   // Socket connection event handlers
   socket.on('connect', handleSocketConnect);
   socket.on('disconnect', handleSocketDisconnect);
@@ -51,6 +57,12 @@ function handleSocketConnect() {
   // Join user's notification room
   joinUserRoom();
   
+  // Fetch only what was missed while disconnected
+  if (hasConnectedBefore && typeof window.chatModule !== 'undefined' && window.chatModule.syncChanges) {
+    window.chatModule.syncChanges();
+  }
+  hasConnectedBefore = true;
+  
   // Show connection status
   updateConnectionStatus(true);
 }
@@ -382,14 +382,24 @@ const storyModule = (function() {
           </div>
         </div>
       `;
-    } else if (story.story_type === 'photo') {
-      // Photo story
+    } else if (story.story_type === 'photo' || story.story_type === 'image') {
+      // Photo story, its inline placeholder is shown until the photo has been downloaded
       storyItemsContainer.innerHTML = `
         <div class="story-image-content">
-          <img src="${story.media_url}" alt="Story" class="img-fluid">
+          <img src="${story.placeholder || story.media_url}" alt="Story" class="img-fluid ${story.placeholder ? 'lqip' : ''}">
           ${story.content ? `<div class="story-caption p-3">${story.content}</div>` : ''}
         </div>
       `;
+
+      if (story.placeholder) {
+        const img = storyItemsContainer.querySelector('img');
+        const full = new Image();
+        full.onload = () => {
+          img.src = story.media_url;
+          img.classList.remove('lqip');
+        };
+        full.src = story.media_url;
+      }
     } else if (story.story_type === 'video') {
       // Video story
       storyItemsContainer.innerHTML = `
@@ -0,0 +1,130 @@
+import queue
+import unittest
+import msgpack
+from utils.backpressure import OutboundGuard, classify_event
+from utils.compact_events import CompactEncoder
+
+class FakeEngineSocket:
+    def __init__(self, depth):
+        self.queue = queue.Queue()
+        for _ in range(depth):
+            self.queue.put(None)
+
+class FakeManager:
+    def __init__(self, rooms):
+        self.rooms = rooms
+
+    def get_participants(self, namespace, room):
+        for sid in self.rooms[room]:
+            yield sid, f'eio_{sid}'
+
+    def eio_sid_from_sid(self, sid, namespace):
+        return f'eio_{sid}' if sid in self.rooms[None] else None
+
+class FakeEngine:
+    def __init__(self):
+        self.sockets = {}
+
+class FakeServer:
+    def __init__(self, rooms):
+        self.manager = FakeManager(rooms)
+        self.eio = FakeEngine()
+        self.disconnected = []
+        self.emitted = []
+
+    def disconnect(self, sid, namespace=None):
+        self.disconnected.append(sid)
+
+    def emit(self, event, data, to=None, namespace=None, ignore_queue=False):
+        self.emitted.append((event, data, to))
+
+class FakeSocketIO:
+    def __init__(self, rooms):
+        self.server = FakeServer(rooms)
+        self.emitted = []
+
+    def emit(self, event, data, room=None, to=None, skip_sid=None, namespace=None):
+        self.emitted.append((event, data, to or room, sorted(skip_sid or [])))
+
+    def start_background_task(self, target):
+        pass
+
+class OutboundGuardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.socketio = FakeSocketIO({None: ['fast', 'slow', 'stuck'], 'user_1': ['slow']})
+        self.set_depth('fast', 0)
+        self.set_depth('slow', 10)
+        self.set_depth('stuck', 100)
+        self.guard = OutboundGuard(self.socketio, soft_limit=5, hard_limit=50, flush_interval_ms=10)
+
+    def set_depth(self, sid, depth):
+        self.socketio.server.eio.sockets[f'eio_{sid}'] = FakeEngineSocket(depth)
+
+    def test_classification(self):
+        self.assertEqual(classify_event('typing', {'user_id': 1}), (True, None))
+        self.assertEqual(classify_event('typing_stopped', {'user_id': 1, 'conversation_id': 4}),
+                         (True, 'typing_stopped:1:4'))
+        self.assertEqual(classify_event('user_status', {'user_id': 1}), (True, 'user_status:1'))
+        self.assertEqual(classify_event('message', {'type': 'new_like', 'post_id': 7}), (True, 'message:new_like:7'))
+        self.assertEqual(classify_event('message', {'type': 'new_comment'}), (False, None))
+        self.assertEqual(classify_event('new_message', {}), (False, None))
+
+    def test_low_priority_events_skip_busy_clients(self):
+        self.guard.emit('typing', {'user_id': 1})
+
+        # The busy client is skipped and the stuck one disconnected
+        self.assertEqual(self.socketio.emitted, [('typing', {'user_id': 1}, None, ['slow', 'stuck'])])
+        self.assertEqual(self.socketio.server.disconnected, ['stuck'])
+        self.assertEqual(self.guard.stats['dropped'], 1)
+        self.assertEqual(self.guard.stats['disconnected'], 1)
+        self.assertEqual(self.guard.stats['max_queue_depth'], 100)
+
+    def test_normal_events_still_reach_busy_clients(self):
+        self.guard.emit('new_message', {'id': 1}, room='user_1')
+        self.assertEqual(self.socketio.emitted, [('new_message', {'id': 1}, 'user_1', [])])
+
+    def test_merged_events_are_flushed_once_drained(self):
+        for status in ('online', 'offline', 'online'):
+            self.guard.emit('user_status', {'user_id': 2, 'status': status}, room='user_1')
+        self.guard.emit('message', {'type': 'new_like', 'post_id': 7, 'like_count': 3, 'seq': 4}, room='user_1')
+        self.assertEqual(self.guard.stats['merged'], 2)
+
+        # Still busy, nothing is sent
+        self.socketio.emitted.clear()
+        self.assertEqual(self.guard.flush(), 0)
+
+        self.set_depth('slow', 0)
+        self.assertEqual(self.guard.flush(), 2)
+        self.assertEqual(self.socketio.emitted, [
+            ('user_status', {'user_id': 2, 'status': 'online'}, 'slow', []),
+            ('message', {'type': 'new_like', 'post_id': 7, 'like_count': 3}, 'slow', [])
+        ])
+        self.assertEqual(self.guard.get_stats()['held_back'], 0)
+
+    def test_typing_stopped_is_delivered_once_drained(self):
+        self.guard.emit('typing', {'user_id': 2, 'conversation_id': 4}, room='user_1')
+        self.guard.emit('typing_stopped', {'user_id': 2, 'conversation_id': 4}, room='user_1')
+        self.assertEqual(self.guard.stats['dropped'], 1)
+
+        self.set_depth('slow', 0)
+        self.socketio.emitted.clear()
+        self.assertEqual(self.guard.flush(), 1)
+        self.assertEqual(self.socketio.emitted, [('typing_stopped', {'user_id': 2, 'conversation_id': 4}, 'slow', [])])
+
+    def test_skip_sid_is_respected(self):
+        self.guard.emit('typing', {'user_id': 1}, skip_sid='fast')
+        self.assertEqual(self.socketio.emitted[0][3], ['fast', 'slow', 'stuck'])
+
+    def test_compact_connections_get_binary_payloads(self):
+        encoder = CompactEncoder(enabled=True, intern_size=10)
+        encoder.enable('fast')
+        self.guard.encoder = encoder
+
+        self.guard.emit('new_message', {'id': 1, 'content': 'hi'})
+        self.assertEqual(self.socketio.emitted, [('new_message', {'id': 1, 'content': 'hi'}, None, ['fast', 'stuck'])])
+        event, payload, to = self.socketio.server.emitted[0]
+        self.assertEqual((event, to), ('new_message', ['fast']))
+        self.assertEqual(msgpack.unpackb(payload), [None, {'i': 1, 'm': 'hi'}])
+
+if __name__ == '__main__':
+    unittest.main()
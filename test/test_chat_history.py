@@ -0,0 +1,95 @@
+import unittest
+from flask import Flask
+from sqlalchemy import event
+from database import db
+from models import User, ChatGroup, ChatMember, ChatMessage, MessageReadReceipt
+from utils.chat_history import fetch_message_page, serialize_message_page
+
+class ChatHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+
+            # Create a group chat with three members
+            users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+            db.session.add_all(users)
+            db.session.flush()
+
+            chat = ChatGroup(name='group', created_by=users[0].id, is_group=True)
+            db.session.add(chat)
+            db.session.flush()
+            self.chat_id = chat.id
+
+            for user in users:
+                db.session.add(ChatMember(chat_id=chat.id, user_id=user.id))
+
+            # 120 messages, round-robin senders, each read by the next user
+            for i in range(120):
+                message = ChatMessage(chat_id=chat.id, user_id=users[i % 3].id, content=f'message {i}')
+                db.session.add(message)
+                db.session.flush()
+                db.session.add(MessageReadReceipt(message_id=message.id, user_id=users[(i + 1) % 3].id))
+
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def count_queries(self, fn):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return result, len(statements)
+
+    def test_latest_page_is_chronological(self):
+        with self.app.app_context():
+            messages, has_more = fetch_message_page(self.chat_id, limit=50)
+            self.assertTrue(has_more)
+            self.assertEqual(len(messages), 50)
+            self.assertEqual(messages[-1].content, 'message 119')
+            self.assertEqual([m.id for m in messages], sorted(m.id for m in messages))
+
+    def test_before_and_after_cursors(self):
+        with self.app.app_context():
+            latest, _ = fetch_message_page(self.chat_id, limit=50)
+            older, has_more = fetch_message_page(self.chat_id, before_id=latest[0].id, limit=50)
+            self.assertTrue(has_more)
+            self.assertEqual(older[-1].id, latest[0].id - 1)
+
+            oldest, has_more = fetch_message_page(self.chat_id, before_id=older[0].id, limit=50)
+            self.assertFalse(has_more)
+            self.assertEqual(len(oldest), 20)
+
+            newer, has_more = fetch_message_page(self.chat_id, after_id=oldest[-1].id, limit=50)
+            self.assertEqual([m.id for m in newer], [m.id for m in older])
+
+    def test_page_cost_is_constant(self):
+        with self.app.app_context():
+            def load_page():
+                messages, _ = fetch_message_page(self.chat_id, limit=50)
+                return serialize_message_page(messages)
+
+            payload, query_count = self.count_queries(load_page)
+            self.assertEqual(query_count, 3)
+            self.assertEqual(len(payload['messages']), 50)
+            self.assertEqual(len(payload['users']), 3)
+            self.assertEqual(len(payload['messages'][0]['read_by']), 1)
+            self.assertNotIn('sender', payload['messages'][0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from flask import Flask
+from sqlalchemy import event
+from database import db
+from models import User, ChatGroup, ChatMember
+from utils.chat_membership import MembershipCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class MembershipCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)])
+            db.session.add(ChatGroup(name='group', created_by=1, is_group=True))
+            db.session.add_all([
+                ChatMember(chat_id=1, user_id=1, role='admin'),
+                ChatMember(chat_id=1, user_id=2, role='member')
+            ])
+            db.session.commit()
+
+        self.clock = FakeClock()
+        self.cache = MembershipCache(maxsize=2, ttl=60, clock=self.clock)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def count_queries(self, fn):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return result, len(statements)
+
+    def test_cached_checks_cost_no_queries(self):
+        with self.app.app_context():
+            members, queries = self.count_queries(lambda: self.cache.get_members(1))
+            self.assertEqual(members, {1: 'admin', 2: 'member'})
+            self.assertEqual(queries, 1)
+
+            _, queries = self.count_queries(lambda: [self.cache.get_members(1) for _ in range(10)])
+            self.assertEqual(queries, 0)
+            self.assertEqual(self.cache.stats['hits'], 10)
+
+    def test_invalidate_reloads_changes(self):
+        with self.app.app_context():
+            self.cache.get_members(1)
+            db.session.add(ChatMember(chat_id=1, user_id=3))
+            db.session.commit()
+
+            self.assertNotIn(3, self.cache.get_members(1))
+            self.cache.invalidate(1)
+            self.assertEqual(self.cache.get_members(1)[3], 'member')
+
+    def test_entries_expire_after_ttl(self):
+        with self.app.app_context():
+            self.cache.get_members(1)
+            ChatMember.query.filter_by(chat_id=1, user_id=2).update({'role': 'admin'})
+            db.session.commit()
+
+            self.clock.now = 60
+            self.assertEqual(self.cache.get_members(1)[2], 'admin')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from database import db
+from models import User, ChatGroup, ChatMember, ChatMessage, ChatChangeLog
+from utils.chat_sync import (
+    record_change, get_sync_cursor, is_cursor_expired, fetch_changes, serialize_changes,
+    prune_change_log, CHANGE_MESSAGE, CHANGE_DELETE, CHANGE_READ, CHANGE_MEMBERS
+)
+
+class ChatSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(1, 4)])
+            db.session.add_all([
+                ChatGroup(name='shared', created_by=1, is_group=True),
+                ChatGroup(name='private', created_by=2, is_group=True)
+            ])
+            db.session.add_all([
+                ChatMember(chat_id=1, user_id=1),
+                ChatMember(chat_id=1, user_id=2),
+                ChatMember(chat_id=2, user_id=2)
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_message(self, chat_id, user_id, content):
+        message = ChatMessage(chat_id=chat_id, user_id=user_id, content=content)
+        db.session.add(message)
+        db.session.flush()
+        record_change(chat_id, CHANGE_MESSAGE, user_id=user_id, message_id=message.id)
+        return message
+
+    def test_delta_contains_only_changes_in_users_chats(self):
+        with self.app.app_context():
+            self.add_message(1, 1, 'before')
+            db.session.commit()
+            cursor = get_sync_cursor()
+
+            kept = self.add_message(1, 2, 'kept')
+            removed = self.add_message(1, 2, 'removed')
+            self.add_message(2, 2, 'not visible to user1')
+            removed.is_deleted = True
+            record_change(1, CHANGE_DELETE, user_id=2, message_id=removed.id)
+            record_change(1, CHANGE_READ, user_id=2, created_at=datetime(2024, 1, 1))
+            record_change(1, CHANGE_READ, user_id=2, created_at=datetime(2024, 1, 2))
+            db.session.commit()
+
+            changes, has_more = fetch_changes(1, cursor)
+            self.assertFalse(has_more)
+            self.assertEqual(len(changes), 5)
+
+            result = serialize_changes(changes)
+            self.assertEqual([m['id'] for m in result['messages']], [kept.id])
+            self.assertEqual(result['users'][2]['username'], 'user2')
+            self.assertEqual(result['deleted'], [{'id': removed.id, 'chat_id': 1}])
+            self.assertEqual(result['read'], [{'chat_id': 1, 'user_id': 2, 'read_at': '2024-01-02T00:00:00'}])
+
+    def test_removed_member_sees_own_removal(self):
+        with self.app.app_context():
+            cursor = get_sync_cursor()
+            ChatMember.query.filter_by(chat_id=1, user_id=1).delete()
+            record_change(1, CHANGE_MEMBERS, user_id=1)
+            self.add_message(1, 2, 'after removal')
+            db.session.commit()
+
+            changes, _ = fetch_changes(1, cursor)
+            self.assertEqual(serialize_changes(changes)['chats'], [1])
+            self.assertEqual(serialize_changes(changes)['messages'], [])
+
+    def test_paging_and_pruning(self):
+        with self.app.app_context():
+            for i in range(5):
+                self.add_message(1, 1, f'message {i}')
+            db.session.commit()
+
+            changes, has_more = fetch_changes(2, 0, limit=3)
+            self.assertTrue(has_more)
+            changes, has_more = fetch_changes(2, changes[-1].id, limit=3)
+            self.assertFalse(has_more)
+            self.assertEqual(len(changes), 2)
+
+            ChatChangeLog.query.filter(ChatChangeLog.id <= 3).update(
+                {'created_at': datetime.utcnow() - timedelta(days=40)}
+            )
+            db.session.commit()
+
+            self.assertEqual(prune_change_log(30, batch_size=2), 3)
+            self.assertTrue(is_cursor_expired(1))
+            self.assertFalse(is_cursor_expired(3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import tempfile
+import unittest
+from io import BytesIO
+from datetime import datetime, timedelta
+from flask import Flask
+from database import db
+from models import User, UploadSession
+from utils.chunked_upload import ChunkedUploads, ChunkConflict
+from utils.upload_spool import UploadRejected
+
+VIDEO = b'\x00\x00\x00\x18ftypmp42' + os.urandom(300 * 1024)
+
+class ChunkedUploadsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(self.tmpdir.name, "test.db")}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.user = User(username='a', email='a@x.com')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.uploads = ChunkedUploads()
+        self.uploads.chunk_size = 128 * 1024
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        self.tmpdir.cleanup()
+
+    def send(self, session, start, stop):
+        return self.uploads.append(session, start, BytesIO(VIDEO[start:stop]), stop - start)
+
+    def test_resume_after_interruption(self):
+        session = self.uploads.create(self.user.id, 'clip.mp4', len(VIDEO), 'video')
+        self.assertEqual(self.send(session, 0, 128 * 1024), 128 * 1024)
+
+        # The connection drops halfway through the second chunk, what arrived is kept
+        partial = BytesIO(VIDEO[128 * 1024:192 * 1024])
+        self.assertEqual(self.uploads.append(session, 128 * 1024, partial, 128 * 1024), 192 * 1024)
+
+        # A retry of the whole chunk is refused with the offset to resume from
+        with self.assertRaises(ChunkConflict) as caught:
+            self.send(session, 128 * 1024, 256 * 1024)
+        self.assertEqual(caught.exception.offset, 192 * 1024)
+
+        # Completing early reports the bytes still missing
+        with self.assertRaises(ChunkConflict):
+            self.uploads.complete(session)
+
+        offset = self.uploads.offset(session)
+        while offset < len(VIDEO):
+            offset = self.send(session, offset, min(offset + self.uploads.chunk_size, len(VIDEO)))
+
+        with self.uploads.complete(session) as spool:
+            self.assertEqual(spool.size, len(VIDEO))
+            self.assertEqual(spool.sha256, hashlib.sha256(VIDEO).hexdigest())
+            self.assertEqual(spool.mime_type, 'video/mp4')
+            self.assertEqual(spool.filename, 'clip.mp4')
+            path = spool.path
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.uploads.get(session.id, self.user.id))
+
+    def test_rejects_bad_chunks(self):
+        session = self.uploads.create(self.user.id, 'clip.mp4', len(VIDEO), 'video')
+        with self.assertRaises(UploadRejected):
+            self.uploads.append(session, 0, BytesIO(VIDEO), len(VIDEO))  # Larger than a chunk
+        with self.assertRaises(UploadRejected):
+            self.send(session, len(VIDEO) - 10, len(VIDEO) + 10)  # Past the end of the file
+
+        # Not a video: refused on the first chunk rather than after the whole file
+        with self.assertRaises(UploadRejected):
+            self.uploads.append(session, 0, BytesIO(b'<html>' + bytes(1000)), 1006)
+        self.assertEqual(self.uploads.offset(session), 0)
+
+        with self.assertRaises(UploadRejected):
+            self.uploads.create(self.user.id, 'big.png', 10 ** 12, 'image')
+
+    def test_expire(self):
+        session = self.uploads.create(self.user.id, 'clip.mp4', len(VIDEO), 'video')
+        self.send(session, 0, 1024)
+        path = session.path
+
+        self.assertEqual(self.uploads.expire(), 0)
+        self.assertEqual(self.uploads.expire(datetime.utcnow() + timedelta(seconds=self.uploads.ttl + 1)), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(UploadSession.query.count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
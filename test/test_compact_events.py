@@ -0,0 +1,99 @@
+import os
+import time
+import unittest
+from datetime import datetime, timezone
+import msgpack
+from utils.compact_events import CompactEncoder, get_schema, ENCODING_MSGPACK, ENCODING_JSON
+
+class CompactEncoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.encoder = CompactEncoder(enabled=True, intern_size=2)
+        self.encoder.enable('sid')
+        self.message = {
+            'id': 7,
+            'conversation_id': 3,
+            'sender_id': 1,
+            'sender_username': 'user1',
+            'sender_profile_pic': '/static/uploads/photos/user1.png',
+            'recipient_id': 2,
+            'content': 'hello',
+            'created_at': '2024-01-01T12:00:00+00:00',
+            'read': False
+        }
+
+    def payload(self, data, sid='sid'):
+        body, profile = self.encoder.encode(data)
+        return msgpack.unpackb(self.encoder.payload_for(sid, body, profile))
+
+    def test_negotiation(self):
+        self.assertEqual(self.encoder.negotiate(['json', 'msgpack']), ENCODING_MSGPACK)
+        self.assertEqual(self.encoder.negotiate(['json']), ENCODING_JSON)
+        self.assertEqual(CompactEncoder(enabled=False, intern_size=2).negotiate(['msgpack']), ENCODING_JSON)
+        self.assertFalse(self.encoder.is_compact('other'))
+
+    def test_keys_and_timestamps_are_compacted(self):
+        profiles, body = self.payload(self.message)
+        expected_ms = int(datetime(2024, 1, 1, 12, tzinfo=timezone.utc).timestamp() * 1000)
+        self.assertEqual(body, {'i': 7, 'c': 3, 's': 1, 'r': 2, 'm': 'hello', 'at': expected_ms, 'rd': False, '@': 0})
+        self.assertEqual(profiles, [[1, 'user1', '/static/uploads/photos/user1.png']])
+
+        # Unparseable timestamps keep their key and value
+        _, body = self.payload({'timestamp': 'soon', 'unknown': 1})
+        self.assertEqual(body, {'timestamp': 'soon', 'unknown': 1})
+
+        schema = get_schema()
+        self.assertEqual(schema['keys']['at'], 'created_at')
+        self.assertIn('at', schema['timestamps'])
+
+    def test_naive_timestamps_are_utc(self):
+        # The server's local time zone must not shift naive datetime.utcnow() values
+        previous = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            expected_ms = int(datetime(2024, 1, 1, 12, tzinfo=timezone.utc).timestamp() * 1000)
+            _, body = self.payload({'created_at': datetime(2024, 1, 1, 12), 'timestamp': '2024-01-01T12:00:00'})
+            self.assertEqual((body['at'], body['ts']), (expected_ms, expected_ms))
+        finally:
+            if previous is None:
+                os.environ.pop('TZ')
+            else:
+                os.environ['TZ'] = previous
+            time.tzset()
+
+    def test_profiles_are_interned_per_connection(self):
+        self.assertIsNotNone(self.payload(self.message)[0])
+        self.assertIsNone(self.payload(self.message)[0])
+
+        # Another connection gets its own copy, a changed profile is resent
+        self.encoder.enable('other')
+        self.assertIsNotNone(self.payload(self.message, 'other')[0])
+        self.assertIsNotNone(self.payload(dict(self.message, sender_username='renamed'))[0])
+
+        # The table is bounded, profiles beyond it are sent every time
+        self.payload(dict(self.message, sender_id=2))
+        self.assertIsNotNone(self.payload(dict(self.message, sender_id=3))[0])
+        self.assertIsNotNone(self.payload(dict(self.message, sender_id=3))[0])
+        self.assertEqual(self.encoder.stats['profiles_sent'], 6)
+
+        self.encoder.forget('sid')
+        self.encoder.forget('other')
+        self.assertEqual(self.encoder._profiles, {})
+
+    def test_broadcast_shares_payloads(self):
+        for sid in ('a', 'b', 'c'):
+            self.encoder.enable(sid)
+        body, profile = self.encoder.encode(self.message)
+        self.encoder.group_payloads(['a'], body, profile)
+
+        groups = self.encoder.group_payloads(['a', 'b', 'c'], body, profile)
+        self.assertEqual([sorted(sids) for _, sids in groups], [['b', 'c'], ['a']])
+        self.assertEqual(msgpack.unpackb(groups[1][0])[0], None)
+
+    def test_chat_message_shape(self):
+        profiles, body = self.payload({'id': 1, 'chat_id': 4, 'user_id': 9, 'sender': 'user9', 'profile_pic': None})
+        self.assertEqual(profiles, [[9, 'user9', None]])
+        self.assertEqual(body, {'i': 1, 'ch': 4, 'u': 9, '@': 1})
+
+if __name__ == '__main__':
+    unittest.main()
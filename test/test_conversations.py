@@ -0,0 +1,76 @@
+import unittest
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import User, Conversation
+from utils.conversations import (
+    clear_conversation_cache, find_conversation_id, get_or_create_conversation_id
+)
+
+class ConversationLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        clear_conversation_cache()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([
+                User(username='user1', email='user1@example.com'),
+                User(username='user2', email='user2@example.com')
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        clear_conversation_cache()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_pair_is_canonical(self):
+        with self.app.app_context():
+            conversation_id = get_or_create_conversation_id(2, 1)
+            db.session.commit()
+
+            conversation = Conversation.query.get(conversation_id)
+            self.assertEqual((conversation.low_user_id, conversation.high_user_id), (1, 2))
+            self.assertEqual((conversation.user1_id, conversation.user2_id), (2, 1))
+            self.assertEqual(get_or_create_conversation_id(1, 2), conversation_id)
+            self.assertEqual(Conversation.query.count(), 1)
+
+    def test_duplicate_pair_is_rejected(self):
+        with self.app.app_context():
+            db.session.add(Conversation(user1_id=1, user2_id=2))
+            db.session.commit()
+
+            db.session.add(Conversation(user1_id=2, user2_id=1))
+            with self.assertRaises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+
+    def test_cached_lookup_skips_database(self):
+        with self.app.app_context():
+            get_or_create_conversation_id(1, 2)
+            db.session.commit()
+
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                # First lookup probes the index once, the second hits the cache
+                first = find_conversation_id(1, 2)
+                second = find_conversation_id(2, 1)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            self.assertEqual(first, second)
+            self.assertEqual(len(statements), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from utils.event_replay import EventReplayBuffer
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class EventReplayBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.buffer = EventReplayBuffer(capacity=5, max_users=2, max_age=60, clock=self.clock)
+
+    def test_sequences_are_per_user(self):
+        self.assertEqual(self.buffer.record(1, 'message', {'n': 1}), 1)
+        self.assertEqual(self.buffer.record(1, 'message', {'n': 2}), 2)
+        self.assertEqual(self.buffer.record(2, 'message', {'n': 1}), 1)
+        self.assertEqual(self.buffer.current(1), 2)
+        self.assertEqual(self.buffer.current(3), 0)
+
+    def test_replay_returns_only_the_gap(self):
+        for n in range(1, 5):
+            self.buffer.record(1, 'message', {'n': n})
+
+        events, complete = self.buffer.replay(1, 2, self.buffer.epoch)
+        self.assertTrue(complete)
+        self.assertEqual([(seq, data['n']) for seq, _, data in events], [(3, 3), (4, 4)])
+
+        events, complete = self.buffer.replay(1, 4, self.buffer.epoch)
+        self.assertTrue(complete)
+        self.assertEqual(events, [])
+
+    def test_gap_outside_buffer_requires_resync(self):
+        for n in range(1, 9):
+            self.buffer.record(1, 'message', {'n': n})
+
+        # Only seq 4-8 are buffered
+        self.assertFalse(self.buffer.replay(1, 2)[1])
+        self.assertTrue(self.buffer.replay(1, 3)[1])
+
+        # Unknown epoch or a sequence from the future
+        self.assertFalse(self.buffer.replay(1, 3, 'other')[1])
+        self.assertFalse(self.buffer.replay(1, 9)[1])
+        self.assertEqual(self.buffer.stats['resyncs'], 3)
+
+    def test_old_events_and_users_are_evicted(self):
+        self.buffer.record(1, 'message', {'n': 1})
+        self.clock.now = 61
+        self.buffer.record(1, 'message', {'n': 2})
+        self.assertFalse(self.buffer.replay(1, 0)[1])
+        self.assertTrue(self.buffer.replay(1, 1)[1])
+
+        self.buffer.record(2, 'message', {})
+        self.buffer.record(3, 'message', {})
+        self.assertEqual(self.buffer.current(1), 0)
+
+if __name__ == '__main__':
+    unittest.main()
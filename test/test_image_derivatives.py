@@ -0,0 +1,101 @@
+import os
+import json
+import base64
+import tempfile
+import unittest
+from io import BytesIO
+from flask import Flask
+from PIL import Image
+from database import db
+from models import FileUpload
+from utils.image_derivatives import ImagePipeline
+from utils.media_files import local_path
+from utils.upload_spool import spool_upload
+
+def make_jpeg(width, height):
+    """A JPEG with EXIF saying it must be rotated a quarter turn"""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    exif[0x010f] = 'Camera maker'
+    data = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(data, 'JPEG', exif=exif)
+    return data.getvalue()
+
+class ImagePipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'test.db')
+        self.app = Flask(__name__, static_folder=os.path.join(self.tmpdir.name, 'static'))
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+
+        self.pipeline = ImagePipeline()
+        self.pipeline.widths = [80, 320, 1280]
+        self.pipeline.init_app(self.app)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.tmpdir.cleanup()
+
+    def upload(self, data, url):
+        with self.app.app_context():
+            upload = FileUpload(original_filename='a', primary_url=url, media_type='image')
+            db.session.add(upload)
+            db.session.commit()
+            upload_id = upload.id
+
+        with spool_upload(data) as spool:
+            future = self.pipeline.submit(upload_id, spool)
+        return upload_id, future.result(10)
+
+    def test_derivatives_are_resized_and_stripped(self):
+        # Rotated by its EXIF orientation this is 500 wide and 1000 high
+        upload_id, derivatives = self.upload(make_jpeg(1000, 500), 'https://host.example/a.jpg')
+        self.assertEqual(sorted(derivatives), [80, 320])
+
+        path = local_path(derivatives[320], self.app.static_folder)
+        with Image.open(path) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (320, 640))
+            self.assertEqual(len(image.getexif()), 0)
+
+        with self.app.app_context():
+            recorded = json.loads(FileUpload.query.get(upload_id).derivatives)
+            self.assertEqual(recorded, {str(width): url for width, url in derivatives.items()})
+
+            # 40px at 2x needs 80px, 100px needs 200px, 400px is larger than every copy
+            self.assertEqual(self.pipeline.pick_size('https://host.example/a.jpg', 40), derivatives[80])
+            self.assertEqual(self.pipeline.pick_size('https://host.example/a.jpg', 100), derivatives[320])
+            self.assertEqual(self.pipeline.pick_size('https://host.example/a.jpg', 400), 'https://host.example/a.jpg')
+            self.assertEqual(self.pipeline.pick_size('https://host.example/unknown.jpg', 40), 'https://host.example/unknown.jpg')
+            self.assertIsNone(self.pipeline.pick_size(None, 40))
+
+    def test_animated_gifs_are_left_alone(self):
+        frames = [Image.new('RGB', (400, 400), color) for color in ('red', 'blue')]
+        data = BytesIO()
+        frames[0].save(data, 'GIF', save_all=True, append_images=frames[1:])
+        _, derivatives = self.upload(data.getvalue(), 'https://host.example/a.gif')
+        self.assertEqual(derivatives, {})
+        self.assertEqual(self.pipeline.stats['skipped'], 1)
+
+    def test_placeholders_are_tiny_inline_thumbnails(self):
+        source = BytesIO(make_jpeg(1000, 500))
+        placeholder = self.pipeline.placeholder(source)
+        self.assertTrue(placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(placeholder), 1000)
+        self.assertEqual(source.tell(), 0)
+
+        data = base64.b64decode(placeholder.split(',', 1)[1])
+        with Image.open(BytesIO(data)) as image:
+            # Oriented like the derivatives, at most 16px on its long side
+            self.assertEqual(image.size, (8, 16))
+
+        self.assertIsNone(self.pipeline.placeholder(BytesIO(b'\x00\x00\x00\x18ftypmp42')))
+
+if __name__ == '__main__':
+    unittest.main()
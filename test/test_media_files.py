@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from flask import Flask
+from utils.media_files import MediaServer, local_path, media_url
+
+HASH = 'ab' * 32
+
+class MediaServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__, static_folder=os.path.join(self.tmpdir.name, 'static'))
+        self.server = MediaServer()
+        self.server.x_accel_prefix = ''
+        self.app.add_url_rule('/media/<kind>/<path:name>', view_func=self.server.send)
+        self.client = self.app.test_client()
+
+        self.data = bytes(range(256)) * 40
+        videos = os.path.join(self.app.static_folder, 'uploads', 'videos')
+        os.makedirs(videos)
+        for name in (f'{HASH}.mp4', '0f3a_clip.mp4'):
+            with open(os.path.join(videos, name), 'wb') as f:
+                f.write(self.data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.client.get(media_url('videos', f'{HASH}.mp4'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.data)
+        self.assertEqual(response.headers['ETag'], f'"{HASH}"')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.mimetype, 'video/mp4')
+
+        response = self.client.get(media_url('videos', f'{HASH}.mp4'), headers={'If-None-Match': f'"{HASH}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Other files are revalidated after the configured max-age
+        response = self.client.get(media_url('videos', '0f3a_clip.mp4'))
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['ETag'].strip('"').split('-')[0], f'{len(self.data):x}')
+
+    def test_byte_ranges(self):
+        url = media_url('videos', f'{HASH}.mp4')
+        size = len(self.data)
+
+        for header, start, stop in (('bytes=10-19', 10, 20), ('bytes=9000-', 9000, size), ('bytes=-5', size - 5, size)):
+            response = self.client.get(url, headers={'Range': header})
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response.data, self.data[start:stop], header)
+            self.assertEqual(response.headers['Content-Range'], f'bytes {start}-{stop - 1}/{size}', header)
+            self.assertEqual(response.content_length, stop - start, header)
+
+        response = self.client.get(url, headers={'Range': f'bytes={size}-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{size}')
+
+        # A range for another version of the file gets the whole file
+        response = self.client.get(url, headers={'Range': 'bytes=10-19', 'If-Range': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.data)
+
+        self.assertEqual(self.server.stats['range_requests'], 3)
+
+    def test_unknown_files_are_not_found(self):
+        self.assertEqual(self.client.get('/media/videos/missing.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/secrets/a.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/videos/../../../etc/passwd').status_code, 404)
+
+    def test_local_path(self):
+        static = self.app.static_folder
+        expected = os.path.join(static, 'uploads', 'photos', 'a.jpg')
+        self.assertEqual(local_path('/media/photos/a.jpg', static), expected)
+        self.assertEqual(local_path('uploads/photos/a.jpg', static), expected)
+        self.assertEqual(local_path('/static/uploads/photos/a.jpg', static), expected)
+        self.assertIsNone(local_path('https://host.example/a.jpg', static))
+        self.assertIsNone(local_path('/media/photos/../../a.jpg', static))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from flask import Flask
+from database import db
+from models import User, Conversation, Message, ChatGroup, ChatMember, ChatMessage, ChatChangeLog
+from utils.message_writer import MessageWriter, KIND_MESSAGE, KIND_CHAT_MESSAGE
+
+class MessageWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        # Use a file database so the writer thread shares it with the test
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([
+                User(username='user1', email='user1@example.com'),
+                User(username='user2', email='user2@example.com')
+            ])
+            db.session.add(Conversation(user1_id=1, user2_id=2))
+            db.session.add(ChatGroup(name='group', created_by=1, is_group=True))
+            db.session.add(ChatMember(chat_id=1, user_id=1))
+            db.session.commit()
+
+        self.writer = MessageWriter()
+        self.writer.enabled = True
+        self.writer.flush_interval = 0.02
+        self.writer.init_app(self.app)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.remove(self.db_path)
+
+    def test_concurrent_messages_share_commits(self):
+        pending = []
+        lock = threading.Lock()
+
+        def send(i):
+            with self.app.app_context():
+                message = self.writer.submit(KIND_MESSAGE, {
+                    'conversation_id': 1,
+                    'sender_id': 1,
+                    'recipient_id': 2,
+                    'content': f'message {i}'
+                }, touch={'conversation_id': 1})
+            with lock:
+                pending.append(message)
+
+        threads = [threading.Thread(target=send, args=(i,)) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(message.wait(timeout=5) for message in pending))
+        self.assertEqual(len({message.id for message in pending}), 50)
+        self.assertLess(self.writer.stats['batches_committed'], 50)
+
+        with self.app.app_context():
+            self.assertEqual(Message.query.count(), 50)
+            latest = max(message.values['created_at'] for message in pending)
+            self.assertEqual(Conversation.query.get(1).last_message_at, latest)
+
+    def test_chat_message_updates_last_read(self):
+        with self.app.app_context():
+            message = self.writer.submit(KIND_CHAT_MESSAGE, {
+                'chat_id': 1,
+                'user_id': 1,
+                'content': 'hello'
+            }, touch={'chat_id': 1, 'user_id': 1})
+
+        self.assertTrue(message.wait(timeout=5))
+
+        with self.app.app_context():
+            saved = ChatMessage.query.get(message.id)
+            self.assertEqual(saved.content, 'hello')
+            self.assertEqual(saved.message_type, 'text')
+            self.assertEqual(ChatMember.query.get(1).last_read, message.values['created_at'])
+            self.assertEqual(ChatChangeLog.query.one().message_id, message.id)
+
+    def test_bad_row_fails_alone(self):
+        def direct(content):
+            return self.writer.submit(KIND_MESSAGE, {
+                'conversation_id': 1,
+                'sender_id': 1,
+                'recipient_id': 2,
+                'content': content
+            })
+
+        with self.app.app_context():
+            first = direct('first')
+            bad = direct(None)
+            chat = self.writer.submit(KIND_CHAT_MESSAGE, {'chat_id': 1, 'user_id': 1, 'content': 'hello'})
+            self.assertTrue(first.wait(timeout=5))
+            self.assertFalse(bad.wait(timeout=5))
+            self.assertTrue(chat.wait(timeout=5))
+            self.assertIsNone(bad.id)
+            self.assertEqual(self.writer.stats['batches_failed'], 1)
+            self.assertEqual(Message.query.get(first.id).content, 'first')
+
+    def test_two_writers_share_a_database(self):
+        # Two processes (e.g. gunicorn workers) writing messages to the same file
+        other = MessageWriter()
+        other.enabled = True
+        other.flush_interval = 0.02
+        other.init_app(self.app)
+
+        pending = []
+        with self.app.app_context():
+            for i in range(40):
+                writer = self.writer if i % 2 else other
+                pending.append(writer.submit(KIND_MESSAGE, {
+                    'conversation_id': 1,
+                    'sender_id': 1,
+                    'recipient_id': 2,
+                    'content': f'message {i}'
+                }))
+
+        self.assertTrue(all(message.wait(timeout=5) for message in pending))
+        self.assertEqual(len({message.id for message in pending}), 40)
+
+        with self.app.app_context():
+            for message in pending:
+                self.assertEqual(Message.query.get(message.id).content, message.values['content'])
+
+    def test_timed_out_message_is_withdrawn(self):
+        self.writer.flush_interval = 0.3
+        with self.app.app_context():
+            first = self.writer.submit(KIND_MESSAGE, {'conversation_id': 1, 'sender_id': 1, 'recipient_id': 2, 'content': 'first'})
+            late = self.writer.submit(KIND_MESSAGE, {'conversation_id': 1, 'sender_id': 1, 'recipient_id': 2, 'content': 'late'})
+
+        # Reported as failed, so it must never be written
+        self.assertFalse(late.wait(timeout=0.01))
+        self.assertTrue(first.wait(timeout=5))
+
+        with self.app.app_context():
+            self.assertEqual([message.content for message in Message.query.all()], ['first'])
+
+    def test_disabled_writer_commits_synchronously(self):
+        self.writer.enabled = False
+        with self.app.app_context():
+            message = self.writer.submit(KIND_MESSAGE, {
+                'conversation_id': 1,
+                'sender_id': 2,
+                'recipient_id': 1,
+                'content': 'direct',
+                'created_at': datetime.utcnow()
+            })
+            self.assertTrue(message.wait(timeout=0))
+            self.assertEqual(Message.query.get(message.id).content, 'direct')
+        self.assertEqual(self.writer.stats['batches_committed'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import os
+import json
+import hashlib
+import time
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+from database import db
+from models import FileUpload, PostMedia
+from utils import websocket
+from utils.multi_upload import (UploadEngine, UPLOAD_SERVICES, upload_engine, upload_to_service,
+                                save_multi_uploads)
+from utils.rate_limit import RateLimiter, upload_limiter
+from utils.service_health import service_health
+from utils.storage import local_store
+from utils.upload import save_photos, start_spooled_upload, init_upload_tracking
+from utils.upload_spool import spool_upload
+
+SERVICES = {
+    'fast': {'enabled': True, 'delay': 0.01, 'url': 'https://fast.example/a.png'},
+    'slow': {'enabled': True, 'delay': 0.3, 'url': 'https://slow.example/a.png'},
+    'broken': {'enabled': True, 'delay': 0.0, 'url': None},
+    'disabled': {'enabled': False, 'delay': 0.0, 'url': 'https://disabled.example/a.png'}
+}
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'image bytes'
+
+def fake_upload(spool, service_name, service_config):
+    time.sleep(service_config['delay'])
+    with spool.open() as file:
+        assert file.read() == IMAGE
+    return service_config['url']
+
+class UploadEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+
+        self.engine = UploadEngine(max_workers=8, services=SERVICES, upload_func=fake_upload,
+                                   limiter=RateLimiter(interval=0))
+        # The broken service must not have its breaker opened nor the buckets emptied by an earlier test
+        service_health.reset()
+        upload_limiter.reset()
+        self.addCleanup(service_health.reset)
+        self.addCleanup(upload_limiter.reset)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.remove(self.db_path)
+
+    def make_file(self):
+        return spool_upload(FileStorage(stream=BytesIO(IMAGE), filename='a.png'))
+
+    def test_returns_first_success_and_records_mirrors(self):
+        start = time.perf_counter()
+        with self.make_file() as spool:
+            job = self.engine.submit(spool)
+        self.assertEqual(job.wait_first(5), 'https://fast.example/a.png')
+        self.assertLess(time.perf_counter() - start, 0.25)
+
+        with self.app.app_context():
+            upload = FileUpload(original_filename='a.png', primary_url='https://fast.example/a.png', media_type='image')
+            db.session.add(upload)
+            db.session.commit()
+            job.attach(self.app, upload.id)
+
+        # The slow mirror lands on the row once it finishes, then the spool is removed
+        self.assertEqual(len(job.wait_all(5)), 2)
+        self.assertFalse(os.path.exists(spool.path))
+        with self.app.app_context():
+            upload = FileUpload.query.get(1)
+            self.assertEqual(json.loads(upload.fallback_urls), ['https://slow.example/a.png'])
+
+        stats = self.engine.get_stats()
+        self.assertEqual(set(stats), {'fast', 'slow', 'broken'})
+        self.assertEqual(stats['broken']['failures'], 1)
+        self.assertEqual(stats['slow']['histogram']['le_500ms'], 1)
+
+    def test_files_upload_concurrently(self):
+        start = time.perf_counter()
+        spools = [self.make_file() for _ in range(5)]
+        jobs = [self.engine.submit(spool) for spool in spools]
+        for job in jobs:
+            job.wait_all(5)
+        # Five files on three services would take 1.5s one after another
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_all_services_failing(self):
+        engine = UploadEngine(max_workers=2, services={'broken': SERVICES['broken']}, upload_func=fake_upload,
+                              limiter=RateLimiter(interval=0))
+        with self.make_file() as spool:
+            self.assertIsNone(engine.submit(spool).wait_first(5))
+
+    def test_reposted_files_reuse_the_existing_upload(self):
+        calls = []
+
+        def counting_upload(spool, service_name, service_config):
+            calls.append(service_name)
+            return fake_upload(spool, service_name, service_config)
+
+        file = lambda: FileStorage(stream=BytesIO(IMAGE), filename='a.png')
+        upload_engine.services, upload_engine.upload_func = SERVICES, counting_upload
+        self.addCleanup(setattr, upload_engine, 'services', UPLOAD_SERVICES)
+        self.addCleanup(setattr, upload_engine, 'upload_func', upload_to_service)
+
+        with self.app.test_request_context():
+            first = save_photos([file()])
+            self.assertEqual(first, ['https://fast.example/a.png'])
+            uploads = len(calls)
+
+            # Same bytes under another name: one index lookup, no external call
+            self.assertEqual(save_photos([FileStorage(stream=BytesIO(IMAGE), filename='b.png')]), first)
+            self.assertEqual(save_multi_uploads(file())[0], first[0])
+            # Empty entries keep their place
+            self.assertEqual(save_photos([None, file()]), [None, first[0]])
+            self.assertEqual(len(calls), uploads)
+            self.assertEqual(FileUpload.query.count(), 1)
+            self.assertEqual(FileUpload.query.get(1).content_hash, hashlib.sha256(IMAGE).hexdigest())
+
+    def test_save_multi_uploads_records_mirrors(self):
+        upload_engine.services, upload_engine.upload_func = SERVICES, fake_upload
+        self.addCleanup(setattr, upload_engine, 'services', UPLOAD_SERVICES)
+        self.addCleanup(setattr, upload_engine, 'upload_func', upload_to_service)
+        file = lambda: FileStorage(stream=BytesIO(IMAGE), filename='a.png')
+
+        with self.app.test_request_context():
+            self.assertEqual(save_multi_uploads(file()), ['https://fast.example/a.png'])
+            for _ in range(100):
+                db.session.expire_all()
+                if len(db.session.get(FileUpload, 1).get_all_urls()) == 2:
+                    break
+                time.sleep(0.01)
+
+            # Saved again: every URL, from the row
+            self.assertEqual(save_multi_uploads(file()), ['https://fast.example/a.png', 'https://slow.example/a.png'])
+
+    def test_background_upload_replaces_the_provisional_url(self):
+        released = threading.Event()
+        completed = threading.Event()
+        events = []
+
+        def gated_upload(spool, service_name, service_config):
+            released.wait(5)
+            return fake_upload(spool, service_name, service_config)
+
+        def record_event(user_id, event_type, data):
+            events.append((user_id, event_type, data))
+            if event_type == 'upload_complete':
+                completed.set()
+            return True
+
+        upload_engine.services, upload_engine.upload_func = SERVICES, gated_upload
+        self.addCleanup(setattr, upload_engine, 'services', UPLOAD_SERVICES)
+        self.addCleanup(setattr, upload_engine, 'upload_func', upload_to_service)
+        self.addCleanup(setattr, websocket, 'send_to_user', websocket.send_to_user)
+        websocket.send_to_user = record_event
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(setattr, local_store, 'root', local_store.root)
+        local_store.root = tmpdir.name
+
+        with self.app.app_context():
+            # Returns before any service has answered, with the local copy's URL
+            with self.make_file() as spool:
+                url, job_id = start_spooled_upload(spool, 'image', user_id=7)
+            self.assertTrue(url.startswith('/media/objects/'))
+            db.session.add(PostMedia(post_id=1, media_type='image', media_url=url))
+            db.session.commit()
+
+            released.set()
+            self.assertTrue(completed.wait(5))
+
+            self.assertEqual(PostMedia.query.get(1).media_url, 'https://fast.example/a.png')
+            upload = FileUpload.query.get(1)
+            self.assertEqual(upload.get_all_urls(), ['https://fast.example/a.png', 'https://slow.example/a.png'])
+
+        progress = [data for _, event_type, data in events if event_type == 'upload_progress']
+        # Tracking starts with nothing answered, then one event per service
+        self.assertEqual([(data['completed'], data['total']) for data in progress], [(0, 3), (1, 3), (2, 3)])
+        user_id, _, data = events[-1]
+        self.assertEqual(user_id, 7)
+        self.assertEqual(data['job_id'], job_id)
+        self.assertEqual(data['provisional_url'], url)
+        self.assertEqual(data['stored'], 'external')
+
+    def test_tracking_starts_when_the_view_raises(self):
+        completed = threading.Event()
+
+        def record_event(user_id, event_type, data):
+            if event_type == 'upload_complete':
+                completed.set()
+            return True
+
+        upload_engine.services, upload_engine.upload_func = SERVICES, fake_upload
+        self.addCleanup(setattr, upload_engine, 'services', UPLOAD_SERVICES)
+        self.addCleanup(setattr, upload_engine, 'upload_func', upload_to_service)
+        self.addCleanup(setattr, websocket, 'send_to_user', websocket.send_to_user)
+        websocket.send_to_user = record_event
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(setattr, local_store, 'root', local_store.root)
+        local_store.root = tmpdir.name
+
+        init_upload_tracking(self.app)
+
+        @self.app.route('/fails')
+        def fails():
+            with self.make_file() as spool:
+                start_spooled_upload(spool, 'image', user_id=7)
+            raise RuntimeError('after the upload started')
+
+        self.assertEqual(self.app.test_client().get('/fails').status_code, 500)
+        self.assertTrue(completed.wait(5))
+        with self.app.app_context():
+            upload = db.session.get(FileUpload, 1)
+            self.assertEqual(upload.get_all_urls(), ['https://fast.example/a.png', 'https://slow.example/a.png'])
+
+if __name__ == '__main__':
+    unittest.main()
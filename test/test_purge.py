@@ -0,0 +1,80 @@
+import unittest
+from flask import Flask
+from database import db
+from models import (
+    User, Post, PostMedia, PostLike, Comment, CommentLike,
+    ChatGroup, ChatMember, ChatMessage, MessageReadReceipt, PurgeJob
+)
+from utils.purge import PurgeWorker, schedule_purge, PURGE_POST, PURGE_CHAT
+
+class PurgeWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(2)])
+
+            # A post with media, likes, and liked comments
+            db.session.add(Post(user_id=1, content='post'))
+            db.session.add(PostMedia(post_id=1, media_type='image', media_url='http://example.com/1.jpg'))
+            db.session.add_all([PostLike(post_id=1, user_id=i) for i in (1, 2)])
+            db.session.add_all([Comment(post_id=1, user_id=2, content=f'comment {i}') for i in range(25)])
+            db.session.add_all([CommentLike(comment_id=i, user_id=1) for i in range(1, 26)])
+
+            # A chat with messages and receipts, plus an unrelated chat
+            db.session.add_all([
+                ChatGroup(name='deleted', created_by=1, is_group=True),
+                ChatGroup(name='kept', created_by=1, is_group=True)
+            ])
+            db.session.add_all([ChatMember(chat_id=1, user_id=1), ChatMember(chat_id=2, user_id=1)])
+            db.session.add_all([ChatMessage(chat_id=1, user_id=1, content=f'message {i}') for i in range(45)])
+            db.session.add(ChatMessage(chat_id=2, user_id=1, content='kept'))
+            db.session.add_all([MessageReadReceipt(message_id=i, user_id=2) for i in range(1, 46)])
+            db.session.commit()
+
+        self.worker = PurgeWorker()
+        self.worker.batch_size = 10
+        self.worker.batch_pause = 0
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_post_children_are_purged_in_batches(self):
+        with self.app.app_context():
+            Post.query.filter_by(id=1).delete()
+            schedule_purge(PURGE_POST, 1)
+            db.session.commit()
+
+            self.assertEqual(self.worker.run_pending(), 1)
+            self.assertEqual(self.worker.stats['rows_deleted'], 25 + 25 + 2 + 1)
+            # 25 comment likes and 25 comments take three batches each
+            self.assertEqual(self.worker.stats['batches'], 3 + 3 + 1 + 1)
+
+            for model in (PostMedia, PostLike, Comment, CommentLike, PurgeJob):
+                self.assertEqual(model.query.count(), 0)
+
+    def test_chat_purge_keeps_other_chats(self):
+        with self.app.app_context():
+            ChatGroup.query.filter_by(id=1).delete()
+            schedule_purge(PURGE_CHAT, 1)
+            db.session.commit()
+
+            self.worker.run_pending()
+
+            self.assertEqual(MessageReadReceipt.query.count(), 0)
+            self.assertEqual([m.content for m in ChatMessage.query.all()], ['kept'])
+            self.assertEqual([m.chat_id for m in ChatMember.query.all()], [2])
+
+    def test_unknown_kind_is_rejected(self):
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                schedule_purge('story', 1)
+
+if __name__ == '__main__':
+    unittest.main()
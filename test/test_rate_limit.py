@@ -0,0 +1,107 @@
+import time
+import asyncio
+import threading
+import unittest
+from utils.multi_upload import UploadEngine
+from utils.rate_limit import RateLimiter
+from utils.upload_spool import spool_upload
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'image bytes'
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_burst_then_first_come_first_served(self):
+        limiter = RateLimiter(interval=1.0, burst=2)
+        limiter.clock = clock = Clock()
+
+        # The burst goes at once, later callers queue one interval apart in call order
+        self.assertEqual([limiter.reserve('svc') for _ in range(4)], [0.0, 0.0, 1.0, 2.0])
+        # Services have their own buckets
+        self.assertEqual(limiter.reserve('other'), 0.0)
+
+        clock.now += 10
+        self.assertEqual(limiter.reserve('svc'), 0.0)
+
+        stats = limiter.get_stats()['svc']
+        self.assertEqual((stats['requests'], stats['delayed']), (5, 2))
+        self.assertEqual(stats['total_wait_ms'], 3000.0)
+        self.assertEqual(stats['max_wait_ms'], 2000.0)
+
+    def test_reservations_are_capped(self):
+        limiter = RateLimiter(interval=1.0, burst=1, max_delay=1.5)
+        limiter.clock = clock = Clock()
+
+        # The third request would wait 2s: skipped without taking a token
+        self.assertEqual([limiter.reserve('svc') for _ in range(3)], [0.0, 1.0, None])
+        clock.now += 0.5
+        self.assertEqual(limiter.reserve('svc'), 1.5)
+        self.assertFalse(limiter.wait('svc'))
+
+        stats = limiter.get_stats()['svc']
+        self.assertEqual((stats['requests'], stats['delayed'], stats['skipped']), (5, 2, 2))
+
+    def test_wait_async(self):
+        limiter = RateLimiter(interval=0.1, burst=1)
+
+        async def send_three():
+            for _ in range(3):
+                await limiter.wait_async('svc')
+
+        start = time.perf_counter()
+        asyncio.run(send_three())
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+
+    def test_throttled_uploads_hold_no_worker(self):
+        running = []
+        lock = threading.Lock()
+
+        def upload(spool, service_name, service_config):
+            with lock:
+                running.append(time.perf_counter())
+            return f'https://{service_name}.example/a.png'
+
+        services = {'svc': {'enabled': True}}
+        engine = UploadEngine(max_workers=1, services=services, upload_func=upload,
+                              limiter=RateLimiter(interval=0.1, burst=1))
+
+        start = time.perf_counter()
+        jobs = []
+        for _ in range(3):
+            with spool_upload(IMAGE) as spool:
+                jobs.append(engine.submit(spool))
+        # Submitting never waits for a token
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+        self.assertEqual([job.wait_first(5) for job in jobs], ['https://svc.example/a.png'] * 3)
+        # Sent in order, an interval apart, although the single worker was free all along
+        gaps = [later - earlier for earlier, later in zip(running, running[1:])]
+        self.assertTrue(all(gap >= 0.08 for gap in gaps), gaps)
+        self.assertEqual(engine.limiter.get_stats()['svc']['delayed'], 2)
+
+    def test_services_too_far_behind_are_skipped(self):
+        def upload(spool, service_name, service_config):
+            return f'https://{service_name}.example/a.png'
+
+        services = {'svc': {'enabled': True}}
+        engine = UploadEngine(max_workers=1, services=services, upload_func=upload,
+                              limiter=RateLimiter(interval=60, burst=1, max_delay=1))
+
+        with spool_upload(IMAGE) as spool:
+            first = engine.submit(spool)
+        with spool_upload(IMAGE) as spool:
+            second = engine.submit(spool)
+
+        self.assertEqual(first.wait_first(5), 'https://svc.example/a.png')
+        # Answered at once instead of a minute later, and its spool is released
+        self.assertTrue(second._done.is_set())
+        self.assertIsNone(second.wait_first(0))
+        self.assertEqual(engine.limiter.get_stats()['svc']['skipped'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from flask import Flask
+from database import db
+from models import User
+from utils.conversations import get_or_create_conversation_id
+from utils.gateway_ipc import gateway_bridge, GatewayBridge, worker_socket_path
+from utils.message_writer import message_writer
+from realtime_gateway import RealtimeGateway
+
+class FakeAsyncServer:
+    """Records what the gateway emits instead of talking to websockets"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.rooms = {}
+        self.emitted = []
+
+    def on(self, event, handler):
+        pass
+
+    async def save_session(self, sid, session):
+        self.sessions[sid] = session
+
+    async def get_session(self, sid):
+        return self.sessions[sid]
+
+    async def enter_room(self, sid, room):
+        self.rooms.setdefault(sid, set()).add(room)
+
+    async def leave_room(self, sid, room):
+        self.rooms.get(sid, set()).discard(room)
+
+    async def emit(self, event, data=None, room=None, to=None, skip_sid=None):
+        self.emitted.append((event, data, to or room))
+
+    def events(self, name):
+        return [(data, target) for event, data, target in self.emitted if event == name]
+
+class RealtimeGatewayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(self.tmpdir.name, 'test.db')}"
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(1, 4)])
+            db.session.commit()
+            self.conversation_id = get_or_create_conversation_id(1, 2)
+            db.session.commit()
+
+        # Write messages synchronously into this test's database
+        self.writer_enabled = message_writer.enabled
+        message_writer.enabled = False
+
+        self.path = os.path.join(self.tmpdir.name, 'gateway.sock')
+        gateway_bridge.init_app(self.app, self.path)
+
+    def tearDown(self):
+        gateway_bridge.stop()
+        message_writer.enabled = self.writer_enabled
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def session_cookie(self, user_id):
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        return f"session={serializer.dumps({'user_id': user_id})}"
+
+    async def connect(self, gateway, sid, user_id=None):
+        cookie = self.session_cookie(user_id) if user_id else ''
+        await gateway.on_connect(sid, {'HTTP_COOKIE': cookie})
+        await gateway.on_auth(sid, {})
+        return gateway.sio.events('auth_response')[-1][0]
+
+    async def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    def test_events_are_served_through_the_app_channel(self):
+        async def scenario():
+            sio = FakeAsyncServer()
+            gateway = RealtimeGateway(sio, self.path)
+            await gateway.channel.start()
+            try:
+                self.assertEqual((await self.connect(gateway, 'a', 1))['status'], 'success')
+                self.assertEqual((await self.connect(gateway, 'b', 2))['user_id'], 2)
+                self.assertEqual((await self.connect(gateway, 'x'))['status'], 'error')
+                self.assertIn('user_1', sio.rooms['a'])
+
+                # Presence is broadcast by the app and pushed back to the gateway
+                self.assertTrue(await self.wait_for(lambda: len(sio.events('user_status')) == 2))
+
+                result = await gateway.on_join_conversation('a', {'conversation_id': self.conversation_id})
+                self.assertTrue(result['success'])
+                self.assertIn(f'conversation_{self.conversation_id}', sio.rooms['a'])
+
+                # Typing is checked through the channel once, then throttled locally
+                self.assertTrue((await gateway.on_typing('b', {'conversation_id': self.conversation_id}))['success'])
+                self.assertTrue((await gateway.on_typing('b', {'conversation_id': self.conversation_id}))['success'])
+                self.assertEqual(len(sio.events('typing')), 1)
+                denied = await gateway.on_join_conversation('x', {'conversation_id': self.conversation_id})
+                self.assertFalse(denied['success'])
+
+                ack = await gateway.on_send_message('b', {'recipient_id': 1, 'content': 'hello'})
+                self.assertTrue(ack['success'])
+                self.assertEqual(len(sio.events('typing_stopped')), 1)
+                self.assertTrue(await self.wait_for(lambda: len(sio.events('new_message')) == 2))
+                self.assertEqual(
+                    sorted(target for _, target in sio.events('new_message')),
+                    [f'conversation_{self.conversation_id}', 'user_1']
+                )
+
+                await gateway.on_disconnect('b')
+                self.assertTrue(await self.wait_for(lambda: len(sio.events('user_status')) == 3))
+                self.assertEqual(sio.events('user_status')[-1][0]['status'], 'offline')
+            finally:
+                await gateway.channel.close()
+
+        asyncio.run(scenario())
+
+        with self.app.app_context():
+            self.assertFalse(db.session.get(User, 2).is_active)
+
+    def test_gateway_reaches_every_worker(self):
+        # A second worker listening next to the first, and the socket of one that has exited
+        other = GatewayBridge(2)
+        other.operations = gateway_bridge.operations
+        other.init_app(self.app, worker_socket_path(self.path, 2))
+        self.addCleanup(other.stop)
+        stale = worker_socket_path(self.path, 3)
+        dead = GatewayBridge(1)
+        dead.init_app(self.app, stale)
+        dead._server.server_close()
+
+        async def scenario():
+            sio = FakeAsyncServer()
+            gateway = RealtimeGateway(sio, self.path)
+            await gateway.channel.start()
+            try:
+                self.assertTrue(await self.wait_for(lambda: gateway_bridge.connected and other.connected))
+                self.assertTrue(await self.wait_for(lambda: not os.path.exists(stale)))
+
+                # Emits from either worker reach the gateway's clients
+                gateway_bridge.publish('ping', {'worker': 1}, room='user_1')
+                other.publish('ping', {'worker': 2}, room='user_1')
+                self.assertTrue(await self.wait_for(lambda: len(sio.events('ping')) == 2))
+
+                # Requests are spread over the workers
+                served = gateway_bridge.stats['requests']
+                for _ in range(4):
+                    await gateway.channel.request('participants', conversation_id=self.conversation_id)
+                self.assertEqual(gateway_bridge.stats['requests'] - served, 2)
+                self.assertEqual(other.stats['requests'], 2)
+            finally:
+                await gateway.channel.close()
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
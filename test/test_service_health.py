@@ -0,0 +1,108 @@
+import unittest
+from utils.image_upload import ImageUploader
+from utils.service_health import ServiceHealth, service_health, CLOSED, OPEN, HALF_OPEN
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'image bytes'
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class ServiceHealthTestCase(unittest.TestCase):
+    def setUp(self):
+        self.health = ServiceHealth()
+        self.health.failure_threshold = 3
+        self.health.cooldown = 60
+        self.health.clock = self.clock = Clock()
+
+    def test_breaker_opens_and_recovers(self):
+        for _ in range(2):
+            self.health.record('dead', 30.0, False)
+        self.assertTrue(self.health.allow('dead'))
+
+        self.health.record('dead', 30.0, False)
+        self.assertFalse(self.health.allow('dead'))
+        self.assertEqual(self.health.snapshot()['dead']['state'], OPEN)
+
+        # Half open after the cool-down: one more failure opens it again at once
+        self.clock.now += 61
+        self.assertTrue(self.health.allow('dead'))
+        self.assertEqual(self.health.snapshot()['dead']['state'], HALF_OPEN)
+        self.health.record('dead', 30.0, False)
+        self.assertFalse(self.health.allow('dead'))
+
+        # A success closes it
+        self.clock.now += 61
+        self.health.record('dead', 0.5, True)
+        self.assertEqual(self.health.snapshot()['dead']['state'], CLOSED)
+        self.assertEqual(self.health.stats['breakers_opened'], 2)
+
+    def test_rank_by_expected_latency(self):
+        for _ in range(4):
+            self.health.record('slow', 2.0, True)
+            self.health.record('fast', 0.2, True)
+        # Fast but failing half of the time
+        self.health.record('flaky', 0.1, True)
+        self.health.record('flaky', 0.1, False)
+        for _ in range(3):
+            self.health.record('dead', 30.0, False)
+
+        # Unmeasured services come first, open breakers are left out
+        self.assertEqual(self.health.rank(['slow', 'dead', 'flaky', 'fast', 'new']),
+                         ['new', 'flaky', 'fast', 'slow'])
+
+class ImageUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        service_health.reset()
+        self.addCleanup(service_health.reset)
+
+        self.calls = []
+        self.uploader = ImageUploader()
+        self.uploader.active_services = ['down', 'up']
+        self.uploader.adapters = {'down': self.failing, 'up': self.working}
+
+    def failing(self, spool, filename=None):
+        self.calls.append('down')
+        raise ConnectionError('timed out')
+
+    def working(self, spool, filename=None):
+        self.calls.append('up')
+        return {'success': True, 'url': 'https://up.example/a.png'}
+
+    def test_fails_over_and_skips_open_breakers(self):
+        # Both unmeasured: the first fails and the next one is tried
+        result = self.uploader.upload(IMAGE, 'a.png')
+        self.assertEqual((result['service'], result['url']), ('up', 'https://up.example/a.png'))
+        self.assertEqual(self.calls, ['down', 'up'])
+
+        # The failed service is ranked last from then on
+        self.uploader.upload(IMAGE, 'a.png')
+        self.assertEqual(self.calls, ['down', 'up', 'up'])
+
+        # Asked for by name until its breaker opens, then refused without a request
+        for _ in range(service_health.failure_threshold - 1):
+            self.assertFalse(self.uploader.upload(IMAGE, 'a.png', service='down')['success'])
+        self.assertFalse(self.uploader.upload(IMAGE, 'a.png', service='down')['success'])
+        self.assertEqual(self.calls.count('down'), service_health.failure_threshold)
+
+    def test_discovered_endpoints_are_cached(self):
+        lookups = []
+
+        def discover():
+            lookups.append(1)
+            return 'store1'
+
+        self.assertEqual(self.uploader._endpoint('gofile', discover), 'store1')
+        self.assertEqual(self.uploader._endpoint('gofile', discover), 'store1')
+        self.assertEqual(len(lookups), 1)
+
+        # Looked up again after an upload to it failed
+        self.uploader._forget_endpoint('gofile')
+        self.uploader._endpoint('gofile', discover)
+        self.assertEqual(len(lookups), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import unittest
+import socketio
+from utils.socket_bus import SQLiteManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A Socket.IO worker process sharing the bus file with its siblings
+WORKER = """
+import sys
+import socketio
+from werkzeug.serving import make_server
+from utils.socket_bus import SQLiteManager
+
+bus_path, port = sys.argv[1], int(sys.argv[2])
+sio = socketio.Server(async_mode='threading', client_manager=SQLiteManager(bus_path, poll_interval=0.01))
+
+@sio.on('join')
+def join(sid, room):
+    sio.enter_room(sid, room)
+    return True
+
+@sio.on('relay')
+def relay(sid, data):
+    sio.emit('relayed', data, room=data.get('room'))
+    return True
+
+server = make_server('127.0.0.1', port, socketio.WSGIApp(sio), threaded=True)
+print('ready', flush=True)
+server.serve_forever()
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class SocketBusTestCase(unittest.TestCase):
+    WORKERS = 3
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.bus_path = os.path.join(self.tmpdir.name, 'bus.db')
+        self.workers = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        for worker in self.workers:
+            worker.kill()
+            worker.wait()
+        self.tmpdir.cleanup()
+
+    def start_worker(self):
+        port = free_port()
+        worker = subprocess.Popen(
+            [sys.executable, '-c', WORKER, self.bus_path, str(port)],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        self.workers.append(worker)
+        self.assertEqual(worker.stdout.readline().strip(), 'ready')
+        return port
+
+    def connect(self, port, room):
+        received = []
+        arrived = threading.Event()
+        client = socketio.Client()
+
+        @client.on('relayed')
+        def on_relayed(data):
+            received.append(data)
+            arrived.set()
+
+        client.connect(f'http://127.0.0.1:{port}', transports=['polling'])
+        self.clients.append(client)
+        self.assertTrue(client.call('join', room, timeout=5))
+        return received, arrived
+
+    def test_emits_reach_clients_of_other_workers(self):
+        ports = [self.start_worker() for _ in range(self.WORKERS)]
+        inboxes = [self.connect(port, f'user_{i}') for i, port in enumerate(ports)]
+
+        # A room emit from worker 0 reaches the client connected to worker 2
+        self.clients[0].call('relay', {'room': 'user_2', 'text': 'hello'}, timeout=5)
+        self.assertTrue(inboxes[2][1].wait(5))
+        self.assertEqual(inboxes[2][0], [{'room': 'user_2', 'text': 'hello'}])
+        self.assertEqual(inboxes[0][0] + inboxes[1][0], [])
+
+        # A broadcast from worker 1 reaches every worker's client once
+        for _, arrived in inboxes:
+            arrived.clear()
+        self.clients[1].call('relay', {'text': 'everyone'}, timeout=5)
+        for received, arrived in inboxes:
+            self.assertTrue(arrived.wait(5))
+        time.sleep(0.2)
+        self.assertEqual([len(received) for received, _ in inboxes], [1, 1, 2])
+
+    def test_old_messages_are_pruned(self):
+        manager = SQLiteManager(self.bus_path, retention=60)
+        manager._publish({'method': 'emit'})
+        self.assertEqual(manager.prune(), 0)
+        self.assertEqual(manager.prune(now=time.time() + 61), 1)
+
+if __name__ == '__main__':
+    unittest.main()
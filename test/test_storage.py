@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import tempfile
+import unittest
+from io import BytesIO
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+from database import db
+from models import FileUpload, PostMedia
+from utils.multi_upload import UploadEngine
+from utils.storage import LocalObjectStore, ImageUploaderBackend, collect_garbage, local_store
+from utils.upload_spool import spool_upload
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'image bytes'
+VIDEO = b'\x00\x00\x00\x18ftypmp42' + b'video bytes'
+
+class FakeUploader:
+    """Stands in for utils.image_upload.ImageUploader"""
+    active_services = ['0x0']
+
+    def __init__(self):
+        self.calls = []
+
+    def upload(self, file_data, filename=None, service=None):
+        self.calls.append(service)
+        return {'success': True, 'url': f'https://{service}.example/{filename}', 'service': service}
+
+class LocalObjectStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = LocalObjectStore(os.path.join(self.tmpdir.name, 'objects'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_objects_are_sharded_by_hash(self):
+        digest = hashlib.sha256(IMAGE).hexdigest()
+        with spool_upload(FileStorage(stream=BytesIO(IMAGE), filename='a.png')) as spool:
+            url = self.store.put(spool)
+            self.assertEqual(self.store.put(spool), url)
+
+        name = f'{digest[:2]}/{digest[2:4]}/{digest}.png'
+        self.assertEqual(url, f'/media/objects/{name}')
+        self.assertEqual(self.store.name_of(url), name)
+        with open(self.store.path(name), 'rb') as f:
+            self.assertEqual(f.read(), IMAGE)
+
+        # Written once, no temporary file left behind
+        self.assertEqual(self.store.stats['stored'], 1)
+        self.assertEqual(self.store.stats['deduplicated'], 1)
+        self.assertEqual([entry[0] for entry in self.store.iter_objects()], [name])
+
+    def test_garbage_collection(self):
+        names = []
+        for data in (IMAGE, VIDEO):
+            with spool_upload(data) as spool:
+                names.append(self.store.name_of(self.store.put(spool)))
+        kept, dropped = names
+
+        # An abandoned partial write
+        abandoned = os.path.join(os.path.dirname(self.store.path(kept)), '.tmp-abc')
+        open(abandoned, 'wb').close()
+
+        # Nothing is old enough yet
+        self.assertEqual(self.store.collect_garbage({kept}), [])
+
+        later = time.time() + self.store.grace_seconds + 1
+        self.assertEqual(self.store.collect_garbage({kept}, now=later), [dropped])
+        self.assertTrue(os.path.exists(self.store.path(kept)))
+        self.assertFalse(os.path.exists(self.store.path(dropped)))
+        self.assertFalse(os.path.exists(abandoned))
+        # Emptied shard directories are removed too
+        self.assertFalse(os.path.exists(os.path.dirname(self.store.path(dropped))))
+
+class StorageBackendsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__, static_folder=os.path.join(self.tmpdir.name, 'static'))
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(self.tmpdir.name, "test.db")}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+
+        self.addCleanup(setattr, local_store, 'root', local_store.root)
+        local_store.root = os.path.join(self.tmpdir.name, 'objects')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.tmpdir.cleanup()
+
+    def test_image_uploader_hosts_plug_in_as_backends(self):
+        uploader = FakeUploader()
+        engine = UploadEngine(max_workers=2, services={}, backends=[
+            ImageUploaderBackend('0x0', uploader),
+            ImageUploaderBackend('imgur', uploader)  # Not active: no API key
+        ])
+
+        with spool_upload(FileStorage(stream=BytesIO(IMAGE), filename='a.png')) as spool:
+            self.assertEqual(engine.submit(spool).wait_first(5), 'https://0x0.example/a.png')
+        # Image hosts take images only
+        with spool_upload(VIDEO) as spool:
+            self.assertIsNone(engine.submit(spool).wait_first(5))
+        self.assertEqual(uploader.calls, ['0x0'])
+
+    def test_collect_garbage_forgets_unreferenced_uploads(self):
+        with self.app.app_context():
+            urls = []
+            for data in (IMAGE, VIDEO):
+                with spool_upload(data) as spool:
+                    urls.append(local_store.put(spool))
+                    db.session.add(FileUpload(original_filename='a', primary_url=urls[-1],
+                                              media_type='image', content_hash=spool.sha256))
+            db.session.add(PostMedia(post_id=1, media_type='image', media_url=urls[0]))
+            db.session.commit()
+
+            self.addCleanup(setattr, local_store, 'grace_seconds', local_store.grace_seconds)
+            local_store.grace_seconds = -1
+            self.assertEqual(collect_garbage(self.app), 1)
+
+            self.assertEqual([upload.primary_url for upload in FileUpload.query.all()], [urls[0]])
+            self.assertTrue(os.path.exists(local_store.path(local_store.name_of(urls[0]))))
+            self.assertFalse(os.path.exists(local_store.path(local_store.name_of(urls[1]))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from utils.typing_indicator import TypingTracker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TypingTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = TypingTracker(throttle_ms=2000, timeout_ms=5000, clock=self.clock)
+
+    def test_typing_is_throttled_per_conversation(self):
+        self.assertTrue(self.tracker.touch(1, 'user1', 10, 'sid1'))
+        self.clock.now = 0.5
+        self.assertFalse(self.tracker.touch(1, 'user1', 10, 'sid1'))
+        # Another conversation has its own throttle window
+        self.assertTrue(self.tracker.touch(1, 'user1', 11, 'sid1'))
+        self.clock.now = 2.0
+        self.assertTrue(self.tracker.touch(1, 'user1', 10, 'sid1'))
+
+    def test_idle_typing_expires(self):
+        self.tracker.touch(1, 'user1', 10, 'sid1')
+        self.clock.now = 4.0
+        self.tracker.touch(2, 'user2', 10, 'sid2')
+        self.clock.now = 5.0
+
+        expired = self.tracker.expire()
+        self.assertEqual([key for key, _ in expired], [(1, 10)])
+        self.assertEqual(expired[0][1]['sid'], 'sid1')
+        self.assertEqual(len(self.tracker), 1)
+
+    def test_stop_and_clear_user(self):
+        self.tracker.touch(1, 'user1', 10, 'sid1')
+        self.tracker.touch(1, 'user1', 11, 'sid1')
+        self.tracker.touch(2, 'user2', 10, 'sid2')
+
+        self.assertIsNotNone(self.tracker.stop(2, 10))
+        self.assertIsNone(self.tracker.stop(2, 10))
+        self.assertEqual(sorted(key for key, _ in self.tracker.clear_user(1)), [(1, 10), (1, 11)])
+        self.assertEqual(len(self.tracker), 0)
+
+if __name__ == '__main__':
+    unittest.main()
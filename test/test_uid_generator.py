@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from flask import Flask
+from sqlalchemy import event
+from database import db
+from models import User, UidSequence
+from utils.uid_generator import UidAllocator, permute, assign_uids_to_existing_users, uid_allocator
+
+class PermutationTestCase(unittest.TestCase):
+    def test_distinct_ten_digit_uids(self):
+        key = os.urandom(16)
+        uids = [permute(key, counter) for counter in range(20000)]
+        self.assertEqual(len(set(uids)), len(uids))
+        self.assertTrue(all(len(uid) == 10 and uid.isdigit() and uid[0] != '0' for uid in uids))
+        # Consecutive counters don't give consecutive UIDs
+        self.assertNotEqual(int(uids[1]) - int(uids[0]), 1)
+
+class UidAllocatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(self.tmpdir.name, "test.db")}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.allocator = UidAllocator()
+        self.allocator.block_size = 100
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        self.tmpdir.cleanup()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_block_serves_uids_without_queries(self):
+        first = self.allocator.allocate()
+        queries = len(self.statements)
+
+        uids = [first] + [self.allocator.allocate() for _ in range(99)]
+        self.assertEqual(len(self.statements), queries)
+        self.assertEqual(len(set(uids)), 100)
+
+        # The next block is reserved once the first one runs out
+        self.allocator.allocate()
+        self.assertEqual(self.allocator.stats['blocks'], 2)
+        self.assertEqual(db.session.get(UidSequence, 1).next_value, 200)
+
+    def test_processes_get_disjoint_blocks(self):
+        other = UidAllocator()
+        other.block_size = 100
+        mine = [self.allocator.allocate() for _ in range(100)]
+        theirs = [other.allocate() for _ in range(100)]
+        self.assertFalse(set(mine) & set(theirs))
+
+    def test_skips_uids_given_out_before(self):
+        # A user from before the allocator happens to hold the third UID of the first block
+        sequence = UidSequence(id=1, key=os.urandom(16).hex(), next_value=0)
+        db.session.add(sequence)
+        db.session.add(User(username='old', email='old@x.com', uid=permute(bytes.fromhex(sequence.key), 2)))
+        db.session.commit()
+
+        uids = self.allocator.allocate_many(100)
+        self.assertEqual(len(set(uids)), 100)
+        self.assertNotIn(permute(bytes.fromhex(sequence.key), 2), uids)
+        self.assertEqual(self.allocator.stats['skipped'], 1)
+
+    def test_backfill_in_batches(self):
+        db.session.add_all([User(username=f'u{i}', email=f'u{i}@x.com') for i in range(25)])
+        db.session.commit()
+
+        self.addCleanup(uid_allocator.reset)
+        uid_allocator.reset()
+        batches = []
+        self.assertEqual(assign_uids_to_existing_users(batch_size=10, progress=batches.append), 25)
+        self.assertEqual(batches, [10, 20, 25])
+
+        uids = [user.uid for user in User.query.all()]
+        self.assertTrue(all(uids))
+        self.assertEqual(len(set(uids)), 25)
+        self.assertEqual(assign_uids_to_existing_users(batch_size=10), 0)
+
+if __name__ == '__main__':
+    unittest.main()
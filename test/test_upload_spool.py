@@ -0,0 +1,59 @@
+import os
+import hashlib
+import unittest
+from io import BytesIO
+from werkzeug.datastructures import FileStorage
+from werkzeug.formparser import parse_form_data
+from utils.upload_spool import spool_upload, sniff_type, MultipartStream, UploadRejected
+
+PNG = b'\x89PNG\r\n\x1a\n' + os.urandom(200 * 1024)
+
+class UploadSpoolTestCase(unittest.TestCase):
+    def make_file(self, data, filename='photo.png'):
+        return FileStorage(stream=BytesIO(data), filename=filename)
+
+    def test_spool_hashes_and_sniffs_in_one_pass(self):
+        with spool_upload(self.make_file(PNG)) as spool:
+            self.assertEqual(spool.size, len(PNG))
+            self.assertEqual(spool.sha256, hashlib.sha256(PNG).hexdigest())
+            self.assertEqual(spool.mime_type, 'image/png')
+            with spool.open() as file:
+                self.assertEqual(file.read(), PNG)
+        self.assertFalse(os.path.exists(spool.path))
+
+    def test_rejected_uploads_leave_nothing_behind(self):
+        with self.assertRaises(UploadRejected):
+            spool_upload(self.make_file(PNG), max_size=1024)
+        with self.assertRaises(UploadRejected):
+            spool_upload(self.make_file(b'<svg></svg>'))
+        with self.assertRaises(UploadRejected):
+            spool_upload(self.make_file(PNG), allowed_types={'video/mp4'})
+
+    def test_sniff_type(self):
+        self.assertEqual(sniff_type(b'\xff\xd8\xff\xe0\x00\x10JFIF'), 'image/jpeg')
+        self.assertEqual(sniff_type(b'RIFF\x00\x00\x00\x00WEBP'), 'image/webp')
+        self.assertEqual(sniff_type(b'\x00\x00\x00\x18ftypmp42'), 'video/mp4')
+        self.assertIsNone(sniff_type(b'#!/bin/sh'))
+
+    def test_multipart_stream_is_a_valid_body(self):
+        with spool_upload(self.make_file(PNG)) as spool:
+            body = MultipartStream(spool, 'image', {'type': 'file'})
+            length = len(body)
+
+            # Read in small blocks as http.client does
+            data = b''.join(iter(lambda: body.read(8192), b''))
+            body.close()
+
+        self.assertEqual(len(data), length)
+        _, form, files = parse_form_data({
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': body.content_type,
+            'CONTENT_LENGTH': str(length),
+            'wsgi.input': BytesIO(data)
+        })
+        self.assertEqual(form['type'], 'file')
+        self.assertEqual(files['image'].filename, 'photo.png')
+        self.assertEqual(files['image'].read(), PNG)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import Flask
+from database import db
+from models import FileUpload
+from utils.url_health import UrlHealthCache, UrlProber
+
+class HeadHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.server.heads.append(self.path)
+        self.send_response(200 if self.path.startswith('/ok') else 404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class UrlHealthCacheTestCase(unittest.TestCase):
+    def test_failures_expire_sooner(self):
+        cache = UrlHealthCache(ttl=600, negative_ttl=60)
+        cache.set('https://a.example', True, now=0)
+        cache.set('https://b.example', False, now=0)
+
+        self.assertTrue(cache.get('https://a.example', now=100))
+        self.assertFalse(cache.get('https://b.example', now=59))
+        self.assertIsNone(cache.get('https://b.example', now=61))
+        self.assertIsNone(cache.get('https://c.example', now=0))
+        self.assertEqual(cache.prune(now=601), 2)
+
+class UrlProberTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), HeadHandler)
+        self.server.heads = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(FileUpload(
+                original_filename='a.png',
+                primary_url=f'{self.base}/missing.png',
+                fallback_urls=json.dumps([f'{self.base}/ok.png']),
+                media_type='image'
+            ))
+            db.session.add(FileUpload(
+                original_filename='b.png',
+                primary_url=f'{self.base}/gone.png',
+                media_type='image'
+            ))
+            db.session.commit()
+
+        self.prober = UrlProber()
+        self.prober.init_app(self.app)
+        self.prober.wake = lambda: None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.remove(self.db_path)
+
+    def test_resolve_reads_cache_and_prober_updates_uploads(self):
+        with self.app.app_context():
+            upload = FileUpload.query.get(1)
+
+            # Nothing is known yet: the primary URL is used and a probe queued, without any request
+            self.assertEqual(self.prober.resolve(upload), f'{self.base}/missing.png')
+            self.assertEqual(self.server.heads, [])
+            self.assertEqual(self.prober._pending, {1})
+
+            # Freshly created rows count as checked, the stale scan skips them
+            self.assertEqual(self.prober.run_pending(), 1)
+
+        with self.app.app_context():
+            upload = FileUpload.query.get(1)
+            self.assertTrue(upload.is_available)
+            self.assertEqual(self.prober.resolve(upload), f'{self.base}/ok.png')
+
+            # Stale uploads are found by the periodic scan
+            FileUpload.query.get(2).last_check = None
+            db.session.commit()
+            self.assertEqual(self.prober.run_pending(), 1)
+            self.assertFalse(FileUpload.query.get(2).is_available)
+
+            # Cached results, broken ones included, are not probed again
+            heads = len(self.server.heads)
+            self.prober.request_check(1)
+            self.prober.request_check(2)
+            self.prober.run_pending()
+            self.assertEqual(len(self.server.heads), heads)
+
+if __name__ == '__main__':
+    unittest.main()
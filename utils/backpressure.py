@@ -0,0 +1,283 @@
+"""
+Socket Backpressure
+Bounded per-connection outbound queues for Socket.IO emits
+
+In threading mode every emit is appended to the engine.io queue of each
+recipient, and a stalled client's queue grows without limit. Emits made
+through the guard look at each recipient's queue depth first:
+
+- above the soft limit, low-priority events are dropped (typing) or merged
+  so only the latest value per key is delivered once the queue drains
+  (typing stopped, presence, like counts);
+- above the hard limit the client is disconnected; it reconnects and
+  catches up through event replay or a resync.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Low-priority events: event name -> field (or fields) whose latest value wins (None = drop)
+LOW_PRIORITY_EVENTS = {
+    'typing': None,
+    # Never dropped, the client would show the indicator until the next message
+    'typing_stopped': ('user_id', 'conversation_id'),
+    'user_status': 'user_id'
+}
+
+# Low-priority types of generic 'message' events
+LOW_PRIORITY_MESSAGE_TYPES = {
+    'new_like': 'post_id'
+}
+
+def classify_event(event: str, data: Any) -> Tuple[bool, Optional[str]]:
+    """
+    Get the priority of an event
+
+    Returns:
+        Tuple[bool, Optional[str]]: (is low priority, merge key or None to drop)
+    """
+    if event in LOW_PRIORITY_EVENTS:
+        field = LOW_PRIORITY_EVENTS[event]
+        return True, _merge_key(event, field, data)
+
+    if event == 'message' and isinstance(data, dict) and data.get('type') in LOW_PRIORITY_MESSAGE_TYPES:
+        field = LOW_PRIORITY_MESSAGE_TYPES[data['type']]
+        return True, _merge_key(f"message:{data['type']}", field, data)
+
+    return False, None
+
+def _merge_key(name: str, field: Union[str, Tuple[str, ...], None], data: Any) -> Optional[str]:
+    if field is None or not isinstance(data, dict):
+        return None
+    if isinstance(field, tuple):
+        return f"{name}:" + ':'.join(str(data.get(key)) for key in field)
+    return f"{name}:{data.get(field)}"
+
+class OutboundGuard:
+    """
+    Emits Socket.IO events with per-connection queue limits
+    """
+
+    def __init__(self, socketio, soft_limit: int, hard_limit: int, flush_interval_ms: int, encoder=None):
+        self.socketio = socketio
+        self.encoder = encoder
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.flush_interval = flush_interval_ms / 1000.0
+
+        # sid -> OrderedDict of merge key -> (event, data) waiting for the queue to drain
+        self._deferred = {}
+        self._lock = threading.Lock()
+        self._flusher_started = False
+
+        # Counters for monitoring
+        self.stats = {
+            'emits': 0,
+            'dropped': 0,
+            'merged': 0,
+            'deferred_sent': 0,
+            'disconnected': 0,
+            'max_queue_depth': 0
+        }
+
+    def _queue_depth(self, eio_sid: str) -> int:
+        socket = self.socketio.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def queue_depths(self, namespace: str = '/') -> Dict[str, int]:
+        """Get the outbound queue depth of every connected client"""
+        if self.socketio.server is None:
+            return {}
+        return {
+            sid: self._queue_depth(eio_sid)
+            for sid, eio_sid in self.socketio.server.manager.get_participants(namespace, None)
+        }
+
+    def emit(self, event: str, data: Any = None, room=None, skip_sid=None, namespace: str = '/') -> None:
+        """
+        Emit an event to a room (or everyone) respecting recipients' queue limits
+
+        Args:
+            event: Socket.IO event name
+            data: Event payload
+            room: Room, list of rooms, or None to broadcast
+            skip_sid: Socket ID or list of socket IDs to leave out
+            namespace: Socket.IO namespace
+        """
+        server = self.socketio.server
+        if server is None:
+            return
+
+        if skip_sid is None:
+            skip = set()
+        elif isinstance(skip_sid, (list, tuple, set)):
+            skip = set(skip_sid)
+        else:
+            skip = {skip_sid}
+
+        low_priority, merge_key = classify_event(event, data)
+        overloaded = []
+        compact = []
+
+        for sid, eio_sid in list(server.manager.get_participants(namespace, room)):
+            if sid in skip:
+                continue
+
+            depth = self._queue_depth(eio_sid)
+            if depth > self.stats['max_queue_depth']:
+                self.stats['max_queue_depth'] = depth
+
+            if depth >= self.hard_limit:
+                skip.add(sid)
+                overloaded.append((sid, depth))
+            elif low_priority and depth >= self.soft_limit:
+                skip.add(sid)
+                self._hold_back(sid, event, data, merge_key)
+            elif self.encoder is not None and self.encoder.is_compact(sid):
+                skip.add(sid)
+                compact.append(sid)
+
+        self.stats['emits'] += 1
+        self.socketio.emit(event, data, room=room, skip_sid=list(skip) or None, namespace=namespace)
+        if compact:
+            self._emit_compact(compact, event, data, namespace)
+
+        for sid, depth in overloaded:
+            self.disconnect_slow_client(sid, depth, namespace)
+
+    def _emit_compact(self, sids, event: str, data: Any, namespace: str) -> None:
+        """Send binary payloads to compact connections, encoding the body once"""
+        body, profile = self.encoder.encode(data)
+
+        # Connections that already know the sender share one packet
+        for payload, recipients in self.encoder.group_payloads(sids, body, profile):
+            # Only local sockets are compact, other workers get the JSON emit
+            self.socketio.server.emit(event, payload, to=recipients, namespace=namespace, ignore_queue=True)
+
+    def _hold_back(self, sid: str, event: str, data: Any, merge_key: Optional[str]) -> None:
+        """Drop a low-priority event for a busy client, or keep only its latest value"""
+        if merge_key is None:
+            self.stats['dropped'] += 1
+            return
+
+        # Sequence numbers are not reused for late delivery, it would look like a duplicate
+        if isinstance(data, dict) and 'seq' in data:
+            data = {key: value for key, value in data.items() if key != 'seq'}
+
+        with self._lock:
+            pending = self._deferred.setdefault(sid, OrderedDict())
+            if merge_key in pending:
+                self.stats['merged'] += 1
+            pending[merge_key] = (event, data)
+            pending.move_to_end(merge_key)
+
+        self._ensure_flusher()
+
+    def disconnect_slow_client(self, sid: str, depth: int, namespace: str = '/') -> None:
+        """Disconnect a client whose outbound queue stayed over the hard limit"""
+        logger.warning(f"Disconnecting slow client {sid} with {depth} queued packets")
+        self.stats['disconnected'] += 1
+        self.forget(sid)
+        try:
+            self.socketio.server.disconnect(sid, namespace=namespace)
+        except Exception as e:
+            logger.error(f"Error disconnecting slow client {sid}: {str(e)}")
+
+    def forget(self, sid: str) -> None:
+        """Discard held-back events of a client"""
+        with self._lock:
+            self._deferred.pop(sid, None)
+
+    def flush(self, namespace: str = '/') -> int:
+        """
+        Send held-back events to clients whose queues have drained
+
+        Returns:
+            int: Number of events sent
+        """
+        server = self.socketio.server
+        if server is None:
+            return 0
+
+        with self._lock:
+            sids = list(self._deferred)
+
+        sent = 0
+        for sid in sids:
+            eio_sid = server.manager.eio_sid_from_sid(sid, namespace)
+            if eio_sid is None:
+                self.forget(sid)
+                continue
+            if self._queue_depth(eio_sid) >= self.soft_limit:
+                continue
+
+            with self._lock:
+                pending = self._deferred.pop(sid, None)
+            if not pending:
+                continue
+
+            for event, data in pending.values():
+                if self.encoder is not None and self.encoder.is_compact(sid):
+                    self._emit_compact([sid], event, data, namespace)
+                else:
+                    self.socketio.emit(event, data, to=sid, namespace=namespace)
+                sent += 1
+
+        self.stats['deferred_sent'] += sent
+        return sent
+
+    def _flush_loop(self) -> None:
+        while True:
+            self.socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing held-back socket events: {str(e)}")
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher_started:
+            return
+
+        with self._lock:
+            if self._flusher_started:
+                return
+            self._flusher_started = True
+        self.socketio.start_background_task(self._flush_loop)
+        logger.info("Socket backpressure flusher started")
+
+    def get_stats(self) -> Dict:
+        """Get counters plus the current queue depth distribution"""
+        depths = self.queue_depths()
+        with self._lock:
+            held_back = sum(len(pending) for pending in self._deferred.values())
+
+        return dict(
+            self.stats,
+            connections=len(depths),
+            current_max_queue_depth=max(depths.values(), default=0),
+            over_soft_limit=sum(1 for depth in depths.values() if depth >= self.soft_limit),
+            held_back=held_back,
+            soft_limit=self.soft_limit,
+            hard_limit=self.hard_limit
+        )
+
+def _create_guard():
+    from socket_instance import socketio
+    from utils.compact_events import compact_encoder
+
+    return OutboundGuard(
+        socketio,
+        get_config('realtime.outbound_soft_limit', 64),
+        get_config('realtime.outbound_hard_limit', 512),
+        get_config('realtime.outbound_flush_interval_ms', 500),
+        encoder=compact_encoder
+    )
+
+# Create a singleton instance
+outbound_guard = _create_guard()
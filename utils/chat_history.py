@@ -0,0 +1,113 @@
+"""
+Chat History Utility
+Keyset pagination over chat messages with bulk hydration of senders and read receipts
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from models import User, ChatMessage, MessageReadReceipt
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Page size limits for history requests
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+def fetch_message_page(chat_id: int, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                       limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[ChatMessage], bool]:
+    """
+    Fetch a page of messages relative to a message ID
+
+    Uses the (chat_id, id) index instead of OFFSET, so every page costs the
+    same no matter how far back the client has scrolled.
+
+    Args:
+        chat_id: ID of the chat
+        before_id: Return messages older than this message ID
+        after_id: Return messages newer than this message ID
+        limit: Maximum number of messages to return
+
+    Returns:
+        Tuple[List[ChatMessage], bool]: Messages in chronological order and
+        whether more messages exist in the paging direction
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = ChatMessage.query.filter(
+        ChatMessage.chat_id == chat_id,
+        ChatMessage.is_deleted == False
+    )
+
+    if after_id is not None:
+        # Page forwards from a known message
+        rows = query.filter(ChatMessage.id > after_id).order_by(
+            ChatMessage.id.asc()
+        ).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        return rows[:limit], has_more
+
+    if before_id is not None:
+        query = query.filter(ChatMessage.id < before_id)
+
+    # Page backwards (or load the latest page) and return oldest first
+    rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+def serialize_message_page(messages: List[ChatMessage]) -> Dict:
+    """
+    Serialize a page of messages into a compact payload
+
+    Senders and read receipts are loaded with one query each for the whole
+    page. Messages reference user profiles by ID; each profile appears once
+    in the 'users' table no matter how many messages it sent or read.
+
+    Args:
+        messages: Messages to serialize
+
+    Returns:
+        Dict: {'messages': [...], 'users': {user_id: profile}}
+    """
+    if not messages:
+        return {'messages': [], 'users': {}}
+
+    message_ids = [message.id for message in messages]
+
+    # Load all read receipts for the page in one query
+    read_by = {message_id: [] for message_id in message_ids}
+    receipts = MessageReadReceipt.query.filter(
+        MessageReadReceipt.message_id.in_(message_ids)
+    ).all()
+    for receipt in receipts:
+        read_by[receipt.message_id].append({
+            'user_id': receipt.user_id,
+            'read_at': receipt.read_at.isoformat()
+        })
+
+    # Load every referenced user (senders and readers) in one query
+    user_ids = {message.user_id for message in messages}
+    user_ids.update(receipt.user_id for receipt in receipts)
+    users = User.query.filter(User.id.in_(user_ids)).all()
+
+    return {
+        'messages': [{
+            'id': message.id,
+            'chat_id': message.chat_id,
+            'user_id': message.user_id,
+            'message_type': message.message_type,
+            'content': message.content,
+            'media_url': message.media_url,
+            'created_at': message.created_at.isoformat(),
+            'updated_at': message.updated_at.isoformat(),
+            'read_by': read_by[message.id]
+        } for message in messages],
+        'users': {
+            user.id: {
+                'username': user.username,
+                'profile_pic': user.profile_pic
+            } for user in users
+        }
+    }
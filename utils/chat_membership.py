@@ -0,0 +1,138 @@
+"""
+Chat Membership Cache
+Per-process cache of chat members and roles used for authorization checks and room emits
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import get_config
+from database import db
+from models import ChatMember
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class MembershipCache:
+    """
+    Maps chat ID -> {user_id: role}
+
+    A chat's members are loaded with one query on first use and kept until
+    the chat is invalidated by a membership change. Entries also expire
+    after ttl seconds so changes made by other processes are picked up.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        # chat_id -> (loaded_at, {user_id: role})
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_members(self, chat_id: int) -> Dict[int, str]:
+        """
+        Get the members of a chat
+
+        Args:
+            chat_id: ID of the chat
+
+        Returns:
+            Dict[int, str]: User ID -> role for every member
+        """
+        now = self.clock()
+        with self._lock:
+            cached = self._chats.get(chat_id)
+            if cached is not None and now - cached[0] < self.ttl:
+                self._chats.move_to_end(chat_id)
+                self.stats['hits'] += 1
+                return cached[1]
+
+        rows = db.session.query(ChatMember.user_id, ChatMember.role).filter_by(chat_id=chat_id).all()
+        members = {row.user_id: row.role or 'member' for row in rows}
+
+        with self._lock:
+            self.stats['misses'] += 1
+            self._chats[chat_id] = (now, members)
+            self._chats.move_to_end(chat_id)
+            while len(self._chats) > self.maxsize:
+                self._chats.popitem(last=False)
+
+        return members
+
+    def invalidate(self, chat_id: int) -> None:
+        """Drop a chat after its membership changed"""
+        with self._lock:
+            self._chats.pop(chat_id, None)
+            self.stats['invalidations'] += 1
+
+    def clear(self) -> None:
+        """Drop all cached chats"""
+        with self._lock:
+            self._chats.clear()
+
+# Create a singleton instance
+membership_cache = MembershipCache(
+    get_config('messaging.membership_cache_size', 4096),
+    get_config('messaging.membership_cache_ttl', 60)
+)
+
+def get_member_role(chat_id: int, user_id: int) -> Optional[str]:
+    """
+    Get a user's role in a chat
+
+    Returns:
+        Optional[str]: 'admin' or 'member', or None if the user is not a member
+    """
+    return membership_cache.get_members(chat_id).get(user_id)
+
+def is_chat_member(chat_id: int, user_id: int) -> bool:
+    """Check if a user is a member of a chat"""
+    return get_member_role(chat_id, user_id) is not None
+
+def is_chat_admin(chat_id: int, user_id: int) -> bool:
+    """Check if a user is an admin of a chat"""
+    return get_member_role(chat_id, user_id) == 'admin'
+
+def get_chat_member_ids(chat_id: int) -> List[int]:
+    """Get the IDs of all members of a chat"""
+    return list(membership_cache.get_members(chat_id))
+
+def invalidate_chat_members(chat_id: int) -> None:
+    """Forget cached members of a chat; call after committing a membership change"""
+    membership_cache.invalidate(chat_id)
+
+def mark_chat_read(chat_id: int, user_id: int, read_at) -> None:
+    """
+    Update a member's last read timestamp without loading the member row
+
+    The new watermark is also appended to the sync change log. The caller
+    commits the session.
+    """
+    from utils.chat_sync import record_change, CHANGE_READ
+
+    ChatMember.query.filter_by(chat_id=chat_id, user_id=user_id).update({'last_read': read_at})
+    record_change(chat_id, CHANGE_READ, user_id=user_id, created_at=read_at)
+
+def emit_to_chat_members(chat_id: int, event_type: str, data: Dict, user_ids: Optional[List[int]] = None) -> bool:
+    """
+    Send an event to every member of a chat through their personal rooms
+
+    Args:
+        chat_id: ID of the chat
+        event_type: Socket.IO event name
+        data: Event payload
+        user_ids: Recipients to use instead of the cached member list
+
+    Returns:
+        bool: True if the event was emitted
+    """
+    from utils.websocket import send_to_users
+
+    if user_ids is None:
+        user_ids = get_chat_member_ids(chat_id)
+    return send_to_users(user_ids, event_type, data)
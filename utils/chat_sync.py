@@ -0,0 +1,175 @@
+"""
+Chat Sync Utility
+Append-only change log and delta queries for reconnecting chat clients
+
+Every new message, edit, deletion, read watermark and membership change is
+appended to ChatChangeLog in the same transaction as the change itself. A
+client keeps the ID of the last entry it has seen and asks for everything
+after it. SQLite serializes writers, so entries become visible in ID order
+and a cursor never skips a later commit.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select
+
+from database import db
+from models import ChatChangeLog, ChatMember, ChatMessage
+from utils.chat_history import serialize_message_page
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Change types
+CHANGE_MESSAGE = 'message'
+CHANGE_EDIT = 'edit'
+CHANGE_DELETE = 'delete'
+CHANGE_READ = 'read'
+CHANGE_MEMBERS = 'members'
+
+# Changes returned per sync request
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 1000
+
+def record_change(chat_id: int, change_type: str, user_id: Optional[int] = None,
+                  message_id: Optional[int] = None, created_at: Optional[datetime] = None) -> None:
+    """
+    Append a change to the log in the current transaction
+
+    Args:
+        chat_id: ID of the chat that changed
+        change_type: One of the CHANGE_* constants
+        user_id: Author, reader or affected member
+        message_id: ID of the message for message, edit and delete changes
+        created_at: Time of the change (e.g. the new read watermark)
+    """
+    db.session.add(ChatChangeLog(
+        chat_id=chat_id,
+        change_type=change_type,
+        user_id=user_id,
+        message_id=message_id,
+        created_at=created_at or datetime.utcnow()
+    ))
+
+def message_change_rows(messages: Iterable[Dict]) -> List[Dict]:
+    """
+    Build change log rows for new chat messages given their column values
+
+    Used by the message writer to append the log in the same batch insert.
+    """
+    return [{
+        'chat_id': values['chat_id'],
+        'change_type': CHANGE_MESSAGE,
+        'user_id': values['user_id'],
+        'message_id': values['id'],
+        'created_at': values['created_at']
+    } for values in messages]
+
+def get_sync_cursor() -> int:
+    """Get the ID of the latest change"""
+    return db.session.query(func.max(ChatChangeLog.id)).scalar() or 0
+
+def is_cursor_expired(cursor: int) -> bool:
+    """Check if changes after a cursor have already been pruned"""
+    oldest = db.session.query(func.min(ChatChangeLog.id)).scalar()
+    return oldest is not None and cursor < oldest - 1
+
+def fetch_changes(user_id: int, cursor: int, limit: int = DEFAULT_SYNC_LIMIT) -> Tuple[List[ChatChangeLog], bool]:
+    """
+    Fetch changes visible to a user after a cursor
+
+    Includes every change in the user's current chats plus membership
+    changes affecting the user (so removals from a chat are seen too).
+
+    Args:
+        user_id: ID of the syncing user
+        cursor: ID of the last change the client has seen
+        limit: Maximum number of changes to return
+
+    Returns:
+        Tuple[List[ChatChangeLog], bool]: Changes in cursor order, and whether more remain
+    """
+    limit = max(1, min(limit, MAX_SYNC_LIMIT))
+
+    chat_ids = select(ChatMember.chat_id).where(ChatMember.user_id == user_id)
+    changes = ChatChangeLog.query.filter(
+        ChatChangeLog.id > cursor,
+        or_(
+            ChatChangeLog.chat_id.in_(chat_ids),
+            and_(ChatChangeLog.change_type == CHANGE_MEMBERS, ChatChangeLog.user_id == user_id)
+        )
+    ).order_by(ChatChangeLog.id).limit(limit + 1).all()
+
+    has_more = len(changes) > limit
+    return changes[:limit], has_more
+
+def serialize_changes(changes: List[ChatChangeLog]) -> Dict:
+    """
+    Collapse a list of changes into the current state of what changed
+
+    Messages are loaded in one query and returned in their latest state;
+    read watermarks keep only the newest entry per chat and reader.
+
+    Returns:
+        Dict: {'messages', 'users', 'deleted', 'read', 'chats'}
+    """
+    message_ids = set()
+    deleted = {}
+    read = {}
+    chats = set()
+
+    for change in changes:
+        if change.change_type in (CHANGE_MESSAGE, CHANGE_EDIT):
+            message_ids.add(change.message_id)
+        elif change.change_type == CHANGE_DELETE:
+            deleted[change.message_id] = change.chat_id
+        elif change.change_type == CHANGE_READ:
+            read[(change.chat_id, change.user_id)] = change.created_at
+        elif change.change_type == CHANGE_MEMBERS:
+            chats.add(change.chat_id)
+
+    # Messages created and deleted within the window are only reported as deleted
+    message_ids -= set(deleted)
+    messages = []
+    if message_ids:
+        messages = ChatMessage.query.filter(ChatMessage.id.in_(message_ids)).order_by(ChatMessage.id).all()
+
+    result = serialize_message_page([message for message in messages if not message.is_deleted])
+    result['deleted'] = [{'id': message_id, 'chat_id': chat_id} for message_id, chat_id in deleted.items()]
+    result['read'] = [{
+        'chat_id': chat_id,
+        'user_id': reader_id,
+        'read_at': read_at.isoformat()
+    } for (chat_id, reader_id), read_at in read.items()]
+    result['chats'] = sorted(chats)
+    return result
+
+def prune_change_log(max_age_days: int, batch_size: int = 1000) -> int:
+    """
+    Delete change log entries older than max_age_days, one batch at a time
+
+    Clients with a cursor older than the pruned range must do a full reload.
+
+    Returns:
+        int: Number of entries deleted
+    """
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    total = 0
+
+    while True:
+        batch = select(ChatChangeLog.id).where(ChatChangeLog.created_at < cutoff).order_by(
+            ChatChangeLog.id
+        ).limit(batch_size)
+        result = db.session.execute(
+            delete(ChatChangeLog).where(ChatChangeLog.id.in_(batch)).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        total += result.rowcount
+
+        if result.rowcount < batch_size:
+            break
+
+    if total:
+        logger.info(f"Pruned {total} chat change log entries older than {max_age_days} days")
+    return total
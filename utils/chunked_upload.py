@@ -0,0 +1,286 @@
+"""
+Chunked Uploads
+Resumable uploads received as a series of chunks appended to a spool file
+
+A plain upload is a single multipart request capped by MAX_CONTENT_LENGTH,
+which Werkzeug buffers before the upload code sees it and which restarts
+from zero when the connection drops. A chunked upload starts a session
+announcing the file's name, size and media type, then sends the bytes in
+PUT requests of at most upload.chunk_size_bytes, each naming its offset in
+a Content-Range header. Every chunk is streamed straight onto the end of the
+session's spool file, so a request holds a worker for one chunk only and
+memory use does not depend on the file size.
+
+The length of the spool file is the offset the next chunk must start at;
+after an interruption the client asks for it and carries on from there.
+Completing the session hashes and checks the file and hands it to the
+background upload pipeline (utils.upload.start_spooled_upload). Sessions
+that are not completed within upload.session_ttl_seconds are removed by the
+purge worker.
+"""
+import os
+import uuid
+import fcntl
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional
+
+from werkzeug.utils import secure_filename
+
+from config import get_config, get_max_upload_size
+from utils.upload_spool import (CHUNK_SIZE, SpooledUpload, UploadRejected, sniff_type,
+                                allowed_image_types, allowed_video_types)
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class ChunkConflict(Exception):
+    """Raised when a chunk does not start at the session's current offset or another request holds the session"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Expected a chunk at offset {offset}")
+        self.offset = offset
+
+def _allowed_types(media_type: str) -> set:
+    return allowed_image_types() if media_type == 'image' else allowed_video_types()
+
+def _lock(file, offset_of) -> None:
+    """Take the session's lock without waiting, a concurrent writer is a conflict"""
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise ChunkConflict(offset_of())
+
+class ChunkedUploads:
+    """
+    Creates upload sessions and appends their chunks
+    """
+
+    def __init__(self):
+        self.chunk_size = get_config('upload.chunk_size_bytes', 4 * 1024 * 1024)
+        self.max_size = get_config('upload.max_chunked_upload_size_bytes', 1024 * 1024 * 1024)
+        self.ttl = get_config('upload.session_ttl_seconds', 86400)
+
+        # Counters for monitoring
+        self.stats = {
+            'sessions': 0,
+            'chunks': 0,
+            'bytes_received': 0,
+            'offset_conflicts': 0,
+            'completed': 0,
+            'expired': 0
+        }
+
+    def max_size_for(self, media_type: str) -> int:
+        """Size limit of a chunked upload, images keep the limit of plain uploads"""
+        return self.max_size if media_type == 'video' else get_max_upload_size()
+
+    def create(self, user_id: int, filename: str, size: int, media_type: str):
+        """
+        Start an upload session (inside an app context)
+
+        Args:
+            user_id: Owner of the session
+            filename: Name of the file being uploaded
+            size: Total size of the file in bytes
+            media_type: 'image' or 'video'
+
+        Returns:
+            UploadSession: The new session
+
+        Raises:
+            UploadRejected: If the media type is unknown or the size is out of bounds
+        """
+        from database import db
+        from models import UploadSession
+
+        if media_type not in ('image', 'video'):
+            raise UploadRejected(f"Unknown media type: {media_type}")
+        if size <= 0:
+            raise UploadRejected("File is empty")
+        max_size = self.max_size_for(media_type)
+        if size > max_size:
+            raise UploadRejected(f"File is larger than {max_size} bytes")
+
+        spool_dir = get_config('upload.spool_dir', '') or None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='chunked_', dir=spool_dir)
+        os.close(fd)
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            filename=secure_filename(filename or '') or 'upload',
+            media_type=media_type,
+            size=size,
+            path=path,
+            expires_at=datetime.utcnow() + timedelta(seconds=self.ttl)
+        )
+        db.session.add(session)
+        db.session.commit()
+        self.stats['sessions'] += 1
+        logger.debug(f"Started chunked upload {session.id}: {session.filename}, {size} bytes")
+        return session
+
+    def get(self, session_id: str, user_id: int):
+        """Get a user's unexpired session, or None"""
+        from database import db
+        from models import UploadSession
+
+        session = db.session.get(UploadSession, session_id)
+        if session is None or session.user_id != user_id or session.expires_at < datetime.utcnow():
+            return None
+        return session
+
+    def offset(self, session) -> int:
+        """Number of bytes received so far, where the next chunk starts"""
+        try:
+            return os.path.getsize(session.path)
+        except OSError:
+            return 0
+
+    def append(self, session, offset: int, stream, length: int) -> int:
+        """
+        Stream a chunk from a request body onto the end of the session's spool file
+
+        Bytes that arrived before the client went away are kept, the client
+        resumes from the offset it is told next.
+
+        Args:
+            session: The upload session
+            offset: Position of the chunk in the file
+            stream: Request body
+            length: Length of the chunk
+
+        Returns:
+            int: The new offset
+
+        Raises:
+            ChunkConflict: If the chunk does not start at the current offset
+            UploadRejected: If the chunk is too large, runs past the end of the
+                file or the file is not of the session's media type
+        """
+        if length <= 0 or length > self.chunk_size:
+            raise UploadRejected(f"Chunks must be between 1 and {self.chunk_size} bytes")
+        if offset + length > session.size:
+            raise UploadRejected("Chunk runs past the end of the file")
+
+        try:
+            spool = open(session.path, 'r+b')
+        except OSError:
+            raise UploadRejected("Upload session has expired")
+
+        with spool:
+            _lock(spool, lambda: self.offset(session))
+            current = os.fstat(spool.fileno()).st_size
+            if offset != current:
+                self.stats['offset_conflicts'] += 1
+                raise ChunkConflict(current)
+
+            spool.seek(current)
+            written = 0
+            try:
+                while written < length:
+                    block = stream.read(min(CHUNK_SIZE, length - written))
+                    if not block:
+                        break
+                    if current + written == 0:
+                        self._check_type(session, block, spool)
+                    spool.write(block)
+                    written += len(block)
+            finally:
+                spool.flush()
+                self.stats['bytes_received'] += written
+
+        self.stats['chunks'] += 1
+        return current + written
+
+    def _check_type(self, session, head: bytes, spool) -> None:
+        """Refuse a file whose first bytes are not of the session's media type, before the rest is sent"""
+        if len(head) < 12 and len(head) < session.size:
+            return
+        mime_type = sniff_type(head)
+        if mime_type not in _allowed_types(session.media_type):
+            spool.truncate(0)
+            raise UploadRejected(f"File is not a supported {session.media_type}")
+
+    def complete(self, session) -> SpooledUpload:
+        """
+        Finish a session whose bytes have all arrived (inside an app context)
+
+        The spool file is hashed and checked like a plain upload and the
+        session is removed; the file now belongs to the returned spool.
+
+        Returns:
+            SpooledUpload: The received file, owned by the caller
+
+        Raises:
+            ChunkConflict: If bytes are still missing
+            UploadRejected: If the file is not of the session's media type
+        """
+        from database import db
+
+        try:
+            spool = open(session.path, 'rb')
+        except OSError:
+            raise UploadRejected("Upload session has expired")
+
+        digest = hashlib.sha256()
+        with spool:
+            _lock(spool, lambda: self.offset(session))
+            size = os.fstat(spool.fileno()).st_size
+            if size != session.size:
+                raise ChunkConflict(size)
+
+            head = spool.read(12)
+            spool.seek(0)
+            for chunk in iter(lambda: spool.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+            mime_type = sniff_type(head)
+            if mime_type not in _allowed_types(session.media_type):
+                self.abort(session)
+                raise UploadRejected(f"File is not a supported {session.media_type}")
+
+            # Deleted while the lock is held, a second completion finds no session
+            db.session.delete(session)
+            db.session.commit()
+
+        self.stats['completed'] += 1
+        logger.info(f"Received chunked upload {session.id}: {session.filename}, {size} bytes")
+        return SpooledUpload(session.path, session.filename, size, digest.hexdigest(), mime_type)
+
+    def abort(self, session) -> None:
+        """Remove a session and what it received (inside an app context)"""
+        from database import db
+
+        try:
+            os.remove(session.path)
+        except OSError:
+            pass
+        db.session.delete(session)
+        db.session.commit()
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """
+        Remove sessions past their expiry with their spool files (inside an app context)
+
+        Returns:
+            int: Number of sessions removed
+        """
+        from models import UploadSession
+
+        now = now or datetime.utcnow()
+        expired = UploadSession.query.filter(UploadSession.expires_at < now).all()
+        for session in expired:
+            self.abort(session)
+        self.stats['expired'] += len(expired)
+        if expired:
+            logger.info(f"Removed {len(expired)} expired chunked uploads")
+        return len(expired)
+
+# Create a singleton instance
+chunked_uploads = ChunkedUploads()
@@ -0,0 +1,266 @@
+"""
+Compact Socket Events
+Per-connection MessagePack encoding of socket event payloads
+
+Clients that load static/js/compact.js ask for compact payloads with the
+negotiate_encoding event. Events sent to them through the outbound guard are
+then MessagePack binary attachments instead of JSON:
+
+- keys are replaced by short aliases,
+- ISO timestamps become epoch milliseconds,
+- the sender's username and avatar URL are sent once per connection and then
+  referenced by user ID (interned profiles).
+
+Each payload is a two element array: [new profiles or nil, body]. The body is
+encoded once per broadcast; only the profile prefix differs per connection.
+The alias tables are sent to the client when it negotiates, so the decoder
+never drifts from this module.
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import get_config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+ENCODING_MSGPACK = 'msgpack'
+ENCODING_JSON = 'json'
+
+# Long key -> short alias
+KEY_ALIASES = {
+    'id': 'i',
+    'type': 'y',
+    'user_id': 'u',
+    'username': 'n',
+    'status': 'st',
+    'conversation_id': 'c',
+    'chat_id': 'ch',
+    'sender_id': 's',
+    'recipient_id': 'r',
+    'content': 'm',
+    'message_type': 'mt',
+    'media_url': 'mu',
+    'read': 'rd',
+    'read_by': 'rb',
+    'is_deleted': 'x',
+    'post_id': 'p',
+    'comment_id': 'cm',
+    'like_count': 'lc',
+    'author': 'au',
+    'message_id': 'mi',
+    'seq': 'q',
+    'epoch': 'e'
+}
+
+# Timestamp keys -> alias used when the value was converted to epoch milliseconds
+TIMESTAMP_ALIASES = {
+    'created_at': 'at',
+    'updated_at': 'ua',
+    'read_at': 'ra',
+    'last_online': 'lo',
+    'timestamp': 'ts'
+}
+
+# Sender profile fields interned per connection: (user ID field, username field, avatar field)
+PROFILE_SHAPES = [
+    ('sender_id', 'sender_username', 'sender_profile_pic'),
+    ('user_id', 'sender', 'profile_pic')
+]
+
+# Body key holding the index of the interned profile shape
+PROFILE_KEY = '@'
+
+def _to_epoch_ms(value: Any) -> Optional[int]:
+    """Convert a datetime or ISO string to epoch milliseconds (naive values are UTC, as the models store them)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    return None
+
+def compact_value(value: Any) -> Any:
+    """Replace keys by their aliases and timestamps by epoch milliseconds"""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in TIMESTAMP_ALIASES:
+                millis = _to_epoch_ms(item)
+                if millis is not None:
+                    result[TIMESTAMP_ALIASES[key]] = millis
+                    continue
+            result[KEY_ALIASES.get(key, key)] = compact_value(item)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [compact_value(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _split_profile(data: Dict) -> Tuple[Dict, Optional[Tuple[int, str, Optional[str]]]]:
+    """Take the sender profile out of a payload so it can be interned"""
+    for index, (id_field, name_field, pic_field) in enumerate(PROFILE_SHAPES):
+        if id_field in data and name_field in data and pic_field in data:
+            body = {key: value for key, value in data.items() if key not in (name_field, pic_field)}
+            body[PROFILE_KEY] = index
+            return body, (data[id_field], data[name_field], data[pic_field])
+    return data, None
+
+def get_schema() -> Dict:
+    """Alias tables the client needs to decode compact payloads"""
+    keys = {alias: key for key, alias in KEY_ALIASES.items()}
+    keys.update({alias: key for key, alias in TIMESTAMP_ALIASES.items()})
+    return {
+        'encoding': ENCODING_MSGPACK,
+        'keys': keys,
+        'timestamps': list(TIMESTAMP_ALIASES.values()),
+        'profiles': PROFILE_SHAPES,
+        'profile_key': PROFILE_KEY
+    }
+
+class CompactEncoder:
+    """
+    Tracks which connections use compact payloads and the profiles each has seen
+    """
+
+    def __init__(self, enabled: bool, intern_size: int):
+        self.enabled = enabled and msgpack is not None
+        self.intern_size = intern_size
+
+        # sid -> user IDs whose profile the connection holds
+        self._connections = {}
+        # user_id -> ((username, profile_pic), sids holding that profile)
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'connections': 0,
+            'payloads': 0,
+            'bytes': 0,
+            'profiles_sent': 0,
+            'encode_seconds': 0.0
+        }
+
+        if enabled and msgpack is None:
+            logger.warning("msgpack not installed, socket payloads stay JSON. Install it with: pip install msgpack")
+
+    def negotiate(self, encodings: Iterable[str]) -> str:
+        """Pick the encoding for a connection from the ones the client supports"""
+        if self.enabled and ENCODING_MSGPACK in (encodings or []):
+            return ENCODING_MSGPACK
+        return ENCODING_JSON
+
+    def enable(self, sid: str) -> None:
+        """Start sending compact payloads to a connection"""
+        with self._lock:
+            if sid not in self._connections:
+                self._connections[sid] = set()
+                self.stats['connections'] += 1
+
+    def is_compact(self, sid: str) -> bool:
+        return sid in self._connections
+
+    def forget(self, sid: str) -> None:
+        with self._lock:
+            user_ids = self._connections.pop(sid, None)
+            if user_ids is None:
+                return
+            self.stats['connections'] -= 1
+            for user_id in user_ids:
+                holders = self._profiles.get(user_id)
+                if holders is not None:
+                    holders[1].discard(sid)
+                    if not holders[1]:
+                        del self._profiles[user_id]
+
+    def encode(self, data: Any) -> Tuple[bytes, Optional[Tuple[int, str, Optional[str]]]]:
+        """
+        Encode an event payload once for all compact recipients
+
+        Returns:
+            Tuple[bytes, Optional[Tuple]]: Packed body and the sender profile to intern
+        """
+        start = time.perf_counter()
+        profile = None
+        if isinstance(data, dict):
+            data, profile = _split_profile(data)
+        body = msgpack.packb(compact_value(data), use_bin_type=True)
+        self.stats['encode_seconds'] += time.perf_counter() - start
+        return body, profile
+
+    def group_payloads(self, sids: List[str], body: bytes,
+                       profile: Optional[Tuple[int, str, Optional[str]]]) -> List[Tuple[bytes, List[str]]]:
+        """
+        Build the payloads for a broadcast to compact connections
+
+        Connections that have not seen the sender's profile get it prefixed,
+        the others share the plain payload.
+
+        Returns:
+            List[Tuple[bytes, List[str]]]: (payload, sids) pairs, at most two
+        """
+        # A fixarray of two elements followed by the already packed parts
+        plain = b'\x92\xc0' + body
+        fresh, known = [], list(sids)
+
+        if profile is not None:
+            user_id, username, profile_pic = profile
+            recipients = set(sids)
+            with self._lock:
+                value, holders = self._profiles.get(user_id, (None, None))
+                if holders is None or value != (username, profile_pic):
+                    # A changed profile must be resent to everyone
+                    for sid in holders or ():
+                        self._connections[sid].discard(user_id)
+                    holders = set()
+                    self._profiles[user_id] = ((username, profile_pic), holders)
+
+                known = list(recipients & holders)
+                fresh = list(recipients - holders)
+
+                # Connections with a full table get the profile every time
+                for sid in fresh:
+                    interned = self._connections.get(sid)
+                    if interned is not None and len(interned) < self.intern_size:
+                        interned.add(user_id)
+                        holders.add(sid)
+                if not holders:
+                    del self._profiles[user_id]
+
+        groups = []
+        if fresh:
+            prefix = msgpack.packb([[user_id, username, profile_pic]], use_bin_type=True)
+            groups.append((b'\x92' + prefix + body, fresh))
+            self.stats['profiles_sent'] += len(fresh)
+        if known:
+            groups.append((plain, known))
+
+        for payload, recipients in groups:
+            self.stats['payloads'] += len(recipients)
+            self.stats['bytes'] += len(payload) * len(recipients)
+        return groups
+
+    def payload_for(self, sid: str, body: bytes, profile: Optional[Tuple[int, str, Optional[str]]]) -> bytes:
+        """Build the payload for a single connection"""
+        groups = self.group_payloads([sid], body, profile)
+        return groups[0][0] if groups else b'\x92\xc0' + body
+
+# Create a singleton instance
+compact_encoder = CompactEncoder(
+    get_config('realtime.compact_encoding_enabled', True),
+    get_config('realtime.compact_intern_size', 256)
+)
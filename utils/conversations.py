@@ -0,0 +1,151 @@
+"""
+Conversation Lookup Utility
+Canonical (low, high) user-pair lookup for direct conversations with a small LRU cache
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import Conversation
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class _LRUCache:
+    """Small thread-safe LRU mapping"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+# Recent pair -> conversation ID cache
+PAIR_CACHE_SIZE = 1024
+_pair_cache = _LRUCache(PAIR_CACHE_SIZE)
+
+# Conversation ID -> (user1_id, user2_id); participants never change
+PARTICIPANTS_CACHE_SIZE = 4096
+_participants_cache = _LRUCache(PARTICIPANTS_CACHE_SIZE)
+
+def conversation_pair(user_a_id: int, user_b_id: int) -> Tuple[int, int]:
+    """
+    Return the canonical (low, high) key for a pair of users
+    """
+    return (user_a_id, user_b_id) if user_a_id <= user_b_id else (user_b_id, user_a_id)
+
+def clear_conversation_cache() -> None:
+    """
+    Drop all cached conversation lookups
+    """
+    _pair_cache.clear()
+    _participants_cache.clear()
+
+def get_conversation_participants(conversation_id: int) -> Optional[Tuple[int, int]]:
+    """
+    Get the two participants of a conversation
+
+    Args:
+        conversation_id: ID of the conversation
+
+    Returns:
+        Optional[Tuple[int, int]]: (user1_id, user2_id), or None if the conversation does not exist
+    """
+    participants = _participants_cache.get(conversation_id)
+    if participants is not None:
+        return participants
+
+    row = db.session.query(Conversation.user1_id, Conversation.user2_id).filter_by(
+        id=conversation_id
+    ).first()
+
+    if row is None:
+        return None
+
+    participants = (row.user1_id, row.user2_id)
+    _participants_cache.put(conversation_id, participants)
+    return participants
+
+def find_conversation_id(user_a_id: int, user_b_id: int) -> Optional[int]:
+    """
+    Find the conversation between two users without creating it
+
+    Args:
+        user_a_id: ID of one participant
+        user_b_id: ID of the other participant
+
+    Returns:
+        Optional[int]: Conversation ID, or None if the users have never talked
+    """
+    pair = conversation_pair(user_a_id, user_b_id)
+    conversation_id = _pair_cache.get(pair)
+    if conversation_id is not None:
+        return conversation_id
+
+    # Single probe of the unique (low_user_id, high_user_id) index
+    row = db.session.query(Conversation.id).filter_by(
+        low_user_id=pair[0],
+        high_user_id=pair[1]
+    ).first()
+
+    if row is None:
+        return None
+
+    _pair_cache.put(pair, row.id)
+    return row.id
+
+def get_or_create_conversation_id(user_a_id: int, user_b_id: int) -> int:
+    """
+    Atomically find or create the conversation between two users
+
+    A new conversation is inserted inside a savepoint and becomes part of the
+    caller's transaction. If a concurrent request created the same pair first,
+    the unique index rejects the insert and the existing row is returned.
+
+    Args:
+        user_a_id: ID of the user starting the conversation
+        user_b_id: ID of the other participant
+
+    Returns:
+        int: Conversation ID
+    """
+    conversation_id = find_conversation_id(user_a_id, user_b_id)
+    if conversation_id is not None:
+        return conversation_id
+
+    try:
+        with db.session.begin_nested():
+            conversation = Conversation(
+                user1_id=user_a_id,
+                user2_id=user_b_id
+            )
+            db.session.add(conversation)
+        # Not cached until committed; the next lookup caches it
+        return conversation.id
+    except IntegrityError:
+        logger.debug(f"Conversation between {user_a_id} and {user_b_id} created concurrently, reusing it")
+        conversation_id = find_conversation_id(user_a_id, user_b_id)
+        if conversation_id is None:
+            raise
+        return conversation_id
@@ -0,0 +1,121 @@
+"""
+Direct Messages Utility
+Sending and reading one-to-one messages, shared by the Socket.IO handlers
+and the realtime gateway
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict
+
+from database import db
+from models import User, Message
+from utils.conversations import get_or_create_conversation_id, get_conversation_participants
+from utils.message_writer import message_writer, KIND_MESSAGE
+from utils.typing_indicator import typing_tracker
+from utils.websocket import publish_event
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a message to be written before acknowledging failure
+MESSAGE_ACK_TIMEOUT = 5
+
+def join_conversation(user_id: int, conversation_id: int) -> Dict:
+    """
+    Check that a user may join a conversation and mark its messages to them as read
+
+    Returns:
+        Dict: Acknowledgement sent back to the client
+    """
+    if not conversation_id:
+        return {'success': False, 'error': 'Missing conversation ID'}
+
+    # Check if user is part of this conversation
+    participants = get_conversation_participants(conversation_id)
+    if not participants:
+        return {'success': False, 'error': 'Conversation not found'}
+
+    if user_id not in participants:
+        logger.warning(f"User {user_id} attempted to join conversation {conversation_id} they're not part of")
+        return {'success': False, 'error': 'Not authorized to join this conversation'}
+
+    # Mark messages as read
+    Message.query.filter_by(
+        conversation_id=conversation_id,
+        recipient_id=user_id,
+        read=False
+    ).update({'read': True})
+    db.session.commit()
+
+    # Notify the other user that messages have been read
+    other_user_id = participants[1] if participants[0] == user_id else participants[0]
+    publish_event('messages_read', {
+        'conversation_id': conversation_id,
+        'user_id': user_id
+    }, room=f"user_{other_user_id}")
+
+    return {'success': True}
+
+def send_direct_message(user_id: int, recipient_id: int, content: str) -> Dict:
+    """
+    Queue a direct message, wait until it is durable and emit it to both users
+
+    Returns:
+        Dict: Acknowledgement sent back to the sender
+    """
+    user = User.query.get(user_id)
+    if not user:
+        logger.warning(f"User {user_id} not found in database")
+        return {'success': False, 'error': 'User not found'}
+
+    if not recipient_id or not content:
+        return {'success': False, 'error': 'Missing required fields'}
+
+    # Get recipient
+    recipient = User.query.get(recipient_id)
+    if not recipient:
+        return {'success': False, 'error': 'Recipient not found'}
+
+    # Find or create conversation (a new one is committed before the message is queued)
+    conversation_id = get_or_create_conversation_id(user.id, recipient.id)
+    db.session.commit()
+
+    # The message replaces the sender's typing indicator
+    typing_tracker.stop(user.id, conversation_id)
+
+    # Hand the message to the group-commit writer, the database assigns its ID
+    pending = message_writer.submit(KIND_MESSAGE, {
+        'conversation_id': conversation_id,
+        'sender_id': user.id,
+        'recipient_id': recipient.id,
+        'content': content,
+        'created_at': datetime.now(timezone.utc),
+        'read': False
+    }, touch={'conversation_id': conversation_id})
+
+    # Emit only once the message is durable, a withdrawn message is never written
+    if not pending.wait(timeout=MESSAGE_ACK_TIMEOUT):
+        return {'success': False, 'error': 'Message could not be saved'}
+
+    # Prepare message data for sending
+    message_data = {
+        'id': pending.id,
+        'conversation_id': conversation_id,
+        'sender_id': user.id,
+        'sender_username': user.username,
+        'sender_profile_pic': user.profile_pic,
+        'recipient_id': recipient.id,
+        'content': content,
+        'created_at': pending.values['created_at'].isoformat(),
+        'read': False
+    }
+
+    # Emit to conversation room
+    room_name = f"conversation_{conversation_id}"
+    publish_event('new_message', message_data, room=room_name)
+
+    # Also emit to recipient's user room (in case they're not in the conversation room)
+    publish_event('new_message', message_data, room=f"user_{recipient.id}")
+
+    # Return success to sender
+    return {'success': True, 'message': message_data}
@@ -0,0 +1,129 @@
+"""
+Event Replay Buffer
+Per-user event sequence numbers and a bounded ring buffer of recent realtime events
+
+Every event sent to a user room gets the next sequence number for that user.
+A reconnecting client reports the last sequence it saw and receives only the
+events it missed. If the gap is no longer buffered (or the server restarted,
+which changes the epoch) the client is told to do a full resync instead.
+"""
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, List, Optional, Tuple
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class EventReplayBuffer:
+    """
+    Keeps the last `capacity` events of up to `max_users` users
+
+    Events older than max_age seconds are not replayed.
+    """
+
+    def __init__(self, capacity: int, max_users: int, max_age: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.max_users = max_users
+        self.max_age = max_age
+        self.clock = clock
+
+        # Changes whenever sequences restart, so stale client sequences are detected
+        self.epoch = secrets.token_hex(4)
+
+        # user_id -> {'seq': last assigned sequence, 'events': deque of (seq, time, event_type, data)}
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'events_recorded': 0,
+            'events_replayed': 0,
+            'replays': 0,
+            'resyncs': 0
+        }
+
+    def _get_user(self, user_id: int):
+        user = self._users.get(user_id)
+        if user is None:
+            user = {'seq': 0, 'events': deque(maxlen=self.capacity)}
+            self._users[user_id] = user
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return user
+
+    def record(self, user_id: int, event_type: str, data: Any) -> int:
+        """
+        Assign the next sequence number to an event and buffer it
+
+        Returns:
+            int: The event's sequence number
+        """
+        with self._lock:
+            user = self._get_user(user_id)
+            user['seq'] += 1
+            user['events'].append((user['seq'], self.clock(), event_type, data))
+            self.stats['events_recorded'] += 1
+            return user['seq']
+
+    def current(self, user_id: int) -> int:
+        """Get the last sequence number assigned to a user"""
+        with self._lock:
+            user = self._users.get(user_id)
+            return user['seq'] if user else 0
+
+    def replay(self, user_id: int, last_seq: int, epoch: Optional[str] = None) -> Tuple[List[Tuple[int, str, Any]], bool]:
+        """
+        Get the events a client missed
+
+        Args:
+            user_id: ID of the reconnecting user
+            last_seq: Last sequence number the client received
+            epoch: Epoch the client's sequence belongs to
+
+        Returns:
+            Tuple[List[Tuple[int, str, Any]], bool]: (seq, event_type, data) events after
+            last_seq, and False if the gap cannot be filled and the client must resync
+        """
+        if epoch is not None and epoch != self.epoch:
+            with self._lock:
+                self.stats['resyncs'] += 1
+            return [], False
+
+        now = self.clock()
+        with self._lock:
+            user = self._users.get(user_id)
+            current = user['seq'] if user else 0
+
+            if last_seq >= current:
+                # Nothing missed (or a sequence from the future we cannot trust)
+                if last_seq > current:
+                    self.stats['resyncs'] += 1
+                return [], last_seq == current
+
+            events = [
+                (seq, event_type, data) for seq, recorded_at, event_type, data in user['events']
+                if seq > last_seq and now - recorded_at <= self.max_age
+            ]
+
+            # The oldest missed event must still be buffered
+            if not events or events[0][0] != last_seq + 1:
+                self.stats['resyncs'] += 1
+                return [], False
+
+            self.stats['replays'] += 1
+            self.stats['events_replayed'] += len(events)
+            return events, True
+
+# Create a singleton instance
+event_buffer = EventReplayBuffer(
+    get_config('realtime.replay_buffer_size', 100),
+    get_config('realtime.replay_max_users', 10000),
+    get_config('realtime.replay_max_age_seconds', 300)
+)
@@ -12,7 +12,7 @@ def timeago(value):
     if value is None:
         return ""
 
-    now = datetime.now()
+    now = datetime.utcnow()
     diff = now - value
 
     seconds = diff.total_seconds()
@@ -38,9 +38,15 @@ def timeago(value):
         years = int(seconds / 31536000)
         return f"{years} year{'s' if years > 1 else ''} ago"
 
+def sized(url, width):
+    """Smallest stored copy of an image URL that covers a display width in pixels."""
+    from utils.image_derivatives import pick_size
+    return pick_size(url, width)
+
 # Register filters with Flask app
 def register_filters(app):
     """Register custom filters with the Flask app."""
     app.jinja_env.filters['strftime'] = format_datetime
     app.jinja_env.filters['timeago'] = timeago
     app.jinja_env.filters['humanize'] = timeago  # Add humanize as an alias for timeago
+    app.jinja_env.filters['sized'] = sized
@@ -0,0 +1,300 @@
+"""
+Realtime Gateway IPC
+Local channel between the Flask app and the asyncio realtime gateway
+
+The gateway (realtime_gateway.py) terminates the websocket connections and
+asks the app over a Unix socket for anything that needs the database. Frames
+are JSON objects, one per line:
+
+    gateway -> app   {"id": 1, "op": "auth", "args": {...}}
+    app -> gateway   {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+    app -> gateway   {"op": "emit", "event": "...", "data": ..., "room": "..."}
+
+Requests are handled on a small thread pool, so a message waiting for its
+durable write does not hold up other requests from the same gateway.
+
+Every app worker process listens on its own socket next to
+realtime.gateway_socket_path (realtime_gateway.<pid>.sock). The gateway
+connects to all of them, so it receives the emits of every worker and
+spreads its requests over them.
+"""
+import os
+import glob
+import json
+import logging
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+def worker_socket_path(path: str, pid: int) -> str:
+    """Get the socket of one app worker from the configured socket path"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{pid}{ext or '.sock'}"
+
+def find_worker_sockets(path: str) -> List[str]:
+    """Get the sockets of the app workers, and path itself if it exists"""
+    stem, ext = os.path.splitext(path)
+    paths = sorted(glob.glob(f"{glob.escape(stem)}.*{ext or '.sock'}"))
+    if os.path.exists(path):
+        paths.insert(0, path)
+    return paths
+
+def encode_frame(frame: Dict) -> bytes:
+    """Encode a frame as one JSON line"""
+    return json.dumps(frame, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+
+def decode_frame(line: bytes) -> Dict:
+    """Decode one JSON line into a frame"""
+    return json.loads(line.decode('utf-8'))
+
+class _GatewayConnection(socketserver.StreamRequestHandler):
+    """One connected gateway process"""
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+
+    def send(self, data: bytes) -> None:
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        bridge = self.server.bridge
+        bridge._add_connection(self)
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    frame = decode_frame(line)
+                except ValueError:
+                    logger.warning("Discarding malformed frame from realtime gateway")
+                    continue
+                bridge._executor.submit(self._respond, frame)
+        finally:
+            bridge._remove_connection(self)
+
+    def _respond(self, frame: Dict) -> None:
+        response = self.server.bridge.handle(frame)
+        try:
+            self.send(encode_frame(response))
+        except OSError as e:
+            logger.warning(f"Could not answer realtime gateway request: {str(e)}")
+
+class _BridgeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class GatewayBridge:
+    """
+    App side of the gateway channel: answers gateway requests and pushes room emits
+    """
+
+    def __init__(self, workers: int = 8):
+        self.app = None
+        self.path = None
+        self.workers = workers
+        self.operations = {}
+
+        self._server = None
+        self._executor = None
+        self._connections = set()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'published': 0
+        }
+
+    def operation(self, name: str) -> Callable:
+        """Register a function the gateway can call by name"""
+        def decorator(func):
+            self.operations[name] = func
+            return func
+        return decorator
+
+    def init_app(self, app, path: str) -> None:
+        """Start listening for gateways on a Unix socket"""
+        self.app = app
+        self.path = path
+
+        # A socket file left by a previous process with the same PID would make bind fail
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gateway-ipc')
+        self._server = _BridgeServer(path, _GatewayConnection)
+        self._server.bridge = self
+
+        thread = threading.Thread(target=self._server.serve_forever, name='gateway-ipc', daemon=True)
+        thread.start()
+        logger.info(f"Realtime gateway channel listening on {path}")
+
+    def stop(self) -> None:
+        """Stop listening and close gateway connections"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._executor.shutdown(wait=False)
+        self._server = None
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    @property
+    def connected(self) -> bool:
+        return bool(self._connections)
+
+    def _add_connection(self, connection) -> None:
+        with self._lock:
+            self._connections.add(connection)
+        logger.info("Realtime gateway connected")
+
+    def _remove_connection(self, connection) -> None:
+        with self._lock:
+            self._connections.discard(connection)
+        logger.info("Realtime gateway disconnected")
+
+    def handle(self, frame: Dict) -> Dict:
+        """
+        Run a gateway request
+
+        Returns:
+            Dict: Response frame with the same id
+        """
+        from database import db
+
+        self.stats['requests'] += 1
+        operation = self.operations.get(frame.get('op'))
+        if operation is None:
+            self.stats['errors'] += 1
+            return {'id': frame.get('id'), 'error': f"Unknown operation: {frame.get('op')}"}
+
+        with self.app.app_context():
+            try:
+                return {'id': frame.get('id'), 'result': operation(**(frame.get('args') or {}))}
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.exception(f"Error handling gateway operation {frame.get('op')}: {str(e)}")
+                db.session.rollback()
+                return {'id': frame.get('id'), 'error': str(e)}
+            finally:
+                db.session.remove()
+
+    def publish(self, event: str, data: Any, room: Optional[str] = None) -> None:
+        """Push a room emit to every connected gateway"""
+        if not self._connections:
+            return
+
+        payload = encode_frame({'op': 'emit', 'event': event, 'data': data, 'room': room})
+        with self._lock:
+            connections = list(self._connections)
+
+        for connection in connections:
+            try:
+                connection.send(payload)
+                self.stats['published'] += 1
+            except OSError as e:
+                logger.warning(f"Dropping realtime gateway connection: {str(e)}")
+                self._remove_connection(connection)
+
+# Create a singleton instance
+gateway_bridge = GatewayBridge(get_config('realtime.gateway_ipc_workers', 8))
+
+def init_gateway_bridge(app) -> None:
+    """Open the gateway channel if the realtime gateway is enabled"""
+    if not get_config('realtime.gateway_enabled', False):
+        return
+
+    path = get_config('realtime.gateway_socket_path', 'instance/realtime_gateway.sock')
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    gateway_bridge.init_app(app, worker_socket_path(path, os.getpid()))
+
+@gateway_bridge.operation('auth')
+def _auth(cookie: str = '', last_seq: Optional[int] = None, epoch: Optional[str] = None) -> Optional[Dict]:
+    """Resolve a websocket's session cookie to a user and mark them online"""
+    from datetime import datetime
+    from flask import current_app, session
+    from database import db
+    from models import User
+    from utils.event_replay import event_buffer
+
+    with current_app.test_request_context('/', headers={'Cookie': cookie or ''}):
+        user_id = session.get('user_id')
+
+    user = User.query.get(user_id) if user_id else None
+    if not user:
+        return None
+
+    user.is_active = True
+    user.last_online = datetime.utcnow()
+    db.session.commit()
+
+    result = {
+        'user_id': user.id,
+        'username': user.username,
+        'epoch': event_buffer.epoch,
+        'seq': event_buffer.current(user.id),
+        'replay': [],
+        'complete': True
+    }
+
+    # Events missed while the client was disconnected
+    if last_seq is not None:
+        events, complete = event_buffer.replay(user.id, int(last_seq), epoch)
+        result['replay'] = [[seq, event_type, data] for seq, event_type, data in events]
+        result['complete'] = complete
+
+    return result
+
+@gateway_bridge.operation('presence')
+def _presence(user_id: int, online: bool) -> None:
+    """Record a user's online status and broadcast it"""
+    from datetime import datetime
+    from database import db
+    from models import User
+    from utils.websocket import publish_event
+
+    user = User.query.get(user_id)
+    if not user:
+        return None
+
+    user.is_active = online
+    user.last_online = datetime.utcnow()
+    db.session.commit()
+
+    publish_event('user_status', {
+        'user_id': user.id,
+        'username': user.username,
+        'status': 'online' if online else 'offline'
+    })
+    return None
+
+@gateway_bridge.operation('participants')
+def _participants(conversation_id: int) -> list:
+    """Get the user IDs of a conversation"""
+    from utils.conversations import get_conversation_participants
+
+    return list(get_conversation_participants(conversation_id) or [])
+
+@gateway_bridge.operation('join_conversation')
+def _join_conversation(user_id: int, conversation_id: int) -> Dict:
+    from utils.direct_messages import join_conversation
+
+    return join_conversation(user_id, conversation_id)
+
+@gateway_bridge.operation('send_message')
+def _send_message(user_id: int, recipient_id: int, content: str) -> Dict:
+    from utils.direct_messages import send_direct_message
+
+    return send_direct_message(user_id, recipient_id, content)
@@ -0,0 +1,325 @@
+"""
+Image Derivatives
+Resized, EXIF-free copies of uploaded images and the lookup that serves them
+
+After an image upload is recorded, a small worker pool renders it at the
+fixed widths of media.derivative_widths (only those below the original
+width) as WebP, or JPEG when Pillow has no WebP support. The copies are
+stored content-addressed under static/uploads/derivatives, served from
+/media/derivatives (utils.media_files) and their URLs recorded as JSON in
+FileUpload.derivatives.
+
+Templates (the |sized filter) and API serializers call pick_size to get the
+smallest copy that covers the display width at media.device_pixel_ratio.
+URLs without derivatives (old uploads, animated GIFs, small originals) are
+returned unchanged.
+
+Each image also gets a tiny inline thumbnail (a data: URI of a few hundred
+bytes) when it is uploaded. It is stored on FileUpload, PostMedia and Story
+and sent with the feed and story payloads, so cards show a blurred preview
+while the full image loads from the hosting service.
+"""
+import os
+import json
+import base64
+import time
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps, features
+
+from config import get_config
+from utils.media_files import media_url
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Display widths (CSS pixels) used by the serializers
+AVATAR_WIDTH = 40
+POST_MEDIA_WIDTH = 640
+
+# Directory of the derivatives, relative to the static folder
+DERIVATIVES_DIR = 'uploads/derivatives'
+
+def _parse_derivatives(value: Optional[str]) -> Dict[int, str]:
+    """FileUpload.derivatives JSON -> {width: URL}"""
+    if not value:
+        return {}
+    try:
+        return {int(width): url for width, url in json.loads(value).items()}
+    except (ValueError, AttributeError):
+        return {}
+
+class DerivativeIndex:
+    """
+    Bounded cache of URL -> {width: derivative URL}, loaded from FileUpload on a miss
+
+    URLs without derivatives are cached for media.derivative_miss_ttl_seconds
+    only, so copies rendered by another process show up shortly after.
+    """
+
+    def __init__(self, maxsize: int, miss_ttl: float):
+        self.maxsize = maxsize
+        self.miss_ttl = miss_ttl
+
+        # url -> ({width: URL}, loaded_at)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Dict[int, str]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(url)
+            if entry is not None and (entry[0] or now - entry[1] < self.miss_ttl):
+                self._data.move_to_end(url)
+                return entry[0]
+
+        from models import FileUpload
+
+        upload = FileUpload.query.filter_by(primary_url=url).first()
+        derivatives = _parse_derivatives(upload.derivatives) if upload else {}
+        self.put(url, derivatives)
+        return derivatives
+
+    def put(self, url: str, derivatives: Dict[int, str]) -> None:
+        with self._lock:
+            self._data[url] = (derivatives, time.time())
+            self._data.move_to_end(url)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class ImagePipeline:
+    """
+    Renders image derivatives on a bounded worker pool
+    """
+
+    def __init__(self):
+        self.app = None
+        self.widths = sorted(get_config('media.derivative_widths', [80, 160, 320, 640, 1280]))
+        self.quality = get_config('media.derivative_quality', 80)
+        self.workers = get_config('media.derivative_workers', 2)
+        self.device_pixel_ratio = get_config('media.device_pixel_ratio', 2)
+        self.placeholder_width = get_config('media.placeholder_width', 16)
+        self.placeholder_quality = get_config('media.placeholder_quality', 50)
+
+        fmt = get_config('media.derivative_format', 'webp').lower()
+        if fmt == 'webp' and not features.check('webp'):
+            logger.warning("Pillow has no WebP support, image derivatives fall back to JPEG")
+            fmt = 'jpeg'
+        self.format = fmt
+
+        self.index = DerivativeIndex(
+            get_config('media.derivative_index_size', 4096),
+            get_config('media.derivative_miss_ttl_seconds', 30)
+        )
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'images': 0,
+            'derivatives': 0,
+            'skipped': 0,
+            'failures': 0,
+            'placeholders': 0
+        }
+
+    def init_app(self, app):
+        """
+        Bind the pipeline to the Flask app used by the workers
+        """
+        self.app = app
+        return True
+
+    def submit(self, upload_id: int, spool):
+        """
+        Queue derivatives of an uploaded image
+
+        Args:
+            upload_id: FileUpload row to record the derivatives on
+            spool: Spooled image, the worker keeps its own reference
+
+        Returns:
+            Future or None if the file is not an image or the pipeline is unbound
+        """
+        if self.app is None or not spool.mime_type.startswith('image/'):
+            return None
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='derivatives')
+        return self._executor.submit(self._process, upload_id, spool.retain())
+
+    def _process(self, upload_id: int, spool) -> Dict[int, str]:
+        with spool:
+            try:
+                with self.app.app_context():
+                    derivatives = self.render(spool.path, spool.sha256)
+                    self.record(upload_id, derivatives)
+                    return derivatives
+            except Exception as e:
+                self.stats['failures'] += 1
+                logger.error(f"Error rendering derivatives of upload {upload_id}: {str(e)}")
+                return {}
+
+    def render(self, source_path: str, key: str) -> Dict[int, str]:
+        """
+        Write the derivatives of an image (inside an app context)
+
+        Args:
+            source_path: Path of the original image
+            key: Content hash naming the derivative files
+
+        Returns:
+            Dict[int, str]: Width -> derivative URL
+        """
+        ext = 'webp' if self.format == 'webp' else 'jpg'
+        rel_dir = os.path.join(DERIVATIVES_DIR, key[:2])
+        out_dir = os.path.join(self.app.static_folder, rel_dir)
+
+        with Image.open(source_path) as original:
+            # Re-encoding an animation would keep only its first frame
+            if getattr(original, 'is_animated', False):
+                self.stats['skipped'] += 1
+                return {}
+
+            # Apply the EXIF orientation, the copies carry no EXIF at all
+            image = ImageOps.exif_transpose(original)
+            has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha and self.format == 'webp' else 'RGB')
+
+            derivatives = {}
+            for width in self.widths:
+                if width >= image.width:
+                    break
+                os.makedirs(out_dir, exist_ok=True)
+                height = max(1, round(image.height * width / image.width))
+                filename = f'{key}_{width}.{ext}'
+                path = os.path.join(out_dir, filename)
+
+                # Another upload of the same content may have written it already
+                if not os.path.exists(path):
+                    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+                    image.resize((width, height), Image.LANCZOS).save(
+                        tmp_path, format=self.format.upper(), quality=self.quality, optimize=True
+                    )
+                    os.replace(tmp_path, path)
+
+                derivatives[width] = media_url('derivatives', f'{key[:2]}/{filename}')
+                self.stats['derivatives'] += 1
+
+        self.stats['images'] += 1
+        return derivatives
+
+    def placeholder(self, source) -> Optional[str]:
+        """
+        Render the inline placeholder of an image
+
+        Args:
+            source: Path or file-like object of the image, read from its start
+
+        Returns:
+            Optional[str]: data: URI of the thumbnail, or None if the file is not a readable image
+        """
+        position = source.tell() if hasattr(source, 'tell') else None
+        if position is not None:
+            source.seek(0)
+        try:
+            with Image.open(source) as original:
+                # JPEGs are decoded at a fraction of their size, only a few pixels are kept
+                size = self.placeholder_width * 4
+                original.draft('RGB', (size, size))
+                image = ImageOps.exif_transpose(original).convert('RGB')
+                image.thumbnail((self.placeholder_width, self.placeholder_width), reducing_gap=2.0)
+
+                buffer = BytesIO()
+                image.save(buffer, format=self.format.upper(), quality=self.placeholder_quality)
+        except Exception as e:
+            logger.debug(f"Could not render a placeholder: {str(e)}")
+            return None
+        finally:
+            if position is not None:
+                source.seek(position)
+
+        self.stats['placeholders'] += 1
+        mime_type = 'image/webp' if self.format == 'webp' else 'image/jpeg'
+        return f"data:{mime_type};base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+
+    def record(self, upload_id: int, derivatives: Dict[int, str]) -> None:
+        """Store the derivative URLs on the FileUpload row (inside an app context)"""
+        from database import db
+        from models import FileUpload
+
+        try:
+            upload = FileUpload.query.get(upload_id)
+            if upload is None:
+                return
+            upload.derivatives = json.dumps({str(width): url for width, url in derivatives.items()})
+            db.session.commit()
+            self.index.put(upload.primary_url, derivatives)
+            logger.info(f"Recorded {len(derivatives)} derivatives for upload {upload_id}")
+        finally:
+            db.session.remove()
+
+    def pick_size(self, url: Optional[str], width: int) -> Optional[str]:
+        """
+        Get the smallest derivative covering a display width
+
+        Args:
+            url: Original image URL as stored on the model
+            width: Display width in CSS pixels
+
+        Returns:
+            Optional[str]: Derivative URL, or the original URL if none is large enough
+        """
+        if not url:
+            return url
+
+        try:
+            derivatives = self.index.get(url)
+        except Exception as e:
+            logger.debug(f"Derivative lookup failed for {url}: {str(e)}")
+            return url
+
+        needed = width * self.device_pixel_ratio
+        for size in sorted(derivatives):
+            if size >= needed:
+                return derivatives[size]
+        return url
+
+# Create a singleton instance
+image_pipeline = ImagePipeline()
+
+def pick_size(url: Optional[str], width: int) -> Optional[str]:
+    """Smallest adequate derivative of an image URL for a display width"""
+    return image_pipeline.pick_size(url, width)
+
+def make_placeholder(source) -> Optional[str]:
+    """Inline placeholder (data: URI) of an image file, None if it is not an image"""
+    return image_pipeline.placeholder(source)
+
+def placeholder_for(url: Optional[str]) -> Optional[str]:
+    """
+    Get the placeholder recorded when an image URL was uploaded
+
+    Args:
+        url: URL returned by the upload helpers
+
+    Returns:
+        Optional[str]: data: URI, or None for URLs not uploaded here or uploaded before placeholders
+    """
+    if not url:
+        return None
+
+    from models import FileUpload
+
+    upload = FileUpload.query.filter_by(primary_url=url).first()
+    return upload.placeholder if upload else None
+
+def init_image_pipeline(app):
+    """Bind the shared image pipeline to the app"""
+    return image_pipeline.init_app(app)
@@ -1,16 +1,25 @@
 """
 Image Upload Utility
 Handles uploading images to various external services
+
+Without a service asked for, the services are tried one after another in
+the order of their observed latency, skipping those whose circuit breaker
+is open (utils.service_health). Endpoints found with a discovery request,
+like the GoFile upload server, are cached for
+upload.endpoint_cache_ttl_seconds and looked up again when an upload to
+them fails.
 """
 import os
 import json
+import time
 import logging
+import threading
 import requests
-import random
-import base64
 from io import BytesIO
 from PIL import Image
 from config import get_config
+from utils.service_health import service_health
+from utils.upload_spool import SpooledUpload, spool_upload, post_multipart, allowed_image_types, UploadRejected
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -51,6 +60,11 @@ class ImageUploader:
         
         if not self.active_services:
             logger.warning("No active image upload services available. Check your API keys.")
+
+        # Discovered endpoints: name -> (value, expiry)
+        self.endpoint_ttl = get_config('upload.endpoint_cache_ttl_seconds', 3600)
+        self._endpoints = {}
+        self._endpoints_lock = threading.Lock()
     
     def upload(self, file_data, filename=None, service=None):
         """
@@ -59,7 +73,7 @@ class ImageUploader:
         Args:
             file_data: The image data (bytes or file-like object)
             filename: Optional filename
-            service: Optional service name to use (otherwise random from active services)
+            service: Optional service name to use (otherwise the healthy services, fastest first)
             
         Returns:
             dict: {
@@ -78,25 +92,41 @@ class ImageUploader:
                 'url': None
             }
         
-        # If no service specified, pick a random one from active services
-        if not service or service not in self.active_services:
-            service = random.choice(self.active_services)
-        
-        # Get the appropriate adapter
-        adapter = self.adapters.get(service)
-        if not adapter:
+        # A service asked for is used alone, otherwise the next one is tried when one fails
+        if service and service in self.active_services:
+            candidates = [service] if service_health.allow(service) else []
+        else:
+            candidates = service_health.rank(self.active_services)
+            service = None
+
+        if not candidates:
             return {
                 'success': False,
-                'error': f'Service {service} not supported',
+                'error': f'{service or "Every image upload service"} is failing, try again later',
                 'service': service,
                 'url': None
             }
         
         try:
-            # Call the adapter
-            result = adapter(file_data, filename)
-            result['service'] = service
+            # Spool the file once unless the caller already did
+            if isinstance(file_data, SpooledUpload):
+                spool = file_data.retain()
+            else:
+                spool = spool_upload(file_data, allowed_image_types())
+
+            with spool:
+                for service in candidates:
+                    result = self._upload_to(service, spool, filename or spool.filename)
+                    if result['success']:
+                        break
             return result
+        except UploadRejected as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'service': service,
+                'url': None
+            }
         except Exception as e:
             logger.error(f"Error uploading to {service}: {str(e)}")
             return {
@@ -106,35 +136,82 @@ class ImageUploader:
                 'url': None
             }
     
-    def upload_to_imgur(self, file_data, filename=None):
+    def _upload_to(self, service, spool, filename):
+        """Upload to one service, recording the outcome for its breaker and latency ranking"""
+        adapter = self.adapters.get(service)
+        if not adapter:
+            return {
+                'success': False,
+                'error': f'Service {service} not supported',
+                'service': service,
+                'url': None
+            }
+
+        start = time.perf_counter()
+        try:
+            result = adapter(spool, filename)
+        except Exception as e:
+            logger.error(f"Error uploading to {service}: {str(e)}")
+            result = {'success': False, 'error': str(e)}
+        service_health.record(service, time.perf_counter() - start, bool(result.get('success')))
+
+        result['service'] = service
+        return result
+
+    def _endpoint(self, name, discover):
+        """
+        Get an endpoint found by a discovery request, cached for upload.endpoint_cache_ttl_seconds
+
+        Args:
+            name: Cache key
+            discover: Function making the discovery request, returns the endpoint or None
+        """
+        with self._endpoints_lock:
+            cached = self._endpoints.get(name)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+
+        value = discover()
+        if value:
+            with self._endpoints_lock:
+                self._endpoints[name] = (value, time.monotonic() + self.endpoint_ttl)
+        return value
+
+    def _forget_endpoint(self, name):
+        """Drop a cached endpoint after an upload to it failed, the next upload discovers it again"""
+        with self._endpoints_lock:
+            self._endpoints.pop(name, None)
+
+    def _discover_gofile_server(self):
+        response = requests.get('https://api.gofile.io/getServer', timeout=10)
+        if response.status_code != 200:
+            return None
+        return response.json().get('data', {}).get('server')
+
+    def upload_to_imgur(self, spool, filename=None):
         """Upload image to Imgur"""
         if not self.api_keys.get('imgur'):
             return {'success': False, 'error': 'Imgur API key not configured'}
         
-        # Convert file data to base64 if it's not already
-        if hasattr(file_data, 'read'):
-            # It's a file-like object
-            file_data = file_data.read()
-        
-        # Encode as base64
-        b64_image = base64.b64encode(file_data).decode('utf-8')
-        
         headers = {
             'Authorization': f'Client-ID {self.api_keys["imgur"]}'
         }
         
         data = {
-            'image': b64_image,
-            'type': 'base64'
+            'type': 'file'
         }
         
         if filename:
             data['name'] = filename
         
-        response = requests.post(
+        # Sent as a binary file field, streamed from the spool
+        response = post_multipart(
             'https://api.imgur.com/3/image',
+            spool,
+            'image',
+            data=data,
             headers=headers,
-            data=data
+            filename=filename
         )
         
         if response.status_code == 200:
@@ -149,7 +226,7 @@ class ImageUploader:
                 'error': f'Imgur upload failed: {response.text}'
             }
     
-    def upload_to_catbox(self, file_data, filename=None):
+    def upload_to_catbox(self, spool, filename=None):
         """Upload image to Catbox.moe"""
         if not self.api_keys.get('catbox'):
             return {'success': False, 'error': 'Catbox user hash not configured'}
@@ -158,20 +235,17 @@ class ImageUploader:
         if not filename:
             filename = 'image.jpg'
         
-        # Prepare the file for upload
-        files = {
-            'fileToUpload': (filename, file_data, 'image/jpeg')
-        }
-        
         data = {
             'reqtype': 'fileupload',
             'userhash': self.api_keys['catbox']
         }
         
-        response = requests.post(
+        response = post_multipart(
             'https://catbox.moe/user/api.php',
-            files=files,
-            data=data
+            spool,
+            'fileToUpload',
+            data=data,
+            filename=filename
         )
         
         if response.status_code == 200 and response.text.startswith('https://'):
@@ -185,14 +259,10 @@ class ImageUploader:
                 'error': f'Catbox upload failed: {response.text}'
             }
     
-    def upload_to_gofile(self, file_data, filename=None):
+    def upload_to_gofile(self, spool, filename=None):
         """Upload image to GoFile.io"""
-        # First, get a server
-        server_response = requests.get('https://api.gofile.io/getServer')
-        if server_response.status_code != 200:
-            return {'success': False, 'error': 'Failed to get GoFile server'}
-        
-        server = server_response.json().get('data', {}).get('server')
+        # The upload server is looked up once and reused
+        server = self._endpoint('gofile', self._discover_gofile_server)
         if not server:
             return {'success': False, 'error': 'No GoFile server available'}
         
@@ -200,11 +270,6 @@ class ImageUploader:
         if not filename:
             filename = 'image.jpg'
         
-        # Prepare the file for upload
-        files = {
-            'file': (filename, file_data, 'image/jpeg')
-        }
-        
         # Add API token if available
         data = {}
         if self.api_keys.get('gofile'):
@@ -212,7 +277,11 @@ class ImageUploader:
         
         # Upload the file
         upload_url = f'https://{server}.gofile.io/uploadFile'
-        response = requests.post(upload_url, files=files, data=data)
+        try:
+            response = post_multipart(upload_url, spool, 'file', data=data, filename=filename)
+        except requests.RequestException:
+            self._forget_endpoint('gofile')
+            raise
         
         if response.status_code == 200:
             result = response.json()
@@ -222,31 +291,30 @@ class ImageUploader:
                     'url': result.get('data', {}).get('downloadPage', '')
                 }
         
+        # The server may have gone away, look it up again next time
+        self._forget_endpoint('gofile')
         return {
             'success': False,
             'error': f'GoFile upload failed: {response.text}'
         }
     
-    def upload_to_pixhost(self, file_data, filename=None):
+    def upload_to_pixhost(self, spool, filename=None):
         """Upload image to Pixhost.to"""
         # Ensure we have a filename
         if not filename:
             filename = 'image.jpg'
         
-        # Prepare the file for upload
-        files = {
-            'img': (filename, file_data, 'image/jpeg')
-        }
-        
         data = {
             'content_type': 0,  # 0 for family-friendly content
             'max_th_size': 300  # Thumbnail size
         }
         
-        response = requests.post(
+        response = post_multipart(
             'https://api.pixhost.to/images',
-            files=files,
-            data=data
+            spool,
+            'img',
+            data=data,
+            filename=filename
         )
         
         if response.status_code == 200:
@@ -262,16 +330,13 @@ class ImageUploader:
             'error': f'Pixhost upload failed: {response.text}'
         }
     
-    def upload_to_0x0(self, file_data, filename=None):
+    def upload_to_0x0(self, spool, filename=None):
         """Upload image to 0x0.st"""
-        # Prepare the file for upload
-        files = {
-            'file': (filename or 'image.jpg', file_data, 'image/jpeg')
-        }
-        
-        response = requests.post(
+        response = post_multipart(
             'https://0x0.st',
-            files=files
+            spool,
+            'file',
+            filename=filename or 'image.jpg'
         )
         
         if response.status_code == 200 and response.text.startswith('https://'):
@@ -295,7 +360,7 @@ def upload_image(file_data, filename=None, service=None):
     Args:
         file_data: The image data (bytes or file-like object)
         filename: Optional filename
-        service: Optional service name to use (otherwise random from active services)
+        service: Optional service name to use (otherwise the healthy services, fastest first)
         
     Returns:
         dict: {
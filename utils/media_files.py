@@ -0,0 +1,196 @@
+"""
+Media Files
+Serves locally stored uploads with byte ranges, strong ETags and zero-copy transfer
+
+Local fallback uploads (the object store of utils.storage) and image
+derivatives are served from /media/<kind>/<name> rather than by the static
+handler. Files named by the SHA-256 of their content (stored objects and
+every derivative) are content-addressed: their ETag is the hash and
+browsers may cache them for a year without revalidating. Older uuid-named
+uploads get an ETag from their size and modification time and
+media.cache_max_age_seconds.
+
+A single byte range, as sent by video players when seeking, is answered
+with 206 and only the bytes asked for. Bodies that run to the end of the
+file are handed to the server's wsgi.file_wrapper, which gunicorn sends
+with sendfile(2); bounded ranges are read in blocks. Behind nginx, set
+media.x_accel_prefix to an internal location and nginx sends the file
+itself.
+"""
+import os
+import re
+import logging
+import mimetypes
+from typing import Optional
+
+from flask import Response, abort, current_app, request
+from werkzeug.http import http_date, quote_etag
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = '/media'
+
+# Media kind -> directory, relative to the static folder
+MEDIA_DIRS = {
+    'objects': 'uploads/objects',
+    'photos': 'uploads/photos',
+    'videos': 'uploads/videos',
+    'derivatives': 'uploads/derivatives'
+}
+
+# <sha256>.<ext> or <sha256>_<width>.<ext>
+CONTENT_ADDRESSED = re.compile(r'^([0-9a-f]{64}(?:_\d+)?)\.\w+$')
+
+BLOCK_SIZE = 64 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def media_url(kind: str, name: str) -> str:
+    """URL of a stored media file"""
+    return f"{MEDIA_URL_PREFIX}/{kind}/{name}"
+
+def content_name(sha256: str, mime_type: str) -> str:
+    """Content-addressed file name of an upload"""
+    return f"{sha256}{mimetypes.guess_extension(mime_type) or ''}"
+
+def media_root(kind: str, static_folder: str) -> Optional[str]:
+    """Directory of a media kind, None for unknown kinds"""
+    if kind == 'objects':
+        # The local object store may live outside the static folder (storage.local_root)
+        from utils.storage import local_store
+        if local_store.root:
+            return local_store.root
+    directory = MEDIA_DIRS.get(kind)
+    return os.path.join(static_folder, directory) if directory else None
+
+def local_path(url: Optional[str], static_folder: str) -> Optional[str]:
+    """
+    Get the file behind a local media URL
+
+    Args:
+        url: /media/... URL, or an older static URL ('uploads/...' or '/static/uploads/...')
+        static_folder: The app's static folder
+
+    Returns:
+        Optional[str]: Path of the file, or None for external or malformed URLs
+    """
+    if not url or url.startswith(('http://', 'https://')):
+        return None
+
+    if url.startswith(MEDIA_URL_PREFIX + '/'):
+        kind, _, name = url[len(MEDIA_URL_PREFIX) + 1:].partition('/')
+        root = media_root(kind, static_folder)
+        return safe_join(root, name) if root else None
+
+    path = url.lstrip('/')
+    if path.startswith('static/'):
+        path = path[len('static/'):]
+    return safe_join(static_folder, path)
+
+def _read_range(file, length: int):
+    """Yield length bytes of a file from its current position, closing it afterwards"""
+    try:
+        while length > 0:
+            block = file.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+class MediaServer:
+    """
+    Answers media requests, counting them for monitoring
+    """
+
+    def __init__(self):
+        self.max_age = get_config('media.cache_max_age_seconds', 86400)
+        self.x_accel_prefix = get_config('media.x_accel_prefix', '').rstrip('/')
+
+        # Counters for monitoring
+        self.stats = {
+            'requests': 0,
+            'range_requests': 0,
+            'not_modified': 0,
+            'zero_copy': 0,
+            'bytes_sent': 0
+        }
+
+    def send(self, kind: str, name: str) -> Response:
+        """
+        Serve a media file for the current request
+
+        Args:
+            kind: Media kind, a key of MEDIA_DIRS
+            name: File name within the kind's directory
+
+        Returns:
+            Response: 200, 206, 304 or 416 response
+        """
+        root = media_root(kind, current_app.static_folder)
+        path = safe_join(root, name) if root else None
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        self.stats['requests'] += 1
+        stat = os.stat(path)
+        size = stat.st_size
+
+        match = CONTENT_ADDRESSED.match(os.path.basename(name))
+        etag = match.group(1) if match else f"{size:x}-{stat.st_mtime_ns:x}"
+        headers = {
+            'ETag': quote_etag(etag),
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if match else f'public, max-age={self.max_age}',
+            'Last-Modified': http_date(stat.st_mtime)
+        }
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+        if request.if_none_match.contains_weak(etag):
+            self.stats['not_modified'] += 1
+            return Response(status=304, headers=headers)
+
+        if self.x_accel_prefix:
+            # nginx answers ranges and sends the file with sendfile itself
+            headers['X-Accel-Redirect'] = f"{self.x_accel_prefix}/{MEDIA_DIRS[kind]}/{name}"
+            return Response(status=200, mimetype=mimetype, headers=headers)
+
+        start, stop, status = 0, size, 200
+        byte_range = request.range
+        if_range = request.if_range
+        # A range is only valid for the version named in If-Range, otherwise the whole file is sent
+        if byte_range is not None and (if_range.etag == etag or (if_range.etag is None and if_range.date is None)):
+            bounds = byte_range.range_for_length(size)
+            if bounds is not None:
+                start, stop = bounds
+                status = 206
+                headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+                self.stats['range_requests'] += 1
+            elif byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+                return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            # Several ranges are answered with the whole file
+
+        file = open(path, 'rb')
+        file.seek(start)
+        length = stop - start
+        if stop == size:
+            # gunicorn's file wrapper sends from the current offset with sendfile(2)
+            body = wrap_file(request.environ, file, BLOCK_SIZE)
+            if 'wsgi.file_wrapper' in request.environ:
+                self.stats['zero_copy'] += 1
+        else:
+            body = _read_range(file, length)
+
+        self.stats['bytes_sent'] += length
+        response = Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        response.content_length = length
+        return response
+
+# Create a singleton instance
+media_server = MediaServer()
@@ -0,0 +1,326 @@
+"""
+Message Writer
+Group-commit write path for direct messages and chat messages
+
+A background thread persists queued messages in one transaction every few
+milliseconds (or every N messages), which turns one fsync per message into
+one fsync per batch on SQLite. The database assigns the IDs while the batch
+is inserted (INSERT ... RETURNING), so any number of processes can write to
+the same database. Callers wait for the commit before they emit a message
+and only then learn its ID.
+
+A message whose wait times out is withdrawn unless its batch is already
+being written, so a message reported as failed never shows up later. If a
+batch fails, its messages are retried one by one so a bad row only fails
+itself.
+"""
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Message kinds handled by the writer
+KIND_MESSAGE = 'message'
+KIND_CHAT_MESSAGE = 'chat_message'
+
+class PendingMessage:
+    """
+    A message that has been accepted by the writer
+
+    The row values are available immediately, the ID once wait() has
+    returned True.
+    """
+
+    def __init__(self, kind: str, values: Dict, touch: Optional[Dict] = None, writer=None):
+        self.kind = kind
+        self.values = values
+        self.touch = touch
+        self.error = None
+        self._writer = writer
+        # Taken by the writer thread into a batch, it can no longer be withdrawn
+        self.claimed = False
+        self.cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def id(self) -> Optional[int]:
+        return self.values.get('id')
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the message is durable
+
+        On timeout the message is withdrawn, unless its batch is already being
+        committed, in which case the outcome of that commit is awaited.
+
+        Args:
+            timeout: Maximum number of seconds to wait before withdrawing the message
+
+        Returns:
+            bool: True if the message was committed, False if it failed or was withdrawn
+        """
+        if not self._done.wait(timeout):
+            if self._writer is not None and self._writer.cancel(self):
+                logger.warning(f"Timed out waiting for {self.kind} to be written, withdrawn")
+                return False
+            self._done.wait()
+        return self.error is None
+
+    def _resolve(self, error: Optional[Exception] = None) -> None:
+        self.error = error
+        self._done.set()
+
+class MessageWriter:
+    """
+    Queues messages and persists them in group commits
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = get_config('messaging.group_commit_enabled', True)
+        self.flush_interval = get_config('messaging.group_commit_interval_ms', 5) / 1000.0
+        self.max_batch = get_config('messaging.group_commit_max_batch', 200)
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        # Guards claiming messages into a batch against withdrawing them
+        self._claim_lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'messages_written': 0,
+            'batches_committed': 0,
+            'batches_failed': 0
+        }
+
+    def init_app(self, app):
+        """
+        Bind the writer to the Flask app used by the background thread
+        """
+        self.app = app
+        return True
+
+    def _models(self):
+        # Import here to avoid circular imports
+        from models import Message, ChatMessage
+        return {KIND_MESSAGE: Message, KIND_CHAT_MESSAGE: ChatMessage}
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+            logger.info(f"Message writer started (interval={self.flush_interval * 1000:.0f}ms, max_batch={self.max_batch})")
+
+    def submit(self, kind: str, values: Dict, touch: Optional[Dict] = None) -> PendingMessage:
+        """
+        Accept a message for writing
+
+        Args:
+            kind: KIND_MESSAGE or KIND_CHAT_MESSAGE
+            values: Column values for the new row (without 'id')
+            touch: Related row to update in the same batch:
+                {'conversation_id': ...} sets Conversation.last_message_at,
+                {'chat_id': ..., 'user_id': ...} sets ChatMember.last_read
+
+        Returns:
+            PendingMessage: The accepted message, to wait on before emitting it
+        """
+        values = dict(values)
+        values.setdefault('created_at', datetime.utcnow())
+
+        if not self.enabled or self.app is None:
+            return self._write_now(kind, values, touch)
+
+        pending = PendingMessage(kind, values, touch, writer=self)
+
+        self._ensure_started()
+        self._queue.put(pending)
+        return pending
+
+    def _write_now(self, kind: str, values: Dict, touch: Optional[Dict]) -> PendingMessage:
+        """Write a single message synchronously (group commit disabled)"""
+        from database import db
+
+        model = self._models()[kind]
+        row = model(**values)
+        db.session.add(row)
+        db.session.flush()
+        values['id'] = row.id
+        values.update({
+            column.name: getattr(row, column.name) for column in model.__table__.columns
+        })
+
+        pending = PendingMessage(kind, values, touch)
+        try:
+            self._append_change_log([pending])
+            self._apply_touches([(kind, values, touch)])
+            db.session.commit()
+            pending._resolve()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing {kind}: {str(e)}")
+            pending._resolve(e)
+        return pending
+
+    def cancel(self, pending: PendingMessage) -> bool:
+        """
+        Withdraw a queued message
+
+        Returns:
+            bool: False if the message is already part of a batch being written
+        """
+        with self._claim_lock:
+            if pending.claimed:
+                return False
+            pending.cancelled = True
+        pending._resolve(TimeoutError(f"{pending.kind} withdrawn before it was written"))
+        return True
+
+    def _claim(self, batch: List[PendingMessage]) -> List[PendingMessage]:
+        """Take the messages that have not been withdrawn"""
+        with self._claim_lock:
+            claimed = [pending for pending in batch if not pending.cancelled]
+            for pending in claimed:
+                pending.claimed = True
+        return claimed
+
+    def _append_change_log(self, batch: List[PendingMessage]) -> None:
+        """Record new chat messages in the sync change log"""
+        from database import db
+        from models import ChatChangeLog
+        from utils.chat_sync import message_change_rows
+
+        rows = message_change_rows(pending.values for pending in batch if pending.kind == KIND_CHAT_MESSAGE)
+        if rows:
+            db.session.execute(insert(ChatChangeLog), rows)
+
+    def _apply_touches(self, items: List) -> None:
+        """Update conversation and chat member timestamps, once per row"""
+        from database import db
+        from models import Conversation, ChatMember
+
+        last_message_at = {}
+        last_read = {}
+        for kind, values, touch in items:
+            if not touch:
+                continue
+            if 'conversation_id' in touch:
+                key = touch['conversation_id']
+                last_message_at[key] = max(last_message_at.get(key, values['created_at']), values['created_at'])
+            elif 'chat_id' in touch:
+                key = (touch['chat_id'], touch['user_id'])
+                last_read[key] = max(last_read.get(key, values['created_at']), values['created_at'])
+
+        for conversation_id, timestamp in last_message_at.items():
+            db.session.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(last_message_at=timestamp)
+            )
+        for (chat_id, user_id), timestamp in last_read.items():
+            db.session.execute(
+                update(ChatMember).where(
+                    ChatMember.chat_id == chat_id,
+                    ChatMember.user_id == user_id
+                ).values(last_read=timestamp)
+            )
+
+    def _run(self) -> None:
+        """Background loop that collects and commits batches"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Collect until the interval elapses or the batch is full
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            batch = self._claim(batch)
+            if batch:
+                self._commit_batch(batch)
+
+    def _insert(self, batch: List[PendingMessage]) -> None:
+        """Add the rows of a batch and their side effects to the current transaction"""
+        from database import db
+
+        for kind, model in self._models().items():
+            items = [pending for pending in batch if pending.kind == kind]
+            if not items:
+                continue
+            # The database assigns the IDs, a retried row drops the one of its failed batch
+            rows = [{key: value for key, value in pending.values.items() if key != 'id'} for pending in items]
+            ids = db.session.execute(
+                insert(model).returning(model.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            for pending, row_id in zip(items, ids):
+                pending.values['id'] = row_id
+
+        self._append_change_log(batch)
+        self._apply_touches([(pending.kind, pending.values, pending.touch) for pending in batch])
+
+    def _commit_batch(self, batch: List[PendingMessage]) -> None:
+        from database import db
+
+        with self.app.app_context():
+            try:
+                self._insert(batch)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.stats['batches_failed'] += 1
+                logger.error(f"Error committing batch of {len(batch)} messages, writing them one by one: {str(e)}")
+                self._commit_each(batch)
+                return
+            finally:
+                db.session.remove()
+
+        self.stats['messages_written'] += len(batch)
+        self.stats['batches_committed'] += 1
+        logger.debug(f"Committed batch of {len(batch)} messages")
+
+        for pending in batch:
+            pending._resolve()
+
+    def _commit_each(self, batch: List[PendingMessage]) -> None:
+        """Commit the messages of a failed batch separately, so a bad row only fails itself"""
+        from database import db
+
+        for pending in batch:
+            try:
+                self._insert([pending])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                pending.values.pop('id', None)
+                logger.error(f"Error writing {pending.kind}: {str(e)}")
+                pending._resolve(e)
+                continue
+            self.stats['messages_written'] += 1
+            pending._resolve()
+
+# Create a singleton instance
+message_writer = MessageWriter()
+
+def init_message_writer(app):
+    """Bind the shared message writer to the app"""
+    return message_writer.init_app(app)
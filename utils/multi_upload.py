@@ -1,20 +1,21 @@
 import os
 import json
 import time
+import uuid
+import bisect
 import logging
 import threading
-import requests
-from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
+from config import get_config
+from utils.upload_spool import spool_upload, post_multipart, UploadRejected
+from utils.storage import StorageBackend, ServiceBackend, configured_backends
+from utils.service_health import service_health
+from utils.rate_limit import upload_limiter
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
-# Rate limiting configuration
-MAX_REQUESTS_PER_SECOND = 1  # 1 request per second per service
-upload_timestamps = {}
-rate_limit_lock = threading.Lock()
-
 # Image hosting services configuration
 UPLOAD_SERVICES = {
     "imgur": {
@@ -47,46 +48,12 @@ UPLOAD_SERVICES = {
     }
 }
 
-def check_rate_limit(service_name: str) -> bool:
+def upload_to_service(spool, service_name: str, service_config: Dict) -> Optional[str]:
     """
-    Check if a service has been rate limited
+    Upload a file to a specific service, the engine spaces the calls out per service (utils.rate_limit)
 
     Args:
-        service_name: Name of the service to check
-
-    Returns:
-        bool: True if requests can be made, False if rate limited
-    """
-    current_time = time.time()
-    with rate_limit_lock:
-        if service_name not in upload_timestamps:
-            upload_timestamps[service_name] = current_time
-            return True
-
-        elapsed = current_time - upload_timestamps[service_name]
-        if elapsed >= 1.0 / MAX_REQUESTS_PER_SECOND:
-            upload_timestamps[service_name] = current_time
-            return True
-
-        logger.debug(f"Rate limited for service: {service_name}, need to wait {1.0 / MAX_REQUESTS_PER_SECOND - elapsed:.2f}s")
-        return False
-
-def wait_for_rate_limit(service_name: str) -> None:
-    """
-    Wait until a service is no longer rate limited
-
-    Args:
-        service_name: Name of the service to wait for
-    """
-    while not check_rate_limit(service_name):
-        time.sleep(0.1)
-
-def upload_to_service(file, service_name: str, service_config: Dict) -> Optional[str]:
-    """
-    Upload a file to a specific service with rate limiting
-
-    Args:
-        file: File object to upload
+        spool: Spooled file to upload
         service_name: Name of the service
         service_config: Service configuration
 
@@ -98,40 +65,17 @@ def upload_to_service(file, service_name: str, service_config: Dict) -> Optional
         logger.debug(f"Service {service_name} is disabled, skipping")
         return None
 
-    # Wait for rate limit
-    wait_for_rate_limit(service_name)
-
     try:
-        # Reset file pointer
-        file.seek(0)
-
-        # Prepare upload
-        upload_url = service_config["upload_url"]
-        field_name = service_config["field_name"]
-
-        # Prepare request arguments
-        kwargs = {
-            "files": {
-                field_name: (
-                    secure_filename(file.filename),
-                    file,
-                    file.content_type if hasattr(file, 'content_type') else None
-                )
-            },
-            "timeout": 30
-        }
-
-        # Add headers if specified
-        if "headers" in service_config:
-            kwargs["headers"] = service_config["headers"]
-
-        # Add form data if specified
-        if "form_data" in service_config:
-            kwargs["data"] = service_config["form_data"]
-
-        # Make request
+        # Make request, the file is streamed from the spool
         logger.info(f"Uploading to {service_name}...")
-        response = requests.post(upload_url, **kwargs)
+        response = post_multipart(
+            service_config["upload_url"],
+            spool,
+            service_config["field_name"],
+            data=service_config.get("form_data"),
+            headers=service_config.get("headers"),
+            timeout=30
+        )
 
         # Check response
         if response.status_code not in (200, 201):
@@ -156,53 +100,371 @@ def upload_to_service(file, service_name: str, service_config: Dict) -> Optional
         logger.error(f"Error uploading to {service_name}: {str(e)}")
         return None
 
-def save_multi_uploads(file) -> List[str]:
+# Upper bounds (milliseconds) of the upload latency histogram buckets
+LATENCY_BUCKETS_MS = [100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+class UploadJob:
     """
-    Save a file to multiple hosting services for redundancy
+    Uploads of one file to every service, finished in any order
 
-    Args:
-        file: File object to upload
+    The first successful URL becomes the primary URL; the others are mirrors
+    written to FileUpload.fallback_urls once every service has answered.
 
-    Returns:
-        List[str]: List of URLs where the file was uploaded
+    A tracked job (see track) runs after its request has returned: the file
+    is served from a provisional local URL until the first external URL
+    replaces it, and the uploading user is told of every service's answer.
     """
-    urls = []
-    errors = []
 
-    # Try each service in sequence
-    for service_name, service_config in UPLOAD_SERVICES.items():
-        try:
-            url = upload_to_service(file, service_name, service_config)
+    def __init__(self, spool, services: int):
+        self.id = uuid.uuid4().hex
+        self.spool = spool
+        self.filename = spool.filename
+        self.urls = []
+        self.services = services
+        self.pending = services
+        self.upload_id = None
+        self.user_id = None
+        self.provisional_url = None
+        self._app = None
+        self._recorded = False
+        self._cond = threading.Condition()
+        self._done = threading.Event()
+
+    def wait_first(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Wait for the first successful upload
+
+        Returns:
+            Optional[str]: The first URL, or None if every service failed or timed out
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.urls or self.pending == 0, timeout)
+            return self.urls[0] if self.urls else None
+
+    def wait_all(self, timeout: Optional[float] = None) -> List[str]:
+        """Wait for every service to answer and return all URLs"""
+        self._done.wait(timeout)
+        with self._cond:
+            return list(self.urls)
+
+    def attach(self, app, upload_id: int) -> None:
+        """
+        Record the mirrors on a FileUpload row when the remaining uploads finish
+
+        Args:
+            app: Flask application used to open a context in the upload thread
+            upload_id: ID of the FileUpload row holding the primary URL
+        """
+        with self._cond:
+            self._app = app
+            self.upload_id = upload_id
+            done = self.pending == 0
+        if done:
+            self._record_mirrors()
+
+    def track(self, app, upload_id: int, provisional_url: str, user_id: Optional[int] = None) -> None:
+        """
+        Finish the job in the background for a FileUpload row that points at a local copy for now
+
+        The first external URL replaces the provisional URL on the row and
+        wherever it is used (utils.storage.replace_media_url), and the user
+        gets an upload_progress event per service and an upload_complete
+        event at the end.
+
+        Args:
+            app: Flask application used to open a context in the upload thread
+            upload_id: ID of the FileUpload row holding the provisional URL
+            provisional_url: Local URL the file is served from meanwhile
+            user_id: User to report progress to
+        """
+        with self._cond:
+            self._app = app
+            self.upload_id = upload_id
+            self.user_id = user_id
+            self.provisional_url = provisional_url
+            first = self.urls[0] if self.urls else None
+            done = self.pending == 0
+        # Answers that arrived before the job was tracked are caught up here
+        if first:
+            self._promote(first)
+        if done:
+            self._record_mirrors()
+        self._report()
+
+    def finish(self, url: Optional[str]) -> None:
+        """Register the answer of one service"""
+        with self._cond:
+            self.pending -= 1
             if url:
-                urls.append(url)
-                logger.info(f"Successfully uploaded to {service_name}: {url}")
-            else:
-                errors.append(f"{service_name}: Failed to upload")
+                self.urls.append(url)
+            self._cond.notify_all()
+            done = self.pending == 0
+            tracked = self.provisional_url is not None
+            first = url if url and len(self.urls) == 1 else None
+        if tracked and first:
+            self._promote(first)
+        if done:
+            self._record_mirrors()
+        # Reported once the row is final, upload_complete comes with every mirror recorded
+        if tracked:
+            self._report()
+        if done:
+            self.spool.release()
+            self._done.set()
+
+    def _promote(self, url: str) -> None:
+        """Replace the provisional local URL with the first external one"""
+        from database import db
+        from models import FileUpload
+        from utils.storage import replace_media_url
+
+        try:
+            with self._app.app_context():
+                upload = db.session.get(FileUpload, self.upload_id)
+                if upload is None or upload.primary_url != self.provisional_url:
+                    return
+                upload.primary_url = url
+                replaced = replace_media_url(self.provisional_url, url)
+                db.session.commit()
+                logger.info(f"Upload {self.upload_id} moved to {url} ({replaced} references updated)")
+        except Exception as e:
+            logger.error(f"Error promoting upload {self.upload_id}: {str(e)}")
+
+    def _report(self) -> None:
+        """Tell the uploading user how far the job is"""
+        if self.user_id is None:
+            return
+
+        from utils.websocket import send_to_user
+
+        with self._cond:
+            done = self.pending == 0
+            data = {
+                'job_id': self.id,
+                'upload_id': self.upload_id,
+                'provisional_url': self.provisional_url,
+                'url': self.urls[0] if self.urls else self.provisional_url,
+                'completed': self.services - self.pending,
+                'total': self.services,
+                'mirrors': max(len(self.urls) - 1, 0)
+            }
+        if done:
+            # Every external host failed: the local copy stays
+            data['stored'] = 'external' if self.urls else 'local'
+        send_to_user(self.user_id, 'upload_complete' if done else 'upload_progress', data)
+
+    def _record_mirrors(self) -> None:
+        with self._cond:
+            if self._recorded or self.upload_id is None:
+                return
+            self._recorded = True
+            mirrors = self.urls[1:]
+        if not mirrors:
+            return
+
+        from database import db
+        from models import FileUpload
+
+        try:
+            with self._app.app_context():
+                upload = FileUpload.query.get(self.upload_id)
+                if upload is None:
+                    return
+                known = upload.get_all_urls()
+                upload.fallback_urls = json.dumps(known[1:] + [url for url in mirrors if url not in known])
+                db.session.commit()
+                logger.info(f"Recorded {len(mirrors)} mirror(s) for upload {self.upload_id}")
+        except Exception as e:
+            logger.error(f"Error recording mirrors for upload {self.upload_id}: {str(e)}")
+
+class UploadEngine:
+    """
+    Uploads files to every service concurrently on a bounded thread pool
+    """
+
+    def __init__(self, max_workers: int, services: Dict = None, upload_func=None, backends: List = None,
+                 limiter=None):
+        self.max_workers = max_workers
+        self.services = UPLOAD_SERVICES if services is None else services
+        self.upload_func = upload_func or upload_to_service
+        # Other external storage backends, e.g. ImageUploader hosts
+        self.backends = configured_backends() if backends is None else backends
+        # Per-service token buckets
+        self.limiter = upload_limiter if limiter is None else limiter
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # service -> latency histogram and counters
+        self.latency = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='upload')
+            return self._executor
+
+    def submit(self, spool) -> UploadJob:
+        """
+        Start uploading a file to every enabled service
+
+        Args:
+            spool: Spooled file to upload, the job keeps its own reference
+
+        Returns:
+            UploadJob: Job to wait on for the first URL
+        """
+        backends = self.get_backends(spool)
+        job = UploadJob(spool.retain(), len(backends))
+        if not backends:
+            spool.release()
+            job._done.set()
+            return job
+
+        # Every backend streams the same spool file through its own handle. A throttled
+        # service's upload is queued when its token comes up, no worker waits for it.
+        # A service whose next slot is too far away is skipped for this job
+        executor = self._get_executor()
+        for backend in backends:
+            if not self.limiter.schedule(backend.name, executor.submit, self._upload, job, backend):
+                job.finish(None)
+        return job
+
+    def get_backends(self, spool) -> List[StorageBackend]:
+        """
+        External backends a file is sent to: the enabled services and the backends taking its type
+
+        Services whose circuit breaker is open are left out and the others
+        start fastest first (utils.service_health).
+        """
+        backends = [
+            ServiceBackend(name, config, self.upload_func)
+            for name, config in self.services.items() if config.get("enabled", False)
+        ]
+        backends += [backend for backend in self.backends if backend.accepts(spool)]
+
+        order = {name: i for i, name in enumerate(service_health.rank(dict.fromkeys(b.name for b in backends)))}
+        return sorted((backend for backend in backends if backend.name in order), key=lambda backend: order[backend.name])
+
+    def _upload(self, job: UploadJob, backend: StorageBackend) -> None:
+        start = time.perf_counter()
+        url = None
+        try:
+            url = backend.put(job.spool)
         except Exception as e:
-            logger.error(f"Error with {service_name}: {str(e)}")
-            errors.append(f"{service_name}: {str(e)}")
+            logger.error(f"Error with {backend.name}: {str(e)}")
+        finally:
+            self._observe(backend.name, time.perf_counter() - start, bool(url))
+            job.finish(url)
+
+    def _observe(self, service_name: str, seconds: float, success: bool) -> None:
+        millis = seconds * 1000
+        with self._lock:
+            stats = self.latency.setdefault(service_name, {
+                'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                'count': 0,
+                'failures': 0,
+                'total_ms': 0.0
+            })
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, millis)] += 1
+            stats['count'] += 1
+            stats['total_ms'] += millis
+            if not success:
+                stats['failures'] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Get per-service upload latency histograms
+
+        Returns:
+            Dict: service -> count, failures, average and bucket counts keyed by upper bound
+        """
+        labels = [f'le_{bound}ms' for bound in LATENCY_BUCKETS_MS] + ['inf']
+        with self._lock:
+            return {
+                service: {
+                    'count': stats['count'],
+                    'failures': stats['failures'],
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 1) if stats['count'] else 0.0,
+                    'histogram': dict(zip(labels, stats['buckets']))
+                }
+                for service, stats in self.latency.items()
+            }
+
+# Create a singleton instance
+upload_engine = UploadEngine(get_config('upload.max_parallel_uploads', 8))
+
+def save_multi_uploads(file) -> List[str]:
+    """
+    Save a file to multiple hosting services for redundancy
+
+    All services are tried concurrently and the call returns with the first
+    successful URL. The other services finish in the background and their
+    URLs are recorded as mirrors on the file's FileUpload row, so they are
+    returned too once the same content is saved again.
 
-    if not urls and errors:
-        logger.error(f"All uploads failed: {', '.join(errors)}")
+    Args:
+        file: File object to upload
 
-    return urls
+    Returns:
+        List[str]: URLs of the file known so far, the best one first
+    """
+    try:
+        spool = spool_upload(file)
+    except UploadRejected as e:
+        logger.warning(f"Upload rejected: {str(e)}")
+        return []
+
+    from utils.upload import find_duplicate_upload
+
+    with spool:
+        # Same content as an earlier upload, reuse its URLs
+        existing = find_duplicate_upload(spool.sha256)
+        if existing is not None:
+            best = existing.get_best_url()
+            return [best] + [url for url in existing.get_all_urls() if url != best]
+        job = upload_engine.submit(spool)
+    url = job.wait_first(get_config('upload.first_success_timeout_seconds', 30))
+    if not url:
+        logger.error(f"All uploads failed for {job.filename}")
+        return []
+
+    from flask import current_app
+    from database import db
+    from models import FileUpload
+
+    upload = FileUpload(
+        original_filename=spool.filename,
+        primary_url=url,
+        media_type='video' if spool.mime_type.startswith('video/') else 'image',
+        content_hash=spool.sha256
+    )
+    db.session.add(upload)
+    db.session.commit()
+    job.attach(current_app._get_current_object(), upload.id)
+    return [url]
 
 def get_first_working_url(urls: List[str]) -> Optional[str]:
     """
     Check a list of URLs and return the first one that is accessible
 
+    URLs with a cached health are not probed again; the others are checked
+    with a blocking HEAD request, so this must not be used on the render path
+    (see utils.url_health).
+
     Args:
         urls: List of URLs to check
 
     Returns:
         Optional[str]: The first working URL, or None if none work
     """
-    for url in urls:
-        try:
-            response = requests.head(url, timeout=5)
-            if response.status_code < 400:
-                return url
-        except Exception:
-            continue
+    from utils.url_health import url_prober
 
-    return None if not urls else urls[0]  # Fall back to first URL if all checks fail
\ No newline at end of file
+    for url in urls:
+        healthy = url_prober.cache.get(url)
+        if healthy is None:
+            healthy = url_prober.probe(url)
+            url_prober.cache.set(url, healthy)
+        if healthy:
+            return url
+
+    return None if not urls else urls[0]  # Fall back to first URL if all checks fail
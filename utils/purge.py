@@ -0,0 +1,258 @@
+"""
+Purge Worker
+Background removal of the children of deleted posts and chats in bounded batches
+
+Deleting a post or chat removes the parent row in the request and records a
+PurgeJob in the same transaction. The worker then deletes comments, likes,
+messages and receipts a batch at a time, committing after each batch so a
+100k-row teardown never holds a long write lock or loads rows into memory.
+Orphaned children are unreachable once the parent is gone (SQLite does not
+enforce the foreign keys), so readers never see a half-purged target. The
+worker also runs the garbage collector of the local object store
+(utils.storage) once per maintenance.storage_gc_interval_seconds and removes
+chunked uploads (utils.chunked_upload) that were never completed.
+"""
+import time
+import logging
+import threading
+from typing import Callable, List, Tuple
+
+from sqlalchemy import delete, select
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Purge job kinds
+PURGE_POST = 'post'
+PURGE_CHAT = 'chat'
+
+def _purge_steps(kind: str) -> List[Tuple[object, Callable]]:
+    """
+    Get the ordered (model, condition factory) steps that remove a target's children
+
+    Grandchildren come first so nothing references a row once it is deleted.
+    """
+    # Import here to avoid circular imports
+    from models import (
+        Comment, CommentLike, PostLike, PostMedia,
+        ChatMember, ChatMessage, MessageReadReceipt, ChatChangeLog
+    )
+
+    if kind == PURGE_POST:
+        return [
+            (CommentLike, lambda target_id: CommentLike.comment_id.in_(
+                select(Comment.id).where(Comment.post_id == target_id)
+            )),
+            (Comment, lambda target_id: Comment.post_id == target_id),
+            (PostLike, lambda target_id: PostLike.post_id == target_id),
+            (PostMedia, lambda target_id: PostMedia.post_id == target_id)
+        ]
+
+    if kind == PURGE_CHAT:
+        return [
+            (MessageReadReceipt, lambda target_id: MessageReadReceipt.message_id.in_(
+                select(ChatMessage.id).where(ChatMessage.chat_id == target_id)
+            )),
+            (ChatMessage, lambda target_id: ChatMessage.chat_id == target_id),
+            (ChatMember, lambda target_id: ChatMember.chat_id == target_id),
+            (ChatChangeLog, lambda target_id: ChatChangeLog.chat_id == target_id)
+        ]
+
+    raise ValueError(f"Unknown purge kind: {kind}")
+
+def schedule_purge(kind: str, target_id: int) -> None:
+    """
+    Record that a target's children must be purged
+
+    The job is added to the current session; the caller commits it together
+    with the parent delete and then calls purge_worker.wake().
+    """
+    from database import db
+    from models import PurgeJob
+
+    _purge_steps(kind)  # Validate the kind before anything is committed
+    db.session.add(PurgeJob(kind=kind, target_id=target_id))
+
+class PurgeWorker:
+    """
+    Runs pending purge jobs on a background thread
+    """
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = get_config('maintenance.purge_batch_size', 1000)
+        self.batch_pause = get_config('maintenance.purge_batch_pause_ms', 10) / 1000.0
+        self.poll_interval = get_config('maintenance.purge_poll_interval_seconds', 60)
+        self.change_log_retention_days = get_config('messaging.sync_log_retention_days', 30)
+        self.storage_gc_interval = get_config('maintenance.storage_gc_interval_seconds', 86400)
+        self._last_storage_gc = None
+
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'jobs_completed': 0,
+            'jobs_failed': 0,
+            'rows_deleted': 0,
+            'batches': 0
+        }
+
+    def init_app(self, app):
+        """
+        Bind the worker to the Flask app used by the background thread
+        """
+        self.app = app
+        return True
+
+    def wake(self) -> None:
+        """Start the worker if needed and have it check for jobs now"""
+        if self.app is None:
+            return
+        self._ensure_started()
+        self._wake.set()
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='purge-worker', daemon=True)
+            self._thread.start()
+            logger.info(f"Purge worker started (batch_size={self.batch_size})")
+
+    def _run(self) -> None:
+        """Background loop that drains pending jobs"""
+        while True:
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+                    self.prune()
+                    self.expire_upload_sessions()
+                    self.collect_storage_garbage()
+            except Exception as e:
+                logger.error(f"Error running purge jobs: {str(e)}")
+            self._wake.wait(self.poll_interval)
+
+    def run_pending(self) -> int:
+        """
+        Run every pending job (inside an app context)
+
+        Returns:
+            int: Number of jobs completed
+        """
+        from database import db
+        from models import PurgeJob
+
+        completed = 0
+        try:
+            while True:
+                job = PurgeJob.query.order_by(PurgeJob.id).first()
+                if job is None:
+                    break
+
+                try:
+                    deleted = self.purge(job.kind, job.target_id)
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['jobs_failed'] += 1
+                    logger.error(f"Error purging {job.kind} {job.target_id}: {str(e)}")
+                    break
+
+                db.session.delete(job)
+                db.session.commit()
+                completed += 1
+                self.stats['jobs_completed'] += 1
+                logger.info(f"Purged {deleted} rows for deleted {job.kind} {job.target_id}")
+        finally:
+            db.session.remove()
+
+        return completed
+
+    def prune(self) -> int:
+        """
+        Trim entries past their retention from append-only logs
+
+        Returns:
+            int: Number of entries deleted
+        """
+        from database import db
+        from utils.chat_sync import prune_change_log
+
+        try:
+            return prune_change_log(self.change_log_retention_days, self.batch_size)
+        finally:
+            db.session.remove()
+
+    def expire_upload_sessions(self) -> int:
+        """
+        Remove chunked uploads past their expiry with the bytes they received
+
+        Returns:
+            int: Number of sessions removed
+        """
+        from database import db
+        from utils.chunked_upload import chunked_uploads
+
+        try:
+            return chunked_uploads.expire()
+        finally:
+            db.session.remove()
+
+    def collect_storage_garbage(self) -> int:
+        """
+        Remove unreferenced files from the local object store, at most once per interval
+
+        Returns:
+            int: Number of files removed
+        """
+        if self._last_storage_gc is not None and time.monotonic() - self._last_storage_gc < self.storage_gc_interval:
+            return 0
+        self._last_storage_gc = time.monotonic()
+
+        from utils.storage import collect_garbage
+        return collect_garbage(self.app)
+
+    def purge(self, kind: str, target_id: int) -> int:
+        """
+        Delete all children of a target, one committed batch at a time
+
+        Returns:
+            int: Number of rows deleted
+        """
+        from database import db
+
+        total = 0
+        for model, condition in _purge_steps(kind):
+            while True:
+                batch = select(model.id).where(condition(target_id)).limit(self.batch_size)
+                result = db.session.execute(
+                    delete(model).where(model.id.in_(batch)).execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+
+                self.stats['batches'] += 1
+                self.stats['rows_deleted'] += result.rowcount
+                total += result.rowcount
+
+                if result.rowcount < self.batch_size:
+                    break
+
+                # Let other writers take the lock between batches
+                if self.batch_pause:
+                    time.sleep(self.batch_pause)
+
+        return total
+
+# Create a singleton instance
+purge_worker = PurgeWorker()
+
+def init_purge_worker(app):
+    """Bind the shared purge worker to the app"""
+    return purge_worker.init_app(app)
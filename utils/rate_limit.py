@@ -0,0 +1,211 @@
+"""
+Rate Limiting
+Per-service token buckets spacing out the requests sent to the upload services
+
+Each service gets a bucket refilled with one token every
+upload.rate_limit_seconds and holding at most upload.rate_limit_burst
+tokens. A request takes a token by reservation: when the bucket is empty the
+token is borrowed against the next refill and the caller is told how long
+to wait. Reservations are handed out in call order, so callers are served
+first come, first served. A reservation is never made further ahead than
+upload.first_success_timeout_seconds, the longest anyone waits for an
+upload: past that the request is skipped, the token is not taken, and the
+skip is counted in the wait stats.
+
+Nobody sleeps in a loop. The upload engine hands delayed uploads to a single
+scheduler thread, which submits them to the worker pool when their time
+comes. Worker threads are therefore never held while a service is
+throttled. Other callers sleep once with wait(), or await wait_async() in
+asyncio code.
+"""
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from typing import Dict, Optional
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    A token bucket handing out reservations
+    """
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def reserve(self, now: float, max_delay: Optional[float] = None) -> Optional[float]:
+        """
+        Take a token
+
+        Args:
+            now: Current time
+            max_delay: Longest acceptable wait, None for no limit
+
+        Returns:
+            Optional[float]: Seconds to wait before using it, 0 if one was available,
+            None if it would come later than max_delay (no token is taken then)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        delay = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if max_delay is not None and delay > max_delay:
+            return None
+        self.tokens -= 1
+        return delay
+
+class _Scheduler:
+    """
+    Runs callbacks after a delay, all from one thread
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay: float, func, *args) -> None:
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._order), func, args))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='rate-limit', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                _, _, func, args = heapq.heappop(self._queue)
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Error running rate limited call: {str(e)}")
+
+class RateLimiter:
+    """
+    Token buckets of the upload services, with the time callers spend waiting
+    """
+
+    def __init__(self, interval: float = None, burst: int = None, max_delay: float = None):
+        self.interval = get_config('upload.rate_limit_seconds', 1) if interval is None else interval
+        self.burst = get_config('upload.rate_limit_burst', 1) if burst is None else burst
+        # Requests that would wait longer are skipped rather than queued
+        self.max_delay = get_config('upload.first_success_timeout_seconds', 30) if max_delay is None else max_delay
+        self.clock = time.monotonic
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._scheduler = _Scheduler()
+
+        # service -> wait counters
+        self.waits = {}
+
+    def reset(self) -> None:
+        """Refill every bucket and clear the counters"""
+        with self._lock:
+            self._buckets = {}
+            self.waits = {}
+
+    def reserve(self, service: str) -> Optional[float]:
+        """
+        Reserve the next request to a service
+
+        Args:
+            service: Service name
+
+        Returns:
+            Optional[float]: Seconds until the request may be sent, None if it
+            would wait longer than max_delay and should be skipped
+        """
+        with self._lock:
+            if self.interval > 0:
+                bucket = self._buckets.get(service)
+                if bucket is None:
+                    bucket = self._buckets[service] = TokenBucket(1.0 / self.interval, self.burst, self.clock())
+                delay = bucket.reserve(self.clock(), self.max_delay)
+            else:
+                delay = 0.0
+
+            waits = self.waits.setdefault(service, {
+                'requests': 0, 'delayed': 0, 'skipped': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0
+            })
+            waits['requests'] += 1
+            if delay is None:
+                waits['skipped'] += 1
+            elif delay > 0:
+                waits['delayed'] += 1
+                waits['wait_seconds'] += delay
+                waits['max_wait_seconds'] = max(waits['max_wait_seconds'], delay)
+
+        if delay is None:
+            logger.info(f"Rate limited for service: {service}, skipped (next slot more than {self.max_delay}s away)")
+        elif delay > 0:
+            logger.debug(f"Rate limited for service: {service}, sending in {delay:.2f}s")
+        return delay
+
+    def schedule(self, service: str, func, *args) -> bool:
+        """
+        Call a function when a request to the service may be sent, at once or from the scheduler thread
+
+        Args:
+            service: Service name
+            func: Function sending the request, it must not block for long
+
+        Returns:
+            bool: False if the request was skipped and func will not be called
+        """
+        delay = self.reserve(service)
+        if delay is None:
+            return False
+        if delay > 0:
+            self._scheduler.call_later(delay, func, *args)
+        else:
+            func(*args)
+        return True
+
+    def wait(self, service: str) -> bool:
+        """Block the calling thread until a request to the service may be sent, False if skipped"""
+        delay = self.reserve(service)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def wait_async(self, service: str) -> bool:
+        """Wait in an event loop until a request to the service may be sent, False if skipped"""
+        delay = self.reserve(service)
+        if delay is None:
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return True
+
+    def get_stats(self) -> Dict:
+        """Per-service request count, delayed and skipped requests and time spent waiting"""
+        with self._lock:
+            return {
+                service: {
+                    'requests': waits['requests'],
+                    'delayed': waits['delayed'],
+                    'skipped': waits['skipped'],
+                    'total_wait_ms': round(waits['wait_seconds'] * 1000, 1),
+                    'average_wait_ms': round(waits['wait_seconds'] * 1000 / waits['requests'], 1),
+                    'max_wait_ms': round(waits['max_wait_seconds'] * 1000, 1)
+                }
+                for service, waits in self.waits.items()
+            }
+
+# Create a singleton instance
+upload_limiter = RateLimiter()
@@ -0,0 +1,157 @@
+"""
+Service Health
+Rolling success rate and latency of the external upload services, with circuit breakers
+
+Every upload attempt is recorded against its service: the last
+upload.health_window outcomes give a success rate and the median latency of
+the successful ones. After upload.breaker_failure_threshold failures in a
+row a service's breaker opens and it is skipped for
+upload.breaker_cooldown_seconds, so a dead host stops costing its full
+timeout on every upload. Once the cool-down is over the breaker is half
+open: uploads go to the service again, the first success closes the
+breaker and a failure opens it for another cool-down.
+
+Services that can be used are ranked by expected latency, the median
+latency divided by the success rate. Services without any outcome yet come
+first so they get measured.
+"""
+import time
+import logging
+import threading
+import statistics
+from collections import deque
+from typing import Dict, Iterable, List
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class _Service:
+    """Outcomes and breaker state of one service"""
+
+    def __init__(self, window: int):
+        self.outcomes = deque(maxlen=window)  # (success, seconds)
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+class ServiceHealth:
+    """
+    Tracks the upload services and decides which ones to use
+    """
+
+    def __init__(self):
+        self.window = get_config('upload.health_window', 50)
+        self.failure_threshold = get_config('upload.breaker_failure_threshold', 3)
+        self.cooldown = get_config('upload.breaker_cooldown_seconds', 60)
+        self.clock = time.monotonic
+
+        self._services = {}
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'breakers_opened': 0,
+            'skipped': 0
+        }
+
+    def reset(self) -> None:
+        """Forget every outcome and close every breaker"""
+        with self._lock:
+            self._services = {}
+
+    def _get(self, service: str) -> _Service:
+        if service not in self._services:
+            self._services[service] = _Service(self.window)
+        return self._services[service]
+
+    def _state(self, entry: _Service) -> str:
+        if entry.opened_at is None:
+            return CLOSED
+        if self.clock() - entry.opened_at < self.cooldown:
+            return OPEN
+        return HALF_OPEN
+
+    def record(self, service: str, seconds: float, success: bool) -> None:
+        """
+        Record the outcome of an upload attempt
+
+        Args:
+            service: Service name
+            seconds: How long the attempt took
+            success: Whether it returned a URL
+        """
+        with self._lock:
+            entry = self._get(service)
+            entry.outcomes.append((success, seconds))
+            if success:
+                entry.consecutive_failures = 0
+                if entry.opened_at is not None:
+                    logger.info(f"Upload service {service} recovered, breaker closed")
+                entry.opened_at = None
+                return
+
+            entry.consecutive_failures += 1
+            state = self._state(entry)
+            if state == HALF_OPEN or (state == CLOSED and entry.consecutive_failures >= self.failure_threshold):
+                entry.opened_at = self.clock()
+                self.stats['breakers_opened'] += 1
+                logger.warning(f"Upload service {service} failed {entry.consecutive_failures} times in a row, "
+                               f"skipping it for {self.cooldown}s")
+
+    def allow(self, service: str) -> bool:
+        """Whether uploads may go to a service, False while its breaker is open"""
+        with self._lock:
+            allowed = self._state(self._get(service)) != OPEN
+            if not allowed:
+                self.stats['skipped'] += 1
+            return allowed
+
+    def _expected_latency(self, entry: _Service) -> float:
+        if not entry.outcomes:
+            return 0.0
+        latencies = [seconds for success, seconds in entry.outcomes if success]
+        if not latencies:
+            return float('inf')
+        return statistics.median(latencies) * len(entry.outcomes) / len(latencies)
+
+    def rank(self, services: Iterable[str]) -> List[str]:
+        """
+        Order the usable services by expected latency, leaving out those with an open breaker
+
+        Args:
+            services: Candidate service names, ties keep this order
+
+        Returns:
+            List[str]: The services to try, best first
+        """
+        services = [service for service in services if self.allow(service)]
+        with self._lock:
+            scores = {service: self._expected_latency(self._get(service)) for service in services}
+        return sorted(services, key=lambda service: scores[service])
+
+    def snapshot(self) -> Dict:
+        """Per-service state, success rate and latency for monitoring"""
+        with self._lock:
+            result = {}
+            for service, entry in self._services.items():
+                latencies = [seconds for success, seconds in entry.outcomes if success]
+                state = self._state(entry)
+                result[service] = {
+                    'state': state,
+                    'samples': len(entry.outcomes),
+                    'success_rate': round(len(latencies) / len(entry.outcomes), 3) if entry.outcomes else None,
+                    'median_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+                    'consecutive_failures': entry.consecutive_failures,
+                    'retry_in_seconds': round(self.cooldown - (self.clock() - entry.opened_at), 1)
+                    if state == OPEN else None
+                }
+            return result
+
+# Create a singleton instance
+service_health = ServiceHealth()
@@ -0,0 +1,152 @@
+"""
+Socket.IO Message Bus
+Cross-process fan-out of Socket.IO emits through a shared SQLite file
+
+With several gunicorn workers each process only knows its own sockets, so an
+emit to a user or conversation room misses clients connected to the other
+workers. SQLiteManager is a python-socketio PubSubManager (the same hook the
+Redis and Kombu message queues use) that appends every emit, room change and
+disconnect to a table in a local SQLite file. Each worker polls the table
+from a background thread and applies the messages published by the others.
+
+No broker process is needed, which suits running several workers on one box;
+for several hosts use a Redis message_queue instead.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Iterator, Optional
+
+from socketio import PubSubManager
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS socketio_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+"""
+
+class SQLiteManager(PubSubManager):
+    """
+    Socket.IO client manager that shares emits between processes via SQLite
+
+    Args:
+        path: SQLite file shared by all workers
+        channel: Channel name, workers only see messages of their channel
+        poll_interval: Seconds between polls for new messages
+        retention: Seconds a message is kept before it is pruned
+        write_only: Only publish (for processes without sockets)
+    """
+    name = 'sqlite'
+
+    def __init__(self, path: str, channel: str = 'socketio', poll_interval: float = 0.02,
+                 retention: float = 60, write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def _publish(self, data) -> None:
+        """Append a message for the other workers"""
+        try:
+            self._connection().execute(
+                'INSERT INTO socketio_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                (self.channel, self.json.dumps(data), time.time())
+            )
+        except sqlite3.Error as e:
+            self._get_logger().error(f"Cannot publish to socket bus: {str(e)}")
+
+    def _listen(self) -> Iterator[str]:
+        """Yield messages published after this worker started listening"""
+        connection = self._connection()
+        last_id = connection.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_messages').fetchone()[0]
+        next_prune = time.time() + self.retention / 2
+
+        while True:
+            try:
+                rows = connection.execute(
+                    'SELECT id, payload FROM socketio_messages WHERE id > ? AND channel = ? ORDER BY id',
+                    (last_id, self.channel)
+                ).fetchall()
+            except sqlite3.Error as e:
+                self._get_logger().error(f"Cannot read from socket bus: {str(e)}")
+                rows = []
+
+            for message_id, payload in rows:
+                last_id = message_id
+                yield payload
+
+            if time.time() >= next_prune:
+                self.prune()
+                next_prune = time.time() + self.retention / 2
+
+            if not rows:
+                time.sleep(self.poll_interval)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Delete messages older than the retention period
+
+        Returns:
+            int: Number of messages deleted
+        """
+        cutoff = (now if now is not None else time.time()) - self.retention
+        try:
+            cursor = self._connection().execute('DELETE FROM socketio_messages WHERE created_at < ?', (cutoff,))
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            self._get_logger().error(f"Cannot prune socket bus: {str(e)}")
+            return 0
+
+def create_client_manager():
+    """
+    Get the cross-process client manager configured for the app
+
+    Returns:
+        Optional[SQLiteManager]: None when realtime.message_bus is disabled
+    """
+    if get_config('realtime.message_bus', '') != 'sqlite':
+        return None
+
+    path = get_config('realtime.bus_path', 'instance/socketio_bus.db')
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+
+    logger.info(f"Using SQLite socket bus at {path}")
+    return SQLiteManager(
+        path,
+        poll_interval=get_config('realtime.bus_poll_interval_ms', 20) / 1000.0,
+        retention=get_config('realtime.bus_retention_seconds', 60)
+    )
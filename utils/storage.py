@@ -0,0 +1,335 @@
+"""
+Storage Backends
+Places an upload can be stored: a sharded local object store and external hosts
+
+Every backend takes a spooled upload and returns the URL the file is served
+from. The upload engine (utils.multi_upload) sends a file to every external
+backend at once and the local store keeps it when they all fail.
+
+The local store is content-addressed: a file is named by the SHA-256 of its
+bytes and kept under two levels of shard directories named by the hash's
+leading hex digits (ab/cd/abcd...jpg), so a directory holds a few thousand
+entries at most and storing the same bytes twice writes nothing. Files are
+written under a temporary name in their shard and renamed into place, so a
+reader never sees a partial file. Objects that no post, story, message or
+profile refers to any more are removed by the garbage collector, which the
+purge worker runs every maintenance.storage_gc_interval_seconds.
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import update
+
+from config import get_config
+from utils.service_health import service_health
+from utils.media_files import MEDIA_DIRS, content_name, media_url, local_path
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Prefix of the files being written, never served or referenced
+TMP_PREFIX = '.tmp-'
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class StorageBackend:
+    """
+    A destination for uploaded files
+    """
+    name = None
+
+    def accepts(self, spool) -> bool:
+        """Whether this backend takes files of the spool's type"""
+        return True
+
+    def put(self, spool) -> Optional[str]:
+        """
+        Store a spooled file
+
+        Returns:
+            Optional[str]: URL of the stored file, None if an external host refused it
+        """
+        raise NotImplementedError
+
+class ServiceBackend(StorageBackend):
+    """
+    A multipart upload service configured in utils.multi_upload.UPLOAD_SERVICES
+    """
+
+    def __init__(self, name: str, config: Dict, upload_func):
+        self.name = name
+        self.config = config
+        self.upload_func = upload_func
+
+    def put(self, spool) -> Optional[str]:
+        start = time.perf_counter()
+        url = None
+        try:
+            url = self.upload_func(spool, self.name, self.config)
+            return url
+        finally:
+            service_health.record(self.name, time.perf_counter() - start, bool(url))
+
+class ImageUploaderBackend(StorageBackend):
+    """
+    An image host of utils.image_upload.ImageUploader
+    """
+
+    def __init__(self, service: str, uploader=None):
+        self.name = service
+        self._uploader = uploader
+
+    @property
+    def uploader(self):
+        if self._uploader is None:
+            from utils.image_upload import uploader
+            self._uploader = uploader
+        return self._uploader
+
+    def accepts(self, spool) -> bool:
+        return spool.mime_type.startswith('image/') and self.name in self.uploader.active_services
+
+    def put(self, spool) -> Optional[str]:
+        result = self.uploader.upload(spool, spool.filename, self.name)
+        if not result.get('success'):
+            logger.warning(f"Upload to {self.name} failed: {result.get('error')}")
+            return None
+        return result['url']
+
+def configured_backends() -> List[StorageBackend]:
+    """External backends added by storage.external_backends (ImageUploader service names)"""
+    return [ImageUploaderBackend(service) for service in get_config('storage.external_backends', [])]
+
+class LocalObjectStore(StorageBackend):
+    """
+    Content-addressed files on local disk, sharded by hash prefix
+    """
+    name = 'local'
+
+    def __init__(self, root: Optional[str] = None, depth: int = 2):
+        self.root = root
+        self.depth = depth
+        self.grace_seconds = get_config('storage.gc_grace_seconds', 86400)
+
+        # Counters for monitoring
+        self.stats = {
+            'stored': 0,
+            'deduplicated': 0,
+            'gc_runs': 0,
+            'collected': 0,
+            'bytes_collected': 0
+        }
+
+    def init_app(self, app):
+        """
+        Resolve the store's root, the objects folder under static unless storage.local_root is set
+        """
+        self.root = get_config('storage.local_root', '') or os.path.join(app.static_folder, MEDIA_DIRS['objects'])
+        self.depth = get_config('storage.shard_depth', 2)
+        os.makedirs(self.root, exist_ok=True)
+        return True
+
+    def object_name(self, sha256: str, mime_type: str) -> str:
+        """Sharded name of an object, relative to the root"""
+        shards = [sha256[2 * level:2 * level + 2] for level in range(self.depth)]
+        return '/'.join(shards + [content_name(sha256, mime_type)])
+
+    def url(self, name: str) -> str:
+        return media_url('objects', name)
+
+    def name_of(self, url: Optional[str]) -> Optional[str]:
+        """Object name of a URL, or None if the URL is not in this store"""
+        prefix = media_url('objects', '')
+        if not url or not url.startswith(prefix):
+            return None
+        return url[len(prefix):]
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split('/'))
+
+    def put(self, spool) -> str:
+        return self.store_file(spool.path, spool.sha256, spool.mime_type)
+
+    def store_file(self, source_path: str, sha256: str, mime_type: str) -> str:
+        """
+        Copy a file into the store unless the same content is there already
+
+        Args:
+            source_path: File to copy
+            sha256: Hex SHA-256 of the file
+            mime_type: Media type, gives the file extension
+
+        Returns:
+            str: URL of the object
+        """
+        name = self.object_name(sha256, mime_type)
+        path = self.path(name)
+        if self.touch(name):
+            self.stats['deduplicated'] += 1
+            return self.url(name)
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=TMP_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out, open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, out, COPY_BUFFER_SIZE)
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self.stats['stored'] += 1
+        logger.debug(f"Stored object {name}")
+        return self.url(name)
+
+    def touch(self, name: str) -> bool:
+        """
+        Mark an object as just used, so the garbage collector leaves it alone for a grace period
+
+        Returns:
+            bool: False if the object does not exist
+        """
+        try:
+            os.utime(self.path(name))
+            return True
+        except OSError:
+            return False
+
+    def iter_objects(self) -> Iterator[Tuple[str, str, os.stat_result]]:
+        """Yield (name, path, stat) of every file in the store, temporary ones included"""
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), path, stat
+
+    def collect_garbage(self, referenced: Set[str], now: Optional[float] = None) -> List[str]:
+        """
+        Remove objects that are not referenced and were not written or used within the grace period
+
+        Args:
+            referenced: Object names still in use
+            now: Current time, for tests
+
+        Returns:
+            List[str]: Names of the removed objects (abandoned temporary files excluded)
+        """
+        now = time.time() if now is None else now
+        collected = []
+        for name, path, stat in self.iter_objects():
+            if name in referenced or now - stat.st_mtime < self.grace_seconds:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            if os.path.basename(name).startswith(TMP_PREFIX):
+                continue
+            collected.append(name)
+            self.stats['collected'] += 1
+            self.stats['bytes_collected'] += stat.st_size
+
+        # Drop emptied shard directories, deepest first
+        for directory, _, _ in sorted(os.walk(self.root), key=lambda entry: -len(entry[0])):
+            if directory != self.root:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+        self.stats['gc_runs'] += 1
+        return collected
+
+# Create a singleton instance
+local_store = LocalObjectStore()
+
+def _media_url_columns() -> list:
+    """Columns holding the URL of an upload"""
+    from models import PostMedia, Story, ChatMessage, User
+    return [PostMedia.media_url, Story.media_url, ChatMessage.media_url, User.profile_pic, User.cover_pic]
+
+def referenced_objects() -> Set[str]:
+    """
+    Names of the local objects used by posts, stories, chat messages and profiles (inside an app context)
+    """
+    from database import db
+
+    prefix = media_url('objects', '')
+    names = set()
+    for column in _media_url_columns():
+        for (url,) in db.session.query(column).filter(column.like(f'{prefix}%')):
+            names.add(local_store.name_of(url))
+    return names
+
+def replace_media_url(old_url: str, new_url: str) -> int:
+    """
+    Point every post, story, chat message and profile using a URL at another one
+
+    The change is added to the current session, the caller commits it. A
+    local object replaced this way is left to the garbage collector.
+
+    Returns:
+        int: Number of rows changed
+    """
+    from database import db
+
+    changed = 0
+    for column in _media_url_columns():
+        result = db.session.execute(
+            update(column.class_).where(column == old_url).values({column.key: new_url})
+            .execution_options(synchronize_session=False)
+        )
+        changed += result.rowcount
+    return changed
+
+def collect_garbage(app) -> int:
+    """
+    Remove unreferenced objects of the local store with their FileUpload rows and image derivatives
+
+    Args:
+        app: Flask application, its static folder holds the derivatives
+
+    Returns:
+        int: Number of objects removed
+    """
+    from database import db
+    from models import FileUpload
+    from utils.image_derivatives import _parse_derivatives
+
+    try:
+        collected = local_store.collect_garbage(referenced_objects())
+        for name in collected:
+            # Forget the upload so it is not offered for deduplication any more
+            for upload in FileUpload.query.filter_by(primary_url=local_store.url(name)).all():
+                if FileUpload.query.filter(FileUpload.content_hash == upload.content_hash,
+                                           FileUpload.id != upload.id).count() == 0:
+                    for url in _parse_derivatives(upload.derivatives).values():
+                        path = local_path(url, app.static_folder)
+                        if path and os.path.exists(path):
+                            os.remove(path)
+                db.session.delete(upload)
+            db.session.commit()
+    finally:
+        db.session.remove()
+
+    if collected:
+        logger.info(f"Removed {len(collected)} unreferenced objects from the local store")
+    return len(collected)
+
+def init_local_store(app):
+    """Bind the shared local object store to the app"""
+    return local_store.init_app(app)
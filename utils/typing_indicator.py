@@ -0,0 +1,141 @@
+"""
+Typing Indicator Utility
+In-memory throttling of typing events with automatic "stopped typing" timeouts
+"""
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import get_config
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class TypingTracker:
+    """
+    Tracks who is typing in which conversation
+
+    A user gets at most one typing broadcast per conversation every
+    throttle_ms; if no typing event arrives for timeout_ms the user is
+    reported as having stopped typing.
+    """
+
+    def __init__(self, throttle_ms: int, timeout_ms: int, clock=time.monotonic):
+        self.throttle = throttle_ms / 1000.0
+        self.timeout = timeout_ms / 1000.0
+        self.clock = clock
+
+        # (user_id, conversation_id) -> {'username', 'sid', 'last_emit', 'last_seen'}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id: int, username: str, conversation_id: int, sid: str) -> bool:
+        """
+        Record a typing event
+
+        Returns:
+            bool: True if a typing broadcast should be sent now
+        """
+        now = self.clock()
+        key = (user_id, conversation_id)
+
+        with self._lock:
+            entry = self._active.get(key)
+            if entry is None:
+                self._active[key] = {
+                    'username': username,
+                    'sid': sid,
+                    'last_emit': now,
+                    'last_seen': now
+                }
+                return True
+
+            entry['last_seen'] = now
+            entry['sid'] = sid
+            if now - entry['last_emit'] >= self.throttle:
+                entry['last_emit'] = now
+                return True
+            return False
+
+    def stop(self, user_id: int, conversation_id: int) -> Optional[Dict]:
+        """
+        Record an explicit stop
+
+        Returns:
+            Optional[Dict]: The removed entry if the user was typing
+        """
+        with self._lock:
+            return self._active.pop((user_id, conversation_id), None)
+
+    def clear_user(self, user_id: int) -> List[Tuple[Tuple[int, int], Dict]]:
+        """
+        Remove every typing entry of a user (e.g. on disconnect)
+        """
+        with self._lock:
+            keys = [key for key in self._active if key[0] == user_id]
+            return [(key, self._active.pop(key)) for key in keys]
+
+    def expire(self) -> List[Tuple[Tuple[int, int], Dict]]:
+        """
+        Remove and return entries that have not seen a typing event within the timeout
+        """
+        now = self.clock()
+        with self._lock:
+            keys = [key for key, entry in self._active.items() if now - entry['last_seen'] >= self.timeout]
+            return [(key, self._active.pop(key)) for key in keys]
+
+    def __len__(self):
+        return len(self._active)
+
+# Create a singleton instance
+typing_tracker = TypingTracker(
+    get_config('messaging.typing_throttle_ms', 2000),
+    get_config('messaging.typing_timeout_ms', 5000)
+)
+
+# Background sweeper state
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+
+def emit_typing_stopped(user_id: int, conversation_id: int, entry: Dict) -> None:
+    """Tell the other participants that a user stopped typing"""
+    from utils.backpressure import outbound_guard
+
+    outbound_guard.emit('typing_stopped', {
+        'user_id': user_id,
+        'username': entry['username'],
+        'conversation_id': conversation_id
+    }, room=f"conversation_{conversation_id}", skip_sid=entry['sid'])
+
+def stop_user_typing(user_id: int) -> None:
+    """Clear all typing indicators of a user and notify their conversations"""
+    for (user_id, conversation_id), entry in typing_tracker.clear_user(user_id):
+        emit_typing_stopped(user_id, conversation_id, entry)
+
+def _sweep_typing_indicators():
+    """Emit "stopped typing" for users whose typing events timed out"""
+    from socket_instance import socketio
+
+    interval = min(typing_tracker.timeout / 2, 1.0)
+    while True:
+        socketio.sleep(interval)
+        try:
+            for (user_id, conversation_id), entry in typing_tracker.expire():
+                emit_typing_stopped(user_id, conversation_id, entry)
+        except Exception as e:
+            logger.error(f"Error sweeping typing indicators: {str(e)}")
+
+def ensure_typing_sweeper() -> None:
+    """Start the background sweeper on first use"""
+    global _sweeper_started
+    if _sweeper_started:
+        return
+
+    with _sweeper_lock:
+        if _sweeper_started:
+            return
+        from socket_instance import socketio
+        socketio.start_background_task(_sweep_typing_indicators)
+        _sweeper_started = True
+        logger.info("Typing indicator sweeper started")
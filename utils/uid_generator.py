@@ -1,63 +1,211 @@
-import random
-import string
-from models import User
+"""
+UID Generator
+Allocates the 10-digit public user IDs without collisions or database lookups
+
+A UID is a counter value passed through a keyed Feistel permutation of the
+9,000,000,000 ten-digit numbers. The permutation is a bijection, so distinct
+counter values always give distinct UIDs, and consecutive users still get
+unrelated-looking IDs. The counter and the key live in the single
+UidSequence row. A process reserves accounts.uid_block_size counter values
+with one UPDATE and hands them out from memory, so allocating a UID normally
+touches the database zero times.
+
+Users who registered before this allocator have random UIDs, and a
+permuted counter value can land on one of them. Each reserved block is
+checked against the user table once, and any UID already in use is
+dropped from it.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import List
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import get_config
+from models import User, UidSequence
 from database import db
 
-def generate_uid(length=10):
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# UIDs are the numbers 1000000000 to 9999999999
+UID_BASE = 10 ** 9
+UID_SPACE = 9 * 10 ** 9
+
+# The permutation runs over 34-bit values, those past UID_SPACE are permuted again (cycle walking)
+HALF_BITS = 17
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 6
+
+# Rows per query when checking a block against existing UIDs
+CHECK_CHUNK = 500
+
+def _feistel(key: bytes, value: int) -> int:
+    """One pass of the balanced Feistel network over 34-bit values"""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_number in range(ROUNDS):
+        digest = hashlib.blake2b(bytes([round_number]) + right.to_bytes(3, 'big'), key=key, digest_size=4).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & HALF_MASK)
+    return (left << HALF_BITS) | right
+
+def permute(key: bytes, counter: int) -> str:
     """
-    Generate a random alphanumeric string of specified length
+    Map a counter value to its UID
+
+    Args:
+        key: Permutation key
+        counter: Counter value, 0 <= counter < UID_SPACE
+
+    Returns:
+        str: The 10-digit UID
+    """
+    if not 0 <= counter < UID_SPACE:
+        raise RuntimeError("The UID space is exhausted")
+    value = _feistel(key, counter)
+    while value >= UID_SPACE:
+        value = _feistel(key, value)
+    return str(UID_BASE + value)
+
+class UidAllocator:
+    """
+    Hands out UIDs from blocks of counter values reserved in the database
     """
-    characters = string.digits  # Only digits for a numeric UID
-    return ''.join(random.choice(characters) for _ in range(length))
 
-def generate_unique_uid(length=10, max_attempts=100):
+    def __init__(self):
+        self.block_size = get_config('accounts.uid_block_size', 1000)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'blocks': 0,
+            'allocated': 0,
+            'skipped': 0
+        }
+
+    def reset(self) -> None:
+        """Drop the UIDs reserved by this process, e.g. when switching databases"""
+        with self._lock:
+            self._pending.clear()
+
+    def allocate(self) -> str:
+        """
+        Get a UID no user has (inside an app context)
+
+        Returns:
+            str: A 10-digit UID
+        """
+        with self._lock:
+            while not self._pending:
+                self._pending.extend(self._reserve(self.block_size))
+            self.stats['allocated'] += 1
+            return self._pending.popleft()
+
+    def allocate_many(self, count: int) -> List[str]:
+        """
+        Get several UIDs at once (inside an app context), for bulk assignment
+
+        Args:
+            count: Number of UIDs
+
+        Returns:
+            List[str]: Distinct UIDs no user has
+        """
+        with self._lock:
+            uids = []
+            while self._pending and len(uids) < count:
+                uids.append(self._pending.popleft())
+            while len(uids) < count:
+                uids.extend(self._reserve(count - len(uids)))
+            self.stats['allocated'] += len(uids)
+            return uids
+
+    def _reserve(self, count: int) -> List[str]:
+        """Reserve count counter values and return their UIDs, less those already in use"""
+        row = None
+        while row is None:
+            with db.engine.begin() as conn:
+                # The UPDATE comes first so concurrent processes queue on its write lock
+                updated = conn.execute(
+                    update(UidSequence).where(UidSequence.id == 1)
+                    .values(next_value=UidSequence.next_value + count)
+                ).rowcount
+                if updated:
+                    row = conn.execute(select(UidSequence.key, UidSequence.next_value).where(UidSequence.id == 1)).one()
+            if row is None:
+                self._create_sequence()
+
+        key = bytes.fromhex(row.key)
+        start = row.next_value - count
+        uids = [permute(key, counter) for counter in range(start, row.next_value)]
+
+        taken = set()
+        for i in range(0, len(uids), CHECK_CHUNK):
+            chunk = uids[i:i + CHECK_CHUNK]
+            taken.update(uid for (uid,) in db.session.execute(select(User.uid).where(User.uid.in_(chunk))))
+
+        self.stats['blocks'] += 1
+        if taken:
+            self.stats['skipped'] += len(taken)
+            logger.info(f"Skipped {len(taken)} UIDs already given out before the allocator")
+        return [uid for uid in uids if uid not in taken]
+
+    def _create_sequence(self) -> None:
+        """Create the allocator's row with a new random key, unless another process just did"""
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(UidSequence.__table__.insert().values(id=1, key=os.urandom(16).hex(), next_value=0))
+            logger.info("Created the UID sequence")
+        except IntegrityError:
+            pass
+
+# Create a singleton instance
+uid_allocator = UidAllocator()
+
+def generate_unique_uid():
     """
     Generate a unique user ID that doesn't exist in the database
-    
-    Args:
-        length (int): Length of the UID
-        max_attempts (int): Maximum number of attempts to generate a unique UID
-        
+
     Returns:
-        str: A unique UID
-        
-    Raises:
-        RuntimeError: If unable to generate a unique UID after max_attempts
-    """
-    for _ in range(max_attempts):
-        # Generate a UID
-        uid = generate_uid(length)
-        
-        # Ensure first digit is not 0 for a true 10-digit number
-        if uid[0] == '0':
-            uid = str(random.randint(1, 9)) + uid[1:]
-            
-        # Check if it exists in the database
-        existing_user = User.query.filter_by(uid=uid).first()
-        
-        # If it doesn't exist, return it
-        if not existing_user:
-            return uid
-    
-    # If we've tried max_attempts times and still haven't found a unique UID
-    raise RuntimeError(f"Unable to generate a unique UID after {max_attempts} attempts")
-
-def assign_uids_to_existing_users():
-    """
-    Assign UIDs to existing users who don't have one
-    
+        str: A unique 10-digit UID
+    """
+    return uid_allocator.allocate()
+
+def assign_uids_to_existing_users(batch_size=None, progress=None):
+    """
+    Assign UIDs to existing users who don't have one, a committed batch at a time
+
+    Args:
+        batch_size (int): Users per batch, accounts.uid_backfill_batch_size if None
+        progress (callable): Called with the running total after each batch
+
     Returns:
         int: Number of users updated
     """
-    # Get all users without a UID
-    users_without_uid = User.query.filter(User.uid.is_(None)).all()
-    
+    if batch_size is None:
+        batch_size = get_config('accounts.uid_backfill_batch_size', 10000)
+
     count = 0
-    for user in users_without_uid:
-        user.uid = generate_unique_uid()
-        count += 1
-    
-    # Commit changes
-    db.session.commit()
-    
+    last_id = 0
+    while True:
+        # Keyset pagination, only the IDs are loaded
+        ids = db.session.execute(
+            select(User.id).where(User.uid.is_(None), User.id > last_id).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        uids = uid_allocator.allocate_many(len(ids))
+        db.session.execute(update(User), [{'id': user_id, 'uid': uid} for user_id, uid in zip(ids, uids)])
+        db.session.commit()
+
+        count += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(count)
+
     return count
@@ -1,59 +1,142 @@
-import os
-import uuid
-import json
+import time
 import logging
-from werkzeug.utils import secure_filename
-from flask import current_app
+from flask import current_app, g, has_request_context
+from config import get_config
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
-def save_photo(file):
+def _spool(file, allowed_types):
+    """Spool a request file, or return None if it is rejected"""
+    from utils.upload_spool import spool_upload, UploadRejected
+
+    try:
+        return spool_upload(file, allowed_types)
+    except UploadRejected as e:
+        logger.warning(f"Upload of {file.filename} rejected: {str(e)}")
+        return None
+
+def find_duplicate_upload(content_hash, media_type=None):
     """
-    Save a photo to the server or external services
-    Returns the URL of the saved photo
+    Find an available upload of the same content, a single index lookup
+    Returns the FileUpload or None
     """
-    if not file:
+    from models import FileUpload
+    from utils.storage import local_store
+
+    query = FileUpload.query.filter_by(content_hash=content_hash, is_available=True)
+    if media_type:
+        query = query.filter_by(media_type=media_type)
+    upload = query.order_by(FileUpload.id).first()
+
+    # A stored object is about to be referenced again, keep the garbage collector off it
+    name = local_store.name_of(upload.primary_url) if upload else None
+    if name is not None and not local_store.touch(name):
         return None
+    return upload
 
-    # First try to upload to multiple services
-    from utils.multi_upload import save_multi_uploads
+def _start(spool, media_type):
+    """
+    Start uploading a spooled file unless the same content was uploaded before
+    Returns (existing FileUpload, None) or (None, upload job)
+    """
+    from utils.multi_upload import upload_engine
+
+    existing = find_duplicate_upload(spool.sha256, media_type)
+    if existing is not None:
+        logger.info(f"Reusing upload {existing.id} for {spool.filename}")
+        return existing, None
+    return None, upload_engine.submit(spool)
+
+def _save_upload(job, spool, media_type, timeout=None):
+    """
+    Store the outcome of an upload job in FileUpload and return the file's URL
+
+    The first external URL is used as soon as it is available; the remaining
+    mirrors are added to fallback_urls when their uploads finish. The file is
+    kept in the local object store when every external service fails.
+    """
     from database import db
     from models import FileUpload
+    from utils.image_derivatives import image_pipeline
+    from utils.storage import local_store
+
+    if timeout is None:
+        timeout = get_config('upload.first_success_timeout_seconds', 30)
+
+    # Rendered here while the uploads run, the feed needs it as soon as the post exists
+    placeholder = image_pipeline.placeholder(spool.path) if media_type == 'image' else None
 
-    urls = save_multi_uploads(file)
-    if urls:
+    url = job.wait_first(timeout)
+    if url:
         # Store in database
         upload = FileUpload(
-            original_filename=secure_filename(file.filename),
-            primary_url=urls[0],
-            fallback_urls=json.dumps(urls[1:]) if len(urls) > 1 else None,
-            media_type='image'
+            original_filename=spool.filename,
+            primary_url=url,
+            media_type=media_type,
+            content_hash=spool.sha256,
+            placeholder=placeholder
         )
         db.session.add(upload)
         db.session.commit()
+        job.attach(current_app._get_current_object(), upload.id)
+        image_pipeline.submit(upload.id, spool)
         logger.info(f"File uploaded to external services: {upload.id} - {upload.original_filename}")
-        return urls[0]
+        return url
 
-    # Fall back to local storage if external uploads fail
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4().hex}_{filename}"
-    file_path = os.path.join(current_app.config["UPLOAD_FOLDER_PHOTOS"], unique_filename)
-    file.save(file_path)
-    local_url = os.path.join("uploads/photos", unique_filename)
+    # Fall back to the local object store if external uploads fail
+    local_url = local_store.put(spool)
 
     # Still track in the database even for local files
     upload = FileUpload(
-        original_filename=filename,
+        original_filename=spool.filename,
         primary_url=local_url,
-        media_type='image'
+        media_type=media_type,
+        content_hash=spool.sha256,
+        placeholder=placeholder
     )
     db.session.add(upload)
     db.session.commit()
-    logger.info(f"File saved locally: {upload.id} - {unique_filename} (external uploads failed)")
+    image_pipeline.submit(upload.id, spool)
+    logger.info(f"File saved locally: {upload.id} - {local_url} (external uploads failed)")
 
     return local_url
 
+def save_photo(file):
+    """
+    Save a photo to the server or external services
+    Returns the URL of the saved photo
+    """
+    if not file:
+        return None
+    return save_photos([file])[0]
+
+def save_photos(files):
+    """
+    Save several photos, uploading all of them concurrently
+    Returns the URLs of the saved photos in the same order, None for empty or rejected files
+    """
+    from utils.upload_spool import allowed_image_types
+
+    allowed_types = allowed_image_types()
+    spools = [_spool(file, allowed_types) if file else None for file in files]
+    started = [_start(spool, 'image') if spool else (None, None) for spool in spools]
+
+    # One deadline for the whole batch, the uploads run side by side
+    deadline = time.monotonic() + get_config('upload.first_success_timeout_seconds', 30)
+    urls = []
+    for (existing, job), spool in zip(started, spools):
+        if spool is None:
+            urls.append(None)
+            continue
+        with spool:
+            # Same content as an earlier upload, nothing was sent anywhere
+            if existing is not None:
+                urls.append(existing.get_best_url())
+                continue
+            urls.append(_save_upload(job, spool, 'image', timeout=max(0, deadline - time.monotonic())))
+    return urls
+
 def save_video(file):
     """
     Save a video to the server or external services
@@ -62,40 +145,107 @@ def save_video(file):
     if not file:
         return None
 
-    # First try to upload to multiple services
-    from utils.multi_upload import save_multi_uploads
+    from utils.upload_spool import allowed_video_types
+
+    spool = _spool(file, allowed_video_types())
+    if spool is None:
+        return None
+    with spool:
+        return save_spooled(spool, 'video')
+
+def save_spooled(spool, media_type):
+    """
+    Save a file that is already spooled, such as a completed chunked upload
+    Returns the URL of the saved file; the caller keeps its reference to the spool
+    """
+    existing, job = _start(spool, media_type)
+    if existing is not None:
+        return existing.get_best_url()
+    return _save_upload(job, spool, media_type)
+
+def start_upload(file, media_type=None, user_id=None):
+    """
+    Save a file locally and upload it to the external services in the background
+    Returns (URL, job ID), or (None, None) if the file is rejected
+    """
+    from utils.upload_spool import allowed_image_types, allowed_video_types
+
+    if media_type == 'image':
+        allowed_types = allowed_image_types()
+    elif media_type == 'video':
+        allowed_types = allowed_video_types()
+    else:
+        allowed_types = allowed_image_types() | allowed_video_types()
+
+    spool = _spool(file, allowed_types)
+    if spool is None:
+        return None, None
+    with spool:
+        return start_spooled_upload(spool, media_type, user_id)
+
+def start_spooled_upload(spool, media_type=None, user_id=None):
+    """
+    Save a spooled file to the local object store and return at once, the external uploads finish in the background
+
+    The local URL is provisional: when the first external service answers,
+    the FileUpload row and every post, story, message or profile using the
+    URL are moved to the external one, and the user is sent upload_progress
+    and upload_complete events. Tracking starts when the request is torn
+    down, so rows the request commits with the local URL are moved too. It
+    also starts if the view raised (see init_upload_tracking).
+
+    Returns (URL, job ID); the job ID is None when the same content was
+    uploaded before and its URL is reused. The caller keeps its reference
+    to the spool.
+    """
     from database import db
     from models import FileUpload
+    from utils.image_derivatives import image_pipeline
+    from utils.multi_upload import upload_engine
+    from utils.storage import local_store
 
-    urls = save_multi_uploads(file)
-    if urls:
-        # Store in database
-        upload = FileUpload(
-            original_filename=secure_filename(file.filename),
-            primary_url=urls[0],
-            fallback_urls=json.dumps(urls[1:]) if len(urls) > 1 else None,
-            media_type='video'
-        )
-        db.session.add(upload)
-        db.session.commit()
-        logger.info(f"Video uploaded to external services: {upload.id} - {upload.original_filename}")
-        return urls[0]
+    if media_type is None:
+        media_type = 'video' if spool.mime_type.startswith('video/') else 'image'
 
-    # Fall back to local storage if external uploads fail
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4().hex}_{filename}"
-    file_path = os.path.join(current_app.config["UPLOAD_FOLDER_VIDEOS"], unique_filename)
-    file.save(file_path)
-    local_url = os.path.join("uploads/videos", unique_filename)
+    existing = find_duplicate_upload(spool.sha256, media_type)
+    if existing is not None:
+        logger.info(f"Reusing upload {existing.id} for {spool.filename}")
+        return existing.get_best_url(), None
 
-    # Still track in the database even for local files
+    local_url = local_store.put(spool)
     upload = FileUpload(
-        original_filename=filename,
+        original_filename=spool.filename,
         primary_url=local_url,
-        media_type='video'
+        media_type=media_type,
+        content_hash=spool.sha256,
+        placeholder=image_pipeline.placeholder(spool.path) if media_type == 'image' else None
     )
     db.session.add(upload)
     db.session.commit()
-    logger.info(f"Video saved locally: {upload.id} - {unique_filename} (external uploads failed)")
+    image_pipeline.submit(upload.id, spool)
 
-    return local_url
+    job = upload_engine.submit(spool)
+    app = current_app._get_current_object()
+    upload_id = upload.id
+
+    def track():
+        job.track(app, upload_id, local_url, user_id)
+
+    if has_request_context():
+        g.setdefault('upload_tracking', []).append(track)
+    else:
+        track()
+    logger.info(f"File saved locally: {upload_id} - {local_url}, upload job {job.id} started")
+    return local_url, job.id
+
+def track_started_uploads(exc=None):
+    """Start tracking the upload jobs the request started, whether or not the view raised"""
+    for track in g.pop('upload_tracking', []):
+        try:
+            track()
+        except Exception as e:
+            logger.error(f"Error tracking upload job: {str(e)}")
+
+def init_upload_tracking(app):
+    """Track background uploads once their request is torn down"""
+    app.teardown_request(track_started_uploads)
@@ -0,0 +1,257 @@
+"""
+Upload Spooling
+Spools uploaded files to disk once and streams them to every backend
+
+A request file is copied to a temporary file in a single pass that also
+hashes it, enforces the size limit and checks its type from the leading
+bytes. Backends then read their own handle on the spool file, and request
+bodies are streamed from it as multipart/form-data with a known length, so
+memory use does not grow with the file size or the number of backends.
+"""
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from io import BytesIO
+from typing import Dict, Iterable, Optional
+
+import requests
+from werkzeug.utils import secure_filename
+
+from config import (get_config, get_max_upload_size, get_allowed_image_extensions,
+                    get_allowed_video_extensions)
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# File extension -> media type
+EXTENSION_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'mp4': 'video/mp4',
+    'webm': 'video/webm',
+    'ogg': 'video/ogg'
+}
+
+class UploadRejected(ValueError):
+    """Raised when an upload is too large or not an accepted media type"""
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """
+    Detect the media type of a file from its leading bytes
+
+    Args:
+        head: At least the first 12 bytes of the file
+
+    Returns:
+        Optional[str]: Media type, or None if it is not a known image or video format
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    if head.startswith(b'\x1aE\xdf\xa3'):
+        return 'video/webm'
+    if head.startswith(b'OggS'):
+        return 'video/ogg'
+    return None
+
+def allowed_image_types() -> set:
+    return {EXTENSION_TYPES[ext] for ext in get_allowed_image_extensions() if ext in EXTENSION_TYPES}
+
+def allowed_video_types() -> set:
+    return {EXTENSION_TYPES[ext] for ext in get_allowed_video_extensions() if ext in EXTENSION_TYPES}
+
+class SpooledUpload:
+    """
+    An uploaded file spooled to disk
+
+    The spool is reference counted: whoever spools a file owns one
+    reference, and every background consumer retains its own. The file is
+    removed when the last reference is released.
+    """
+
+    def __init__(self, path: str, filename: str, size: int, sha256: str, mime_type: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    @property
+    def content_type(self) -> str:
+        return self.mime_type
+
+    def open(self):
+        """Open a new read handle on the spooled file"""
+        return open(self.path, 'rb')
+
+    def save(self, dest: str) -> None:
+        """Copy the spooled file to its final location"""
+        shutil.copyfile(self.path, dest)
+
+    def retain(self) -> 'SpooledUpload':
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> 'SpooledUpload':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+def spool_upload(file, allowed_types: Optional[Iterable[str]] = None, max_size: Optional[int] = None) -> SpooledUpload:
+    """
+    Copy an uploaded file to a spool file, hashing and validating it on the way
+
+    Args:
+        file: Request file (FileStorage), file-like object or bytes
+        allowed_types: Accepted media types, any known image or video type if None
+        max_size: Size limit in bytes, upload.max_upload_size_bytes if None
+
+    Returns:
+        SpooledUpload: The spooled file, owned by the caller
+
+    Raises:
+        UploadRejected: If the file is empty, too large or of a type that is not allowed
+    """
+    if max_size is None:
+        max_size = get_max_upload_size()
+
+    filename = secure_filename(getattr(file, 'filename', None) or '') or 'upload'
+    if isinstance(file, (bytes, bytearray)):
+        source = BytesIO(file)
+    else:
+        source = getattr(file, 'stream', file)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    spool_dir = get_config('upload.spool_dir', '') or None
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='upload_', dir=spool_dir)
+
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected(f"File is larger than {max_size} bytes")
+                if len(head) < 12:
+                    head += chunk[:12 - len(head)]
+                digest.update(chunk)
+                spool.write(chunk)
+
+        if size == 0:
+            raise UploadRejected("File is empty")
+
+        mime_type = sniff_type(head)
+        if mime_type is None:
+            raise UploadRejected("File is not a supported image or video")
+        if allowed_types is not None and mime_type not in allowed_types:
+            raise UploadRejected(f"File type {mime_type} is not allowed")
+    except BaseException:
+        os.remove(path)
+        raise
+
+    logger.debug(f"Spooled {filename}: {size} bytes, {mime_type}")
+    return SpooledUpload(path, filename, size, digest.hexdigest(), mime_type)
+
+class MultipartStream:
+    """
+    A multipart/form-data request body read straight from a spool file
+
+    It has a length, so requests sends a Content-Length header and streams
+    the body in blocks instead of building it in memory.
+    """
+
+    def __init__(self, spool: SpooledUpload, field_name: str, fields: Optional[Dict] = None,
+                 filename: Optional[str] = None):
+        boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in (fields or {}).items():
+            head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n').encode('utf-8')
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; '
+                 f'filename="{filename or spool.filename}"\r\n'
+                 f'Content-Type: {spool.mime_type}\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._length = len(head) + spool.size + len(tail)
+        self._parts = [BytesIO(head), spool.open(), BytesIO(tail)]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        result = b''
+        while self._parts and (size < 0 or len(result) < size):
+            chunk = self._parts[0].read(-1 if size < 0 else size - len(result))
+            if not chunk:
+                self._parts.pop(0).close()
+                continue
+            result += chunk
+        return result
+
+    def close(self) -> None:
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+def post_multipart(url: str, spool: SpooledUpload, field_name: str, data: Optional[Dict] = None,
+                   headers: Optional[Dict] = None, filename: Optional[str] = None, timeout: float = 30):
+    """
+    POST a spooled file as multipart/form-data, streaming it from disk
+
+    Args:
+        url: Upload URL
+        spool: File to send
+        field_name: Form field of the file
+        data: Other form fields
+        headers: Extra request headers
+        filename: File name sent to the backend, the spooled file's name if None
+        timeout: Request timeout in seconds
+
+    Returns:
+        requests.Response: The backend's response
+    """
+    body = MultipartStream(spool, field_name, data, filename)
+    try:
+        return requests.post(url, data=body, timeout=timeout,
+                             headers={**(headers or {}), 'Content-Type': body.content_type})
+    finally:
+        body.close()
@@ -0,0 +1,270 @@
+"""
+URL Health
+Cached health of uploaded file URLs, kept fresh by a background prober
+
+FileUpload.get_best_url picks a URL from this cache and never waits on the
+network: the first URL known to be healthy, otherwise the first one not
+known to be broken. URLs with a missing or expired entry are queued for the
+prober, which issues the HEAD requests on its own thread and records the
+outcome in FileUpload.is_available and FileUpload.last_check. Failures are
+cached too (for a shorter time) so a dead mirror is not probed on every
+render.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import requests
+
+from config import get_config
+from utils.media_files import local_path
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class UrlHealthCache:
+    """
+    In-process cache of URL health with separate TTLs for healthy and broken URLs
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        # url -> (healthy, checked_at)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    def get(self, url: str, now: Optional[float] = None) -> Optional[bool]:
+        """
+        Get the cached health of a URL
+
+        Returns:
+            Optional[bool]: True or False, or None if unknown or expired
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                healthy, checked_at = entry
+                if now - checked_at < (self.ttl if healthy else self.negative_ttl):
+                    self.stats['hits'] += 1
+                    return healthy
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, url: str, healthy: bool, now: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[url] = (healthy, time.time() if now is None else now)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Drop expired entries, returns the number removed"""
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [
+                url for url, (healthy, checked_at) in self._entries.items()
+                if now - checked_at >= (self.ttl if healthy else self.negative_ttl)
+            ]
+            for url in expired:
+                del self._entries[url]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class UrlProber:
+    """
+    Probes FileUpload URLs on a background thread
+    """
+
+    def __init__(self):
+        self.app = None
+        self.cache = UrlHealthCache(
+            get_config('upload.url_health_ttl_seconds', 600),
+            get_config('upload.url_health_negative_ttl_seconds', 60)
+        )
+        self.timeout = get_config('upload.url_probe_timeout_seconds', 5)
+        self.poll_interval = get_config('upload.url_probe_interval_seconds', 300)
+        self.batch_size = get_config('upload.url_probe_batch_size', 100)
+
+        # FileUpload IDs waiting for a probe
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        # Counters for monitoring
+        self.stats = {
+            'probes': 0,
+            'failures': 0,
+            'uploads_checked': 0
+        }
+
+    def init_app(self, app):
+        """
+        Bind the prober to the Flask app used by the background thread
+        """
+        self.app = app
+        return True
+
+    def wake(self) -> None:
+        """Start the prober if needed and have it check pending uploads now"""
+        if self.app is None:
+            return
+        self._ensure_started()
+        self._wake.set()
+
+    def request_check(self, upload_id: int) -> None:
+        """Queue an upload for a probe, without waiting for it"""
+        with self._pending_lock:
+            if upload_id in self._pending:
+                return
+            self._pending.add(upload_id)
+        self.wake()
+
+    def best_url(self, urls: List[str]) -> Optional[str]:
+        """
+        Pick a URL from cached health only
+
+        Returns:
+            Optional[str]: First healthy URL, else the first not known to be broken, else None
+        """
+        fallback = None
+        for url in urls:
+            healthy = self.cache.get(url)
+            if healthy:
+                return url
+            if healthy is None and fallback is None:
+                fallback = url
+        return fallback
+
+    def resolve(self, upload) -> str:
+        """
+        Get the best URL of a FileUpload without touching the network
+
+        Uploads with a URL of unknown health are queued for the prober.
+        """
+        urls = upload.get_all_urls()
+        if upload.id is not None and any(self.cache.get(url) is None for url in urls):
+            self.request_check(upload.id)
+        return self.best_url(urls) or upload.primary_url
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='url-prober', daemon=True)
+            self._thread.start()
+            logger.info(f"URL prober started (interval={self.poll_interval}s)")
+
+    def _run(self) -> None:
+        """Background loop probing requested and stale uploads"""
+        while True:
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+                    self.cache.prune()
+            except Exception as e:
+                logger.error(f"Error probing upload URLs: {str(e)}")
+            self._wake.wait(self.poll_interval)
+
+    def run_pending(self) -> int:
+        """
+        Probe requested uploads, then the ones not checked within the TTL (inside an app context)
+
+        Returns:
+            int: Number of uploads checked
+        """
+        from database import db
+        from models import FileUpload
+
+        with self._pending_lock:
+            requested = list(self._pending)
+            self._pending.clear()
+
+        checked = 0
+        try:
+            uploads = FileUpload.query.filter(FileUpload.id.in_(requested)).all() if requested else []
+
+            stale_before = datetime.utcnow() - timedelta(seconds=self.cache.ttl)
+            uploads += FileUpload.query.filter(
+                (FileUpload.last_check == None) | (FileUpload.last_check < stale_before),
+                ~FileUpload.id.in_(requested)
+            ).order_by(FileUpload.last_check).limit(self.batch_size).all()
+
+            for upload in uploads:
+                self.check(upload)
+                db.session.commit()
+                checked += 1
+        finally:
+            db.session.remove()
+
+        self.stats['uploads_checked'] += checked
+        return checked
+
+    def check(self, upload) -> Dict[str, bool]:
+        """
+        Probe the URLs of an upload and record its availability
+
+        Returns:
+            Dict[str, bool]: Health of each URL
+        """
+        health = {}
+        for url in upload.get_all_urls():
+            healthy = self.cache.get(url)
+            if healthy is None:
+                healthy = self.probe(url)
+                self.cache.set(url, healthy)
+            health[url] = healthy
+
+        upload.is_available = any(health.values())
+        upload.last_check = datetime.utcnow()
+        return health
+
+    def probe(self, url: str) -> bool:
+        """Check a single URL (blocking), local files are checked on disk"""
+        self.stats['probes'] += 1
+        try:
+            if url.startswith(('http://', 'https://')):
+                response = requests.head(url, timeout=self.timeout, allow_redirects=True)
+                healthy = response.status_code < 400
+            else:
+                path = local_path(url, self.app.static_folder)
+                healthy = path is not None and os.path.exists(path)
+        except Exception as e:
+            logger.debug(f"Probe of {url} failed: {str(e)}")
+            healthy = False
+
+        if not healthy:
+            self.stats['failures'] += 1
+        return healthy
+
+    def get_stats(self) -> Dict:
+        """Get prober and cache counters"""
+        return {
+            **self.stats,
+            **self.cache.stats,
+            'cached_urls': len(self.cache),
+            'pending': len(self._pending)
+        }
+
+# Create a singleton instance
+url_prober = UrlProber()
+
+def init_url_prober(app):
+    """Bind the shared URL prober to the app"""
+    return url_prober.init_app(app)
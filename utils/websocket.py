@@ -5,6 +5,10 @@ from flask_socketio import emit, join_room, leave_room, disconnect
 
 # Import shared socketio instance
 from socket_instance import socketio
+from utils.event_replay import event_buffer
+from utils.backpressure import outbound_guard
+from utils.gateway_ipc import gateway_bridge
+from utils.compact_events import compact_encoder, get_schema, ENCODING_MSGPACK
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -12,6 +16,9 @@ logger = logging.getLogger(__name__)
 # Connected clients
 connected_clients = {}
 
+# Identity of authenticated sockets, keyed by socket ID
+client_identities = {}
+
 def init_socketio(app):
     """Initialize SocketIO handlers"""
     logger.info("WebSocket handlers initialized")
@@ -26,7 +33,7 @@ def handle_connect():
     emit('connected', {
         'status': 'connected', 
         'authenticated': False,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.utcnow().isoformat()
     })
     
     return True
@@ -43,10 +50,18 @@ def handle_disconnect():
             user_id = uid
             break
     
+    client_identities.pop(request.sid, None)
+    outbound_guard.forget(request.sid)
+    compact_encoder.forget(request.sid)
+
     if user_id:
         logger.info(f"Authenticated client disconnected: {user_id}")
         del connected_clients[user_id]
 
+        # Clear any typing indicators left by this user
+        from utils.typing_indicator import stop_user_typing
+        stop_user_typing(user_id)
+
         # Update user's online status
         try:
             from models import User
@@ -55,15 +70,15 @@ def handle_disconnect():
             user = User.query.get(user_id)
             if user:
                 user.is_active = False
-                user.last_online = datetime.now()
+                user.last_online = datetime.utcnow()
                 db.session.commit()
 
                 # Broadcast user's offline status
-                emit('user_status', {
+                publish_event('user_status', {
                     'user_id': user.id,
                     'username': user.username,
                     'status': 'offline'
-                }, broadcast=True)
+                })
         except Exception as e:
             logger.error(f"Error updating user status on disconnect: {str(e)}")
 
@@ -92,6 +107,10 @@ def handle_auth(data):
 
         # Store client connection
         connected_clients[user_id] = request.sid
+        client_identities[request.sid] = {
+            'user_id': user.id,
+            'username': user.username
+        }
         
         # Join user's personal room
         room_name = f"user_{user_id}"
@@ -100,27 +119,69 @@ def handle_auth(data):
 
         # Update user's online status
         user.is_active = True
-        user.last_online = datetime.now()
+        user.last_online = datetime.utcnow()
         db.session.commit()
 
         # Broadcast user's online status
-        emit('user_status', {
+        publish_event('user_status', {
             'user_id': user.id,
             'username': user.username,
             'status': 'online'
-        }, broadcast=True)
+        })
+
+        # Replay events missed while the client was disconnected
+        last_seq = (data or {}).get('last_seq')
+        if last_seq is not None:
+            replay_missed_events(user.id, last_seq, (data or {}).get('epoch'))
 
         # Send success response
         logger.info(f"Client authenticated: {user_id} ({user.username})")
         emit('auth_response', {
             'status': 'success', 
             'user_id': user_id,
-            'username': user.username
+            'username': user.username,
+            'epoch': event_buffer.epoch,
+            'seq': event_buffer.current(user.id)
         })
     except Exception as e:
         logger.error(f"Error during authentication: {str(e)}")
         emit('auth_response', {'status': 'error', 'message': f'Server error: {str(e)}'})
 
+def replay_missed_events(user_id, last_seq, epoch):
+    """Send a reconnecting client the events after last_seq, or ask it to resync"""
+    try:
+        last_seq = int(last_seq)
+    except (TypeError, ValueError):
+        return
+
+    events, complete = event_buffer.replay(user_id, last_seq, epoch)
+    if not complete:
+        logger.info(f"Replay gap for user {user_id} after seq {last_seq}, requesting resync")
+        emit('resync_required', {
+            'epoch': event_buffer.epoch,
+            'seq': event_buffer.current(user_id)
+        })
+        return
+
+    for seq, event_type, data in events:
+        emit(event_type, dict(data, seq=seq, replayed=True))
+
+    if events:
+        logger.debug(f"Replayed {len(events)} events to user {user_id}")
+
+@socketio.on('negotiate_encoding')
+def handle_negotiate_encoding(data):
+    """Let a client opt into compact (MessagePack) event payloads"""
+    encoding = compact_encoder.negotiate((data or {}).get('encodings'))
+    if encoding == ENCODING_MSGPACK:
+        # Sent before any compact payload so the client can decode them
+        emit('encoding_selected', get_schema())
+        compact_encoder.enable(request.sid)
+    else:
+        emit('encoding_selected', {'encoding': encoding})
+
+    return {'encoding': encoding}
+
 @socketio.on('error')
 def handle_error(error):
     """Handle WebSocket errors"""
@@ -148,19 +209,41 @@ def handle_message(data):
         # Add processing logic here if needed
     
     # Echo back for testing
-    emit('message', {'echo': data, 'timestamp': datetime.now().isoformat()})
+    emit('message', {'echo': data, 'timestamp': datetime.utcnow().isoformat()})
+
+def get_client_identity(sid):
+    """Get the cached identity of an authenticated socket, or None"""
+    return client_identities.get(sid)
+
+def publish_event(event_type, data, room=None, skip_sid=None):
+    """Emit an event to a room on this server and on any connected realtime gateway"""
+    outbound_guard.emit(event_type, data, room=room, skip_sid=skip_sid)
+    gateway_bridge.publish(event_type, data, room=room)
 
 def send_to_user(user_id, event_type, data):
     """Send event to a specific user"""
     try:
         room = f"user_{user_id}"
-        socketio.emit(event_type, data, room=room)
+
+        # Sequence and buffer the event so a reconnecting client can get it replayed
+        if isinstance(data, dict):
+            seq = event_buffer.record(user_id, event_type, data)
+            data = dict(data, seq=seq, epoch=event_buffer.epoch)
+
+        publish_event(event_type, data, room=room)
         logger.debug(f"Sent {event_type} to user {user_id}")
         return True
     except Exception as e:
         logger.error(f"Error sending {event_type} to user {user_id}: {str(e)}")
         return False
 
+def send_to_users(user_ids, event_type, data):
+    """Send event to several users, each with their own sequence number"""
+    sent = True
+    for user_id in user_ids:
+        sent = send_to_user(user_id, event_type, data) and sent
+    return sent
+
 def broadcast_to_friends(user_id, event_type, data, friends_list=None):
     """Broadcast event to user's friends"""
     try:
@@ -200,7 +283,7 @@ def notify_new_post(post_id, user_id, author_name):
         'post_id': post_id,
         'user_id': user_id,
         'author': author_name,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.utcnow().isoformat()
     }
     return broadcast_to_friends(user_id, 'message', data)
 
@@ -212,7 +295,7 @@ def notify_new_comment(comment_id, post_id, user_id, author_name, post_author_id
         'post_id': post_id,
         'user_id': user_id,
         'author': author_name,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.utcnow().isoformat()
     }
 
     # Send to post author
@@ -231,7 +314,7 @@ def notify_new_like(post_id, user_id, post_author_id, like_count):
         'post_id': post_id,
         'user_id': user_id,
         'like_count': like_count,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.utcnow().isoformat()
     }
 
     # Send to post author